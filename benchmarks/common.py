@@ -0,0 +1,115 @@
+"""
+Data shared by the benchmarks: checked-in parse trees and rule sets built from
+the patterns in examples/matching.py and examples/multimatch.py.
+"""
+import os
+
+from lango.trees import iter_parse_trees
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+TREES_PATH = os.path.join(DATA_DIR, 'trees.txt')
+
+
+def load_parses():
+    """Returns (sentence, bracketed parse) pairs of the checked-in trees"""
+    with open(TREES_PATH) as f:
+        parses = [parse.strip() for parse in f.read().split('\n\n') if parse.strip()]
+    sents = [' '.join(tree.leaves()) for tree in
+             iter_parse_trees('\n'.join(parses), strip_root=True)]
+    return list(zip(sents, parses))
+
+
+def load_trees(compact=False):
+    """Returns the checked-in trees without their ROOT nodes"""
+    with open(TREES_PATH) as f:
+        return list(iter_parse_trees(f.read(), compact=compact, strip_root=True))
+
+
+# Rules from examples/matching.py
+subj_obj_rules = {
+    'subj_t': {
+        '( NP ( PRP$:subject-o=my ) ( NN:relation-o ) )': {},
+        '( NP ( NP ( NNP:subject-o ) ( POS ) ) ( NN:relation-o ) )': {},
+        '( NP:subject-o )': {},
+    },
+    'obj_t': {
+        '( NP ( NP:item-O ) ( PP ( IN:item_in-O ) ( NP:item_addon-O ) ) )': {},
+        '( NP:item-O )': {},
+    }
+}
+
+matching_rules = {
+    '( S ( VP ( VB:action-o ) ( S ( NP:subj_t ) ( NP:obj_t ) ) ) )': subj_obj_rules,
+    '( S ( VP ( VB:action-o ) ( NP:subj_t ) ( NP:obj_t ) ) )': subj_obj_rules,
+}
+
+# Rules from examples/multimatch.py
+multimatch_rules = {
+    '( SBARQ ( WHNP/WHADVP:wh_t ) ( SQ ( VBZ ) ( NP:np_t ) ) )': {
+        'np_t': {
+            '( NP ( NP:subj-o ) ( PP ( IN:subj_in-o ) ( NP:obj-o ) ) )': {},
+            '( NP:subj-o )': {},
+        },
+        'wh_t': {
+            '( WHNP:whnp ( WDT ) ( NN:prop-o ) )': {},
+            '( WHNP/WHADVP:qtype-o )': {},
+        }
+    },
+    '( SBARQ:subj-o )': {},
+}
+
+pp_rules = {
+    '( PP ( TO=to ) ( NP:to_object-o ) )': {},
+    '( PP ( IN=from ) ( NP:from_object-o ) )': {},
+    '( PP ( IN:prep-o ) ( NP:prep_object-o ) )': {},
+}
+
+command_patterns = [
+    ('( S ( VP ( VB:action-o={0} ) ( S ( NP:subj_t ) ( NP:obj_t ) ) ) )',
+     subj_obj_rules),
+    ('( S ( VP ( VB:action-o={0} ) ( NP:subj_t ) ( NP:obj_t ) ) )',
+     subj_obj_rules),
+    ('( S ( VP ( VB:action-o={0} ) ( NP:obj_t ) ( PP:pp_t ) ) )',
+     {'obj_t': subj_obj_rules['obj_t'], 'pp_t': pp_rules}),
+    ('( S ( NP:subj_t ) ( VP ( VBD:action-o={0} ) ( PP:pp_t ) ) )',
+     {'subj_t': subj_obj_rules['subj_t'], 'pp_t': pp_rules}),
+]
+
+verbs = ['call', 'get', 'find', 'give', 'send', 'play', 'book', 'ran', 'walked']
+
+
+def command_rules(size):
+    """Returns a rules dictionary of size templates
+
+    Templates are the example patterns for many verbs, followed by the
+    multimatch rules. Verbs that occur in the checked-in trees come last, so
+    larger rule sets try more templates before matching.
+    """
+    count = size - len(multimatch_rules)
+    words = ['verb{0}'.format(i) for i in range(count)] + verbs
+    templates = [(template.format(word), child_rules)
+                 for word in words
+                 for template, child_rules in command_patterns]
+    rules = dict(templates[len(templates) - count:])
+    rules.update(multimatch_rules)
+    return rules
+
+
+def cross_rules(keys, alternatives):
+    """Returns rules with alternatives ** keys matches on the deep NP question
+
+    Each of the keys captured by the top template has alternatives sub-rules
+    that all match.
+    """
+    names = ['k0', 'k1', 'k2', 'k3', 'k4'][:keys]
+    labels = ['SBARQ', 'WHNP', 'SQ', 'VBZ', 'NP']
+    tokens = ['{0}:{1}'.format(label, name) if name else label
+              for label, name in zip(labels, names + [None] * 5)]
+    template = '( {0} ( {1} ) ( {2} ( {3} ) ( {4} ) ) )'.format(*tokens)
+    return {
+        template: {
+            name: {'( .:{0}_{1}-o )'.format(name, i): {}
+                   for i in range(alternatives)}
+            for name in names
+        }
+    }
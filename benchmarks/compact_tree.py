@@ -0,0 +1,52 @@
+"""
+Compares memory use and matching speed of nltk Trees and CompactTrees.
+
+Usage: python benchmarks/compact_tree.py [number of trees]
+"""
+import sys
+import time
+import tracemalloc
+
+from nltk import Tree
+from lango.matcher import compile_rules, match_rules
+from lango.trees import CompactTree
+
+from common import load_parses, matching_rules, multimatch_rules
+
+rules = compile_rules(dict(matching_rules, **multimatch_rules))
+
+
+def measure(name, build):
+    tracemalloc.start()
+    start = time.time()
+    trees = build()
+    build_time = time.time() - start
+    memory = tracemalloc.get_traced_memory()[0]
+
+    for tree in trees:
+        match_rules(tree, rules, multi=True)
+    # Memory kept by the trees once they were matched, as with a stored corpus
+    matched_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.time()
+    for tree in trees:
+        match_rules(tree, rules, multi=True)
+    match_time = time.time() - start
+    print('{0:12} {1:8.1f} MB {2:8.1f} MB after match {3:6.0f} bytes/tree '
+          'build {4:.2f}s match {5:.2f}s'.format(
+              name, memory / 1e6, matched_memory / 1e6,
+              matched_memory / len(trees), build_time, match_time))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    parses = [parse for _, parse in load_parses()]
+    strings = [parses[i % len(parses)] for i in range(n)]
+    measure('nltk.Tree', lambda: [Tree.fromstring(s)[0] for s in strings])
+    measure('CompactTree', lambda: [
+        CompactTree.from_tree(Tree.fromstring(s)[0]) for s in strings])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""
+Measures how match_corpus scales with the number of worker processes.
+
+Usage: python benchmarks/corpus_scaling.py [number of trees]
+"""
+import os
+import sys
+import time
+
+from lango.corpus import match_corpus
+
+from common import load_trees, matching_rules, multimatch_rules
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    data = load_trees()
+    trees = [data[i % len(data)] for i in range(n)]
+    rules = dict(matching_rules, **multimatch_rules)
+
+    base = None
+    workers = 1
+    while workers <= os.cpu_count():
+        start = time.time()
+        count = sum(1 for _ in match_corpus(trees, rules, multi=True,
+                                            workers=workers, chunksize=256))
+        elapsed = time.time() - start
+        base = base or elapsed
+        print('{0:2} workers: {1:.2f}s {2:8.0f} trees/s speedup {3:.2f}x'.format(
+            workers, elapsed, count / elapsed, base / elapsed))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
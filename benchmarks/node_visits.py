@@ -0,0 +1,55 @@
+"""
+Counts tree node visits of the 'index' and 'trie' matching engines for the
+rules in examples/multimatch.py and a larger grammar with shared prefixes.
+
+A node visit is counted every time the matcher reads the label of a node.
+
+Usage: python benchmarks/node_visits.py
+"""
+from nltk import Tree
+from lango.matcher import compile_rules, match_rules
+
+from common import TREES_PATH, multimatch_rules
+
+
+class CountingTree(Tree):
+    visits = 0
+
+    def label(self):
+        CountingTree.visits += 1
+        return Tree.label(self)
+
+
+command_sent = (
+    '(S (VP (VB Find) (S (NP (PRP me)) (NP (NP (DT a) (NN pizza)) (PP (IN with) '
+    '(NP (JJ extra) (NN cheese)))))) (. .))')
+
+# Many commands sharing the '( S ( VP ( VB:action-o ) ...' prefix
+verbs = ['call', 'get', 'find', 'give', 'order', 'book', 'play', 'send']
+command_rules = {}
+for verb in verbs:
+    command_rules['( S ( VP ( VB:action-o={0} ) ( NP:subj-o ) ) )'.format(verb)] = {}
+    command_rules['( S ( VP ( VB:action-o={0} ) ( S ( NP:subj-o ) ( NP:obj-o ) ) ) )'.format(verb)] = {}
+    command_rules['( S ( VP ( VB:action-o={0} ) ( NP:subj-o ) ( NP:obj-o ) ) )'.format(verb)] = {}
+command_rules['( S ( VP ( VB:action-o ) ( S ( NP:subj-o ) ( NP ( NP:obj-o ) ( PP:pp ) ) ) ) )'] = {}
+command_rules['( S ( VP ( VB:action-o ) ( S ( NP:subj-o ) ( NP:obj-o ) ) ) )'] = {}
+command_rules['( S:sent-r )'] = {}
+
+with open(TREES_PATH) as f:
+    # What religion is the President of the United States ?
+    multimatch_sent = f.read().split('\n\n')[4]
+
+for name, sent, rules in [
+        ('multimatch', multimatch_sent, multimatch_rules),
+        ('commands', command_sent, command_rules)]:
+    tree = CountingTree.fromstring(sent)
+    if tree.label() == 'ROOT':
+        tree = tree[0]
+    compiled = compile_rules(rules)
+    results = {}
+    for engine in ['index', 'trie']:
+        CountingTree.visits = 0
+        results[engine] = match_rules(tree, compiled, multi=True, engine=engine)
+        print('{0:12} {1:6} {2:4} node visits, {3} matches'.format(
+            name, engine, CountingTree.visits, len(results[engine])))
+    assert results['index'] == results['trie']
@@ -0,0 +1,351 @@
+"""
+Benchmark suite for the matcher and parser paths.
+
+Measures single match latency, multi match throughput, cross product blowup,
+parse round trip overhead against a stub CoreNLP server, memory use,
+loading of saved rules, import time, pipelined parsing and matching and
+reloading changed rules, and writes the results as JSON so they can be compared between releases.
+
+Usage:
+    python benchmarks/run.py [--quick] [--output results.json]
+                             [--compare baseline.json]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import lango
+from lango.matcher import (RuleSet, compile_rules, compile_template,
+                           iter_match_rules, load_rules, match_rules,
+                           save_rules)
+from lango.parser import ParseCache, ProcessParser, StanfordServerParser
+from lango.pipeline import Pipeline
+from lango.trees import parse_tree
+
+from common import (command_rules, cross_rules, load_parses, load_trees,
+                    matching_rules, multimatch_rules)
+from stub_server import StubCoreNLPServer
+
+ENGINES = ['index', 'trie']
+STUB_LEXPARSER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'stub_lexparser.py')
+
+
+def best_time(fun, number, repeat=3):
+    """Returns the best time in seconds of calling fun number times"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fun()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_single_match(scale):
+    """Latency of a first match over the checked-in trees per rule set size"""
+    trees = load_trees()
+    results = {}
+    for size in [10, 100, 1000]:
+        rules = compile_rules(command_rules(size))
+        for engine in ENGINES:
+            def run():
+                for tree in trees:
+                    match_rules(tree, rules, engine=engine)
+            run()
+            elapsed = best_time(run, scale)
+            results['rules_{0}_{1}_us'.format(size, engine)] = \
+                elapsed / (scale * len(trees)) * 1e6
+    return results
+
+
+def bench_multi_match(scale):
+    """Throughput of matching all rules over the checked-in trees"""
+    trees = load_trees()
+    compact_trees = load_trees(compact=True)
+    results = {}
+    rule_sets = [('examples', dict(matching_rules, **multimatch_rules)),
+                 ('rules_100', command_rules(100))]
+    for name, rules in rule_sets:
+        rules = compile_rules(rules)
+        for engine in ENGINES:
+            for tree_type, tree_list in [('tree', trees), ('compact', compact_trees)]:
+                def run():
+                    for tree in tree_list:
+                        match_rules(tree, rules, multi=True, engine=engine)
+                run()
+                elapsed = best_time(run, scale)
+                results['{0}_{1}_{2}_trees_per_s'.format(name, engine, tree_type)] = \
+                    scale * len(tree_list) / elapsed
+    return results
+
+
+def bench_cross_product(scale):
+    """Time to the first and to all matches of rules with many alternatives"""
+    tree = load_trees()[11]
+    results = {}
+    for keys, alternatives in [(3, 4), (4, 4), (5, 4)]:
+        rules = compile_rules(cross_rules(keys, alternatives))
+        name = '{0}x{1}'.format(keys, alternatives)
+        first = best_time(
+            lambda: list(iter_match_rules(tree, rules, limit=1)), scale)
+        full = best_time(lambda: match_rules(tree, rules, multi=True), 1)
+        results[name + '_first_us'] = first / scale * 1e6
+        results[name + '_all_ms'] = full * 1e3
+        results[name + '_matches'] = alternatives ** keys
+    return results
+
+
+def bench_parse_roundtrip(scale):
+    """Per sentence cost of parsing with the server client against a stub server
+    and with the process parser against a stub parser process"""
+    parses = load_parses()
+    sents = [sent for sent, _ in parses]
+    server = StubCoreNLPServer(parses).start()
+    results = {}
+    try:
+        parser = StanfordServerParser(port=server.port)
+        parser.parse(sents[0])
+
+        def parse_all():
+            for sent in sents:
+                parser.parse(sent)
+        elapsed = best_time(parse_all, scale)
+        results['parse_us'] = elapsed / (scale * len(sents)) * 1e6
+
+        elapsed = best_time(lambda: parser.parse_batch(sents), scale)
+        results['parse_batch_us'] = elapsed / (scale * len(sents)) * 1e6
+
+        cached = StanfordServerParser(port=server.port, cache=ParseCache())
+        for sent in sents:
+            cached.parse(sent)
+        elapsed = best_time(lambda: [cached.parse(sent) for sent in sents], scale)
+        results['parse_cached_us'] = elapsed / (scale * len(sents)) * 1e6
+
+        elapsed = best_time(
+            lambda: [parse_tree(parse) for _, parse in parses], scale)
+        results['build_tree_us'] = elapsed / (scale * len(sents)) * 1e6
+        results['parse_overhead_us'] = results['parse_us'] - results['build_tree_us']
+    finally:
+        server.stop()
+
+    process = ProcessParser([sys.executable, STUB_LEXPARSER])
+    try:
+        process.parse(sents[0])
+
+        def process_all():
+            for sent in sents:
+                process.parse(sent)
+        elapsed = best_time(process_all, scale)
+        results['process_parse_us'] = elapsed / (scale * len(sents)) * 1e6
+
+        elapsed = best_time(lambda: process.parse_batch(sents), scale)
+        results['process_batch_us'] = elapsed / (scale * len(sents)) * 1e6
+    finally:
+        process.close()
+    return results
+
+
+def bench_memory(scale):
+    """Memory per tree and of compiled rules"""
+    results = {}
+    copies = 100 * scale
+    for name, compact in [('tree', False), ('compact', True)]:
+        gc.collect()
+        tracemalloc.start()
+        trees = [load_trees(compact) for _ in range(copies)]
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[name + '_bytes_per_tree'] = memory / (copies * len(trees[0]))
+        del trees
+
+    gc.collect()
+    tracemalloc.start()
+    rules = compile_rules(command_rules(1000))
+    for tree in load_trees():
+        match_rules(tree, rules, multi=True, engine='trie')
+    results['compiled_rules_1000_bytes'] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return results
+
+
+def bench_rules_startup(scale):
+    """Time to compile rules from source and to load them from a saved artifact"""
+    results = {}
+    rules = command_rules(1000)
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        save_rules(rules, path)
+
+        def compile_fresh():
+            compile_template.cache_clear()
+            compile_rules(rules)
+        results['compile_1000_ms'] = best_time(compile_fresh, 1, 3 * scale) * 1e3
+        results['load_1000_ms'] = best_time(
+            lambda: load_rules(path), 1, 3 * scale) * 1e3
+        results['load_checked_1000_ms'] = best_time(
+            lambda: load_rules(path, rules), 1, 3 * scale) * 1e3
+        results['artifact_1000_bytes'] = os.path.getsize(path)
+    finally:
+        os.remove(path)
+    return results
+
+
+def bench_rules_reload(scale):
+    """Time to change one template of 1000 and update the matches of the
+    checked-in trees, from scratch and incrementally with a RuleSet"""
+    trees = load_trees()
+    rules = command_rules(1000)
+    template = list(rules)[len(rules) // 2]
+    changed = dict(rules)
+    changed[template.replace('( S', '( SQ', 1)] = changed.pop(template)
+    results = {}
+
+    def from_scratch():
+        compiled = compile_rules(changed)
+        [match_rules(tree, compiled) for tree in trees]
+    results['scratch_ms'] = best_time(from_scratch, 1, 3 * scale) * 1e3
+
+    ruleset = RuleSet(rules)
+    corpus = ruleset.track(trees)
+
+    def incremental():
+        ruleset.update(changed)
+        corpus.rematch()
+        ruleset.update(rules)
+        corpus.rematch()
+    results['incremental_ms'] = best_time(incremental, 1, 3 * scale) * 1e3 / 2
+
+    def replace():
+        ruleset.replace(template, changed_template)
+        corpus.rematch()
+        ruleset.replace(changed_template, template)
+        corpus.rematch()
+    changed_template = template.replace('( S', '( SQ', 1)
+    results['replace_ms'] = best_time(replace, 1, 3 * scale) * 1e3 / 2
+    return results
+
+
+def import_time(module):
+    """Returns the time in seconds to import a module in a new interpreter
+
+    Also returns the modules loaded by the import. Byte code is written on
+    the first import so compiling the sources is not measured.
+    """
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    code = 'import {0}, sys; print(" ".join(sys.modules))'.format(module)
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    for line in output.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1e6, output.stdout.split()
+
+
+def bench_import(scale):
+    """Time to import lango modules (and nltk for comparison) in a new interpreter"""
+    results = {}
+    for module in ['lango.matcher', 'lango.corpus', 'lango.parser',
+                   'lango.async_parser', 'nltk']:
+        import_time(module)
+        best = min(import_time(module)[0] for _ in range(3 * scale))
+        results[module.replace('.', '_') + '_ms'] = best * 1e3
+    for module in ['lango.matcher', 'lango.parser']:
+        loaded = import_time(module)[1]
+        results[module.replace('.', '_') + '_loads_nltk'] = int('nltk' in loaded)
+    return results
+
+
+def bench_pipeline(scale):
+    """Per sentence cost of parsing then matching one sentence at a time and
+    with a Pipeline, against a stub server taking 5ms per request"""
+    parses = load_parses()
+    sents = [sent for sent, _ in parses]
+    rules = compile_rules(matching_rules)
+    server = StubCoreNLPServer(parses, delay=0.005).start()
+    results = {}
+    try:
+        parser = StanfordServerParser(port=server.port)
+
+        def sequential():
+            for sent in sents:
+                match_rules(parser.parse(sent), rules)
+        elapsed = best_time(sequential, scale)
+        results['sequential_us'] = elapsed / (scale * len(sents)) * 1e6
+
+        with Pipeline(parser, rules, parse_workers=8) as pipeline:
+            elapsed = best_time(lambda: list(pipeline.run(sents)), scale)
+        results['pipeline_us'] = elapsed / (scale * len(sents)) * 1e6
+    finally:
+        server.stop()
+    return results
+
+
+BENCHMARKS = [
+    ('single_match', bench_single_match),
+    ('multi_match', bench_multi_match),
+    ('cross_product', bench_cross_product),
+    ('parse_roundtrip', bench_parse_roundtrip),
+    ('memory', bench_memory),
+    ('rules_startup', bench_rules_startup),
+    ('rules_reload', bench_rules_reload),
+    ('import', bench_import),
+    ('pipeline', bench_pipeline),
+]
+
+
+def compare(results, baseline):
+    """Prints the ratio of every result to the same result of a baseline run"""
+    print('\n{0:45} {1:>12} {2:>12} {3:>7}'.format(
+        'benchmark', 'baseline', 'current', 'ratio'))
+    for group, metrics in results['results'].items():
+        for metric, value in metrics.items():
+            old = baseline['results'].get(group, {}).get(metric)
+            if old:
+                print('{0:45} {1:12.2f} {2:12.2f} {3:7.2f}'.format(
+                    group + '.' + metric, old, value, value / old))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    arg_parser.add_argument('--quick', action='store_true',
+                            help='run fewer iterations')
+    arg_parser.add_argument('--output', help='path of the JSON results')
+    arg_parser.add_argument('--compare', help='JSON results to compare with')
+    args = arg_parser.parse_args()
+
+    scale = 1 if args.quick else 10
+    results = {
+        'lango_version': lango.__version__,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': {},
+    }
+    for name, benchmark in BENCHMARKS:
+        results['results'][name] = benchmark(scale)
+        for metric, value in results['results'][name].items():
+            print('{0:45} {1:12.2f}'.format(name + '.' + metric, value))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Stub Stanford LexicalizedParser process writing canned parses, for
+benchmarking ProcessParser without a JVM.
+
+Reads one sentence per line from standard input and writes its parse, pretty
+printed over several lines and followed by a blank line like the Stanford
+parser does.
+
+Usage: python benchmarks/stub_lexparser.py [--exit-on WORD] [--delay SECONDS]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from common import load_parses
+from lango.trees import parse_tree
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    arg_parser.add_argument('--exit-on', help='exit when a sentence has this word')
+    arg_parser.add_argument('--delay', type=float, default=0,
+                            help='seconds to wait before each parse')
+    args = arg_parser.parse_args()
+
+    parses = dict(load_parses())
+    sys.stderr.write('Loading parser from serialized file ... done\n')
+    for line in sys.stdin:
+        sent = ' '.join(line.split())
+        if not sent:
+            continue
+        if args.exit_on and args.exit_on in sent.split():
+            sys.exit(1)
+        if args.delay:
+            time.sleep(args.delay)
+        parse = parses.get(sent)
+        if parse is None:
+            parse = '(ROOT (S {0}))'.format(' '.join(
+                '(NN {0})'.format(word.replace('(', '-LRB-').replace(')', '-RRB-'))
+                for word in sent.split()))
+        sys.stdout.write(parse_tree(parse).pformat() + '\n\n')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Stub Stanford CoreNLP server returning canned parses, for benchmarking the
+parser clients without a JVM.
+
+Usage: python benchmarks/stub_server.py [port]
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import threading
+import time
+
+from common import load_parses
+
+
+class StubCoreNLPServer:
+    """CoreNLP server answering annotate requests with canned JSON
+
+    Every line of a request is a sentence. Known sentences get their canned
+    parse and other sentences get a flat parse of their words.
+
+    Args:
+        parses (list): (sentence, bracketed parse) pairs
+        port (int): Port to listen on (0 for any free port)
+        delay (float): Seconds to wait before answering each request
+        error_word (str): Requests with this word get an HTML error page
+        drop_connections (Bool): If True, closes every connection after its
+            response without telling the client, like an idle keep-alive
+            connection timing out on the server
+    """
+
+    def __init__(self, parses=None, port=0, delay=0, error_word=None,
+                 drop_connections=False):
+        self.parses = dict(load_parses() if parses is None else parses)
+        self.delay = delay
+        self.error_word = error_word
+        self.drop_connections = drop_connections
+        self.requests = 0
+        self.server = ThreadingHTTPServer(('localhost', port), self._handler())
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self._send(b'pong', 'text/plain')
+
+            def do_POST(self):
+                stub.requests += 1
+                length = int(self.headers.get('Content-Length', 0))
+                text = self.rfile.read(length).decode('utf-8')
+                if stub.delay:
+                    time.sleep(stub.delay)
+                if stub.error_word and stub.error_word in text.split():
+                    self._send(b'<html>Internal Server Error</html>',
+                               'text/html', 500)
+                    return
+                sentences = [{'index': i, 'parse': stub.parse(sent)}
+                             for i, sent in enumerate(text.split('\n'))
+                             if sent.strip()]
+                self._send(json.dumps({'sentences': sentences}).encode('utf-8'),
+                           'application/json')
+
+            def _send(self, body, content_type, status=200):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                if stub.drop_connections:
+                    self.close_connection = True
+
+        return Handler
+
+    def parse(self, sent):
+        sent = ' '.join(sent.split())
+        parse = self.parses.get(sent)
+        if parse is None:
+            words = [word.replace('(', '-LRB-').replace(')', '-RRB-')
+                     for word in sent.split()]
+            parse = '(ROOT (S {0}))'.format(
+                ' '.join('(NN {0})'.format(word) for word in words))
+        return parse
+
+    def start(self):
+        """Serves requests in a background thread"""
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 9000
+    server = StubCoreNLPServer(port=port)
+    print('Serving stub CoreNLP on port {0}'.format(server.port))
+    server.server.serve_forever()
@@ -0,0 +1,57 @@
+"""
+Compares building trees from bracketed parser output with nltk and with
+lango.trees.parse_tree for sentences of increasing length.
+
+Usage: python benchmarks/tree_parsing.py
+"""
+import random
+import timeit
+
+from nltk import Tree
+from nltk.parse.stanford import GenericStanfordParser
+from lango.trees import parse_tree
+
+random.seed(0)
+phrases = ['NP', 'VP', 'PP', 'S', 'SBAR', 'ADJP']
+tags = ['NN', 'NNS', 'NNP', 'VB', 'VBD', 'VBZ', 'IN', 'DT', 'JJ', 'PRP', 'RB']
+
+
+def make_tree(words):
+    """Random CoreNLP style pretty printed parse of a number of words"""
+    def build(n, depth):
+        if n == 1:
+            return '({0} w{1})'.format(random.choice(tags), random.randint(0, 999))
+        k = random.randint(1, min(3, n))
+        sizes = sorted(random.sample(range(1, n), k - 1)) if k > 1 else []
+        bounds = [0] + sizes + [n]
+        children = [build(b - a, depth + 1) for a, b in zip(bounds, bounds[1:])]
+        indent = '\n' + '  ' * (depth + 1)
+        return '({0}{1}{2})'.format(
+            random.choice(phrases), indent, indent.join(children))
+    return '(ROOT\n  {0})'.format(build(words, 1))
+
+
+class _Parser(GenericStanfordParser):
+    def __init__(self):
+        pass
+
+    def _make_tree(self, result):
+        return Tree.fromstring(result)
+
+
+nltk_parser = _Parser()
+
+for words in [10, 25, 50, 100]:
+    s = make_tree(words)
+    assert parse_tree(s) == Tree.fromstring(s)
+    number = 20000 // words
+    results = [
+        ('_parse_trees_output', lambda: next(next(
+            nltk_parser._parse_trees_output(s + '\n\n')))[0]),
+        ('Tree.fromstring', lambda: Tree.fromstring(s)),
+        ('parse_tree', lambda: parse_tree(s)),
+        ('parse_tree compact', lambda: parse_tree(s, compact=True)),
+    ]
+    for name, fun in results:
+        elapsed = timeit.timeit(fun, number=number) / number
+        print('{0:3} words {1:20} {2:8.1f} us'.format(words, name, elapsed * 1e6))
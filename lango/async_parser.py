@@ -0,0 +1,289 @@
+import asyncio
+import json
+import time
+from urllib.parse import quote
+
+from lango.parser import (Parser, ParseError, ServerUnavailableError,
+                          StanfordServerParser)
+
+
+class _ConnectionPool:
+    """Pool of keep-alive HTTP/1.1 connections to a single server
+
+    Args:
+        host (str): Server host
+        port (int): Server port
+        size (int): Maximum number of idle connections kept open
+    """
+
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.size = size
+        self._idle = []
+
+    async def request(self, path, body):
+        """Sends a POST request and returns (status, response body)
+
+        A request on a reused connection that the server has closed in the
+        meantime is retried once on a new connection.
+        """
+        while self._idle:
+            conn = self._idle.pop()
+            try:
+                return await self._request(conn, path, body)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                continue
+        conn = await asyncio.open_connection(self.host, self.port)
+        return await self._request(conn, path, body)
+
+    async def _request(self, conn, path, body):
+        reader, writer = conn
+        try:
+            writer.write((
+                'POST {0} HTTP/1.1\r\n'
+                'Host: {1}:{2}\r\n'
+                'Content-Type: text/plain; charset=utf-8\r\n'
+                'Content-Length: {3}\r\n'
+                'Connection: keep-alive\r\n'
+                '\r\n').format(path, self.host, self.port, len(body)).encode('ascii')
+                + body)
+            await writer.drain()
+
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError('Connection closed by server')
+            status = int(status_line.split()[1])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            if 'content-length' in headers:
+                data = await reader.readexactly(int(headers['content-length']))
+            elif headers.get('transfer-encoding', '').lower() == 'chunked':
+                chunks = []
+                while True:
+                    size = int((await reader.readline()).split(b';')[0], 16)
+                    if size == 0:
+                        await reader.readline()
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readline()
+                data = b''.join(chunks)
+            else:
+                data = await reader.read()
+                keep_alive = False
+        except BaseException:
+            writer.close()
+            raise
+
+        if keep_alive and len(self._idle) < self.size:
+            self._idle.append(conn)
+        else:
+            writer.close()
+        return status, data
+
+    def close(self):
+        """Closes all idle connections
+
+        Connections of an event loop that is already closed are dropped.
+        """
+        while self._idle:
+            _, writer = self._idle.pop()
+            try:
+                writer.close()
+            except RuntimeError:
+                pass
+
+
+class AsyncStanfordServerParser(Parser):
+    """Asyncio client for the Stanford CoreNLP server
+
+    Keeps a pool of keep-alive connections to the server and caps the number
+    of requests in flight. Connections belong to the event loop they were
+    opened in, so when the parser is used from a new event loop (such as
+    another asyncio.run) the idle ones are dropped.
+
+    Args:
+        host (str): Host of the CoreNLP server
+        port (int): Port of the CoreNLP server
+        properties (dict): CoreNLP annotation properties
+        cache (ParseCache): Cache of parsed trees (None to disable caching)
+        concurrency (int): Maximum number of requests in flight
+        timeout (float): Seconds before a request times out (None for no timeout)
+        metrics: See Parser
+    """
+
+    def __init__(self, host='localhost', port=9000, properties={},
+                 cache=None, concurrency=8, timeout=60, metrics=None):
+        Parser.__init__(self, cache, metrics)
+        self.url = 'http://{0}:{1}'.format(host, port)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self._pool = _ConnectionPool(host, port, concurrency)
+        self._semaphore = None
+        self._loop = None
+
+        if not properties:
+            self.properties = {
+                'annotators': 'parse',
+                'outputFormat': 'json',
+            }
+        else:
+            self.properties = properties
+
+    cache_properties = StanfordServerParser.cache_properties
+    _make_tree = StanfordServerParser._make_tree
+    _sentence_tree = StanfordServerParser._sentence_tree
+
+    async def _annotate(self, text, properties=None):
+        """Annotates text with the CoreNLP server
+
+        Args:
+            text (str): Text to annotate
+            properties (dict): CoreNLP properties (defaults to self.properties)
+        Returns:
+            dict: Decoded JSON output of the server
+        Raises:
+            ServerUnavailableError: If the server is down or timed out
+            ParseError: If the server did not return JSON
+        """
+        if properties is None:
+            properties = self.properties
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._pool.close()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._loop = loop
+        path = '/?properties=' + quote(json.dumps(properties))
+        body = text.encode('utf-8')
+
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                status, data = await asyncio.wait_for(
+                    self._pool.request(path, body), self.timeout)
+            except asyncio.TimeoutError:
+                self._emit_request(start, body, None, None, 'timeout')
+                raise ServerUnavailableError(
+                    'CoreNLP request timed out after {0}s'.format(self.timeout))
+            except OSError as e:
+                self._emit_request(start, body, None, None, 'connection')
+                raise ServerUnavailableError(
+                    'Check whether you have started the CoreNLP server: '
+                    '{0}'.format(e))
+        try:
+            output = json.loads(data.decode('utf-8'))
+        except ValueError:
+            self._emit_request(start, body, status, data, 'html')
+            raise ParseError('CoreNLP server did not return JSON: {0}'.format(
+                data[:200]))
+        self._emit_request(start, body, status, data, None)
+        return output
+
+    def _emit_request(self, start, body, status, data, error):
+        if self.metrics is not None:
+            self._emit('request', server=self.url,
+                       seconds=time.perf_counter() - start,
+                       request_bytes=len(body),
+                       response_bytes=len(data) if data is not None else 0,
+                       status=status, error=error)
+
+    async def parse(self, sent):
+        """Returns tree objects from a sentence
+
+        Args:
+            sent: Sentence to be parsed into a tree
+
+        Returns:
+            Tree object representing parsed sentence
+        Raises:
+            ParseError: If the server is down, timed out or returned an error
+        """
+        if self.metrics is None:
+            return await self._parse_cached(sent)
+
+        start = time.perf_counter()
+        try:
+            tree = await self._parse_cached(sent)
+        except Exception as e:
+            self._emit('parse', seconds=time.perf_counter() - start,
+                       empty=False, error=type(e).__name__)
+            raise
+        self._emit('parse', seconds=time.perf_counter() - start,
+                   empty=not tree, error=None)
+        return tree
+
+    async def _parse_cached(self, sent):
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(sent, self.cache_properties)
+            tree = self.cache.get(key)
+            self._emit('cache', hit=tree is not None)
+            if tree is not None:
+                return tree
+
+        output = await self._annotate(sent)
+        tree = self._sentence_tree(output['sentences'][0])
+        if key is not None:
+            self.cache.set(key, tree)
+        return tree
+
+    async def parse_many(self, sentences):
+        """Returns tree objects from many sentences parsed concurrently
+
+        Args:
+            sentences (list): Sentences to be parsed into trees
+
+        Returns:
+            list: Tree object for each sentence, or the ParseError raised
+            while parsing it
+        """
+        async def parse_or_error(sent):
+            try:
+                return await self.parse(sent)
+            except ParseError as e:
+                return e
+
+        return await asyncio.gather(*[parse_or_error(sent) for sent in sentences])
+
+    async def parse_all(self, text):
+        """Returns a tree for every sentence of a text
+
+        See StanfordServerParser.iter_parse_all
+
+        Args:
+            text (str): Text to be parsed
+
+        Returns:
+            list: Tree objects of the sentences in order
+        Raises:
+            ParseError: If the text could not be parsed
+        """
+        return [tree async for tree in self.iter_parse_all(text)]
+
+    async def iter_parse_all(self, text):
+        """Yields a tree for every sentence of a text
+
+        See StanfordServerParser.iter_parse_all
+
+        Args:
+            text (str): Text to be parsed
+
+        Yields:
+            Tree objects of the sentences in order
+        Raises:
+            ParseError: If the text could not be parsed
+        """
+        output = await self._annotate(text)
+        for sentence in output['sentences']:
+            yield self._sentence_tree(sentence)
+
+    def close(self):
+        """Closes the idle connections to the server"""
+        self._pool.close()
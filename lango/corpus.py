@@ -0,0 +1,334 @@
+"""
+Reading and matching of large corpora of parsed trees.
+"""
+from array import array
+from itertools import islice
+import json
+import logging
+import mmap
+from multiprocessing import Pool
+import os
+import re
+import struct
+
+from lango.matcher import compile_rules, match_rules
+from lango.trees import CompactTreeBuilder, parse_tree
+
+logger = logging.getLogger(__name__)
+
+_OPEN = '\x01'
+_CLOSE = '\x02'
+_SEP = '\x00'
+
+
+def encode_tree(tree):
+    """Encodes a tree into a compact string for sending to other processes
+
+    Args:
+        tree (Tree): Parsed tree structure
+    Returns:
+        str: Encoded tree (see decode_tree)
+    """
+    tokens = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if node is _CLOSE:
+            tokens.append(_CLOSE)
+        elif not isinstance(node, str):
+            tokens.append(_OPEN + node.label())
+            stack.append(_CLOSE)
+            stack.extend(reversed(node))
+        else:
+            tokens.append(node)
+    return _SEP.join(tokens)
+
+
+def decode_tree(data):
+    """Decodes a tree encoded by encode_tree
+
+    The tree is decoded into a CompactTree, so worker processes do not import
+    nltk or build a Tree object per node.
+
+    Args:
+        data (str): Encoded tree
+    Returns:
+        CompactTree: Parsed tree structure
+    """
+    builder = CompactTreeBuilder()
+    for token in data.split(_SEP):
+        if token == _CLOSE:
+            builder.close()
+        elif token[:1] == _OPEN:
+            builder.open(token[1:])
+        else:
+            builder.leaf(token)
+    return builder.build()
+
+
+_worker = {}
+
+
+def _init_worker(rules, fun, multi, engine):
+    _worker['args'] = (rules, fun, multi, engine)
+
+
+def _match_chunk(chunk):
+    rules, fun, multi, engine = _worker['args']
+    return [(i, match_rules(decode_tree(data), rules, fun, multi, engine))
+            for i, data in chunk]
+
+
+def _iter_chunks(trees, chunksize):
+    trees = enumerate(trees)
+    while True:
+        chunk = [(i, encode_tree(tree)) for i, tree in islice(trees, chunksize)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def match_corpus(trees, rules, fun=None, multi=False, workers=None,
+                 chunksize=64, ordered=True, engine='index'):
+    """Matches many trees with the same rules using a pool of processes
+
+    The rules are compiled and sent to every worker process once. Trees are
+    streamed to the workers in chunks, encoded with encode_tree, so trees can
+    come from a generator over a corpus that does not fit in memory.
+
+    Args:
+        trees (iterable): Parsed tree structures
+        rules (dict): See match_rules
+        fun (function): See match_rules (must be a module level function)
+        multi (Bool): See match_rules
+        workers (int): Number of worker processes (None for one per CPU,
+            0 to match in this process)
+        chunksize (int): Number of trees sent to a worker at a time
+        ordered (Bool): If True, yields results in input order, else yields
+            (index, result) pairs as soon as their chunk completes
+        engine (str): See match_rules
+    Yields:
+        Results of match_rules for each tree
+    """
+    rules = compile_rules(rules)
+    chunks = _iter_chunks(trees, chunksize)
+
+    if workers == 0:
+        _init_worker(rules, fun, multi, engine)
+        for chunk in map(_match_chunk, chunks):
+            for i, result in chunk:
+                yield result if ordered else (i, result)
+        return
+
+    with Pool(workers, _init_worker, (rules, fun, multi, engine)) as pool:
+        if ordered:
+            results = pool.imap(_match_chunk, chunks)
+        else:
+            results = pool.imap_unordered(_match_chunk, chunks)
+        for chunk in results:
+            for i, result in chunk:
+                yield result if ordered else (i, result)
+
+
+_BRACKET_RE = re.compile(rb'[()]')
+_JSON_RE = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}]')
+_INDEX_MAGIC = b'LANGOIDX'
+_INDEX_VERSION = 1
+_INDEX_HEADER = struct.Struct('<8sIQQQ')
+
+
+class TreebankReader:
+    """Streams parse trees from a file of pre-parsed sentences
+
+    Reads bracketed trees (Penn Treebank or CoreNLP parse output, any
+    whitespace between trees) or CoreNLP JSON output as received by
+    StanfordServerParser (one or more JSON documents, each with a 'sentences'
+    list, pretty printed or one per line). The file is memory-mapped and trees
+    are parsed one at a time, so corpora larger than memory can be matched.
+
+    Random access by tree number uses an index of byte offsets, built on the
+    first full pass over the file and saved next to it (index_path) so later
+    readers can load it instead of scanning the file. Saving is best effort:
+    if the index cannot be written, for example next to a read-only corpus,
+    it is only kept in memory.
+
+    Args:
+        path (str): Path of the file
+        format (str): 'bracketed' or 'json' (None to guess from the extension)
+        index_path (str): Path of the index file (None for path + '.idx',
+            False to not save the index)
+        strip_root (Bool): Removes ROOT (or unlabeled) root nodes with one child,
+            like the parsers in lango.parser do
+        compact (Bool): If True, returns CompactTrees instead of Trees
+    """
+
+    def __init__(self, path, format=None, index_path=None, strip_root=True,
+                 compact=False):
+        if format is None:
+            format = 'json' if path.endswith(('.json', '.jsonl')) else 'bracketed'
+        if format not in ('bracketed', 'json'):
+            raise ValueError('Unknown treebank format: ' + str(format))
+        self.path = path
+        self.format = format
+        self.index_path = path + '.idx' if index_path is None else index_path
+        self.strip_root = strip_root
+        self.compact = compact
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._index = None
+        # (start, sentences) of the last JSON document read by _parse
+        self._document = (None, None)
+        self._load_index()
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _spans(self):
+        """Yields (start, end) byte offsets of every bracketed tree or JSON document"""
+        depth = 0
+        start = 0
+        if self.format == 'bracketed':
+            for m in _BRACKET_RE.finditer(self._mm):
+                if m.group() == b'(':
+                    if depth == 0:
+                        start = m.start()
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        yield start, m.end()
+                    elif depth < 0:
+                        raise ValueError('Bracket mismatch at byte {0} of {1}'.format(
+                            m.start(), self.path))
+        else:
+            for m in _JSON_RE.finditer(self._mm):
+                token = m.group()
+                if token == b'{':
+                    if depth == 0:
+                        start = m.start()
+                    depth += 1
+                elif token == b'}':
+                    depth -= 1
+                    if depth == 0:
+                        yield start, m.end()
+        if depth > 0:
+            raise ValueError('Truncated tree at byte {0} of {1}'.format(
+                start, self.path))
+
+    def _iter_scan(self):
+        """Yields (start, end, sentence number, parse string) of every tree"""
+        for start, end in self._spans():
+            data = self._mm[start:end].decode('utf-8')
+            if self.format == 'bracketed':
+                yield start, end, 0, data
+            else:
+                for k, sentence in enumerate(json.loads(data)['sentences']):
+                    yield start, end, k, sentence['parse']
+
+    def _make_tree(self, parse):
+        return parse_tree(parse, self.compact, self.strip_root)
+
+    def _parse(self, start, end, k):
+        """Returns the parse string of sentence k of the tree or document at start"""
+        if self.format == 'bracketed':
+            return self._mm[start:end].decode('utf-8')
+        # Sentences of a document are read in a row, so it is decoded once
+        document_start, sentences = self._document
+        if document_start != start:
+            sentences = json.loads(self._mm[start:end].decode('utf-8'))['sentences']
+            self._document = (start, sentences)
+        return sentences[k]['parse']
+
+    def __iter__(self):
+        """Yields every tree of the file in order"""
+        if self._index is not None:
+            for start, end, k in zip(*self._index):
+                yield self._make_tree(self._parse(start, end, k))
+            return
+
+        starts, ends, subs = array('Q'), array('Q'), array('I')
+        for start, end, k, parse in self._iter_scan():
+            starts.append(start)
+            ends.append(end)
+            subs.append(k)
+            yield self._make_tree(parse)
+        self._set_index(starts, ends, subs)
+
+    def build_index(self):
+        """Scans the whole file for the byte offsets of every tree"""
+        starts, ends, subs = array('Q'), array('Q'), array('I')
+        for start, end, k, _ in self._iter_scan():
+            starts.append(start)
+            ends.append(end)
+            subs.append(k)
+        self._set_index(starts, ends, subs)
+
+    def __len__(self):
+        if self._index is None:
+            self.build_index()
+        return len(self._index[0])
+
+    def __getitem__(self, i):
+        """Returns tree number i of the file"""
+        if self._index is None:
+            self.build_index()
+        starts, ends, subs = self._index
+        if i < 0:
+            i += len(starts)
+        return self._make_tree(self._parse(starts[i], ends[i], subs[i]))
+
+    def _stamp(self):
+        stat = os.stat(self.path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _set_index(self, starts, ends, subs):
+        self._index = (starts, ends, subs)
+        if not self.index_path:
+            return
+        size, mtime = self._stamp()
+        try:
+            with open(self.index_path, 'wb') as f:
+                f.write(_INDEX_HEADER.pack(
+                    _INDEX_MAGIC, _INDEX_VERSION, size, mtime, len(starts)))
+                starts.tofile(f)
+                ends.tofile(f)
+                subs.tofile(f)
+        except OSError as e:
+            logger.info('Could not save the index of %s: %s', self.path, e)
+            try:
+                os.remove(self.index_path)
+            except OSError:
+                pass
+
+    def _load_index(self):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return
+        try:
+            f = open(self.index_path, 'rb')
+        except OSError:
+            return
+        with f:
+            header = f.read(_INDEX_HEADER.size)
+            if len(header) != _INDEX_HEADER.size:
+                return
+            magic, version, size, mtime, n = _INDEX_HEADER.unpack(header)
+            if (magic, version) != (_INDEX_MAGIC, _INDEX_VERSION) or \
+                    (size, mtime) != self._stamp():
+                return
+            starts, ends, subs = array('Q'), array('Q'), array('I')
+            try:
+                starts.fromfile(f, n)
+                ends.fromfile(f, n)
+                subs.fromfile(f, n)
+            except EOFError:
+                return
+        self._index = (starts, ends, subs)
@@ -1,9 +1,64 @@
-from nltk import Tree
+from bisect import insort
+from collections import ChainMap, OrderedDict
+from functools import lru_cache
+from itertools import islice, product
+import json
 import logging
+import threading
+import time
+import warnings
+
+from lango.trees import CompactNode, CompactTree
 
 logger = logging.getLogger(__name__)
 
-def match_rules(tree, rules, fun=None, multi=False):
+
+class RuleError(Exception):
+    """Raised when a template or rules dictionary is invalid"""
+
+
+# Types of tree nodes, children of nodes that are not trees are words.
+# Other types following the tree protocol are added when first matched.
+_tree_types = (CompactNode, CompactTree)
+_checked_types = {}
+
+
+def register_tree_type(cls):
+    """Registers a class of tree nodes for matching
+
+    The matcher does not depend on nltk. A tree node is any object with a
+    label() method, len() and indexing of its children, where children are
+    tree nodes or word strings. nltk Trees and other classes following this
+    protocol are registered automatically the first time a tree of that class
+    is matched; register a class beforehand if its instances only appear as
+    children of trees of another class.
+
+    Args:
+        cls (type): Class of tree nodes
+    """
+    global _tree_types
+    if not issubclass(cls, _tree_types):
+        _tree_types = _tree_types + (cls,)
+    _checked_types[cls] = True
+
+
+def _is_tree(node):
+    """Check if node is a tree node, registering its class if it is new"""
+    if isinstance(node, _tree_types):
+        return True
+    cls = type(node)
+    res = _checked_types.get(cls)
+    if res is None:
+        res = (callable(getattr(cls, 'label', None)) and
+               hasattr(cls, '__len__') and hasattr(cls, '__getitem__'))
+        if res:
+            register_tree_type(cls)
+        else:
+            _checked_types[cls] = False
+    return res
+
+def match_rules(tree, rules, fun=None, multi=False, engine='index',
+                stats=None):
     """Matches a Tree structure with the given query rules.
 
     Query rules are represented as a dictionary of template to action.
@@ -14,62 +69,246 @@ def match_rules(tree, rules, fun=None, multi=False):
 
     Args:
         tree (Tree): Parsed tree structure
-        rules (dict): A dictionary of query rules
+        rules (dict): A dictionary of query rules or compiled rules
+            (see compile_rules)
         fun (function): Function to call with context (set to None if you want to return context)
+            or a BoundAction (see bind_action)
         multi (Bool): If True, returns all matched contexts, else returns first matched context
+        engine (str): 'index' to try candidate templates one by one or 'trie'
+            to match all templates of a rules level in a single walk
+            (see RuleTrie)
+        stats (MatchStats): Counters of the templates tried (see
+            lango.metrics.MatchStats), None to not count
     Returns:
         Contexts from matched rules
     """
     if multi:
-        context = match_rules_context_multi(tree, rules)
-    else:
-        context = match_rules_context(tree, rules)
-        if not context:
-            return None
+        return list(iter_match_rules(tree, rules, fun, engine=engine,
+                                     stats=stats))
+
+    context = _match_context(tree, _cached_rules(rules), {}, engine,
+                             ExtractCache(), stats)
+    if not context:
+        return None
 
     if fun:
-        args = fun.__code__.co_varnames
-        if multi:
-            res = []
-            for c in context:
-                action_context = {}
-                for arg in args:
-                    if arg in c:
-                        action_context[arg] = c[arg]
-                res.append(fun(**action_context))
-            return res
-        else:
-            action_context = {}
-            for arg in args:
-                if arg in context:
-                    action_context[arg] = context[arg]
-            return fun(**action_context)
+        return call_action(fun, context)
     else:
-        return context
+        return _materialize(context)
+
+def iter_match_rules(tree, rules, fun=None, limit=None, engine='index',
+                     stats=None):
+    """Lazily matches a Tree structure with all query rules.
+
+    Yields the same contexts in the same order as
+    ``match_rules(tree, rules, fun, multi=True)``, but each one is only
+    computed when it is requested. Contexts of nested rules share their parent
+    context instead of copying it, and are only turned into dictionaries when
+    yielded, so taking the first few results does not pay for the full cross
+    product of nested matches.
+
+    Args:
+        tree (Tree): Parsed tree structure
+        rules (dict): See match_rules
+        fun (function): Function to call with each context (set to None to yield contexts)
+        limit (int): Maximum number of results to yield (None for all)
+        engine (str): See match_rules
+        stats (MatchStats): See match_rules
+    Yields:
+        Contexts (or results of fun) from matched rules
+    """
+    contexts = _iter_contexts(
+        tree, _cached_rules(rules), ChainMap(), engine, ExtractCache(), stats)
+    if limit is not None:
+        contexts = islice(contexts, limit)
+    for context in contexts:
+        if fun:
+            yield call_action(fun, context)
+        else:
+            yield _materialize(context)
+
+def call_action(fun, context):
+    """Calls an action function with the arguments it takes from a context
+
+    Captured strings are only extracted for the arguments the function takes.
+
+    Args:
+        fun (function): Action function or BoundAction
+        context (dict): Matched context
+    Returns:
+        Result of fun
+    """
+    if isinstance(fun, BoundAction):
+        return fun(context)
+    params = _action_params(fun)[0]
+    return fun(**{arg: _value(context[arg]) for arg in params if arg in context})
+
+
+@lru_cache(maxsize=1024)
+def _action_params(fun):
+    """Returns (parameter names, required parameter names) of an action
+
+    Only parameters that can be passed by keyword are returned, local variables
+    and ``*args`` / ``**kwargs`` are not.
+    """
+    import inspect
+
+    params = []
+    required = []
+    for param in inspect.signature(fun).parameters.values():
+        if param.kind in (param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY):
+            params.append(param.name)
+            if param.default is param.empty:
+                required.append(param.name)
+    return tuple(params), frozenset(required)
+
+
+class BoundAction:
+    """Action function with its parameters resolved once (see bind_action)
+
+    Calling it with a matched context calls the function with the parameters
+    it takes from the context as keyword arguments.
+
+    Attributes:
+        fun (function): Action function
+        params (tuple): Names of the parameters taken from contexts
+        required (frozenset): Names of the parameters without default value
+        unsatisfied (list): (template, missing parameter names) for every
+            top level template of the rules that can never capture all
+            required parameters
+    """
+
+    def __init__(self, fun, params, required, unsatisfied):
+        self.fun = fun
+        self.params = params
+        self.required = required
+        self.unsatisfied = unsatisfied
+
+    def __call__(self, context):
+        return self.fun(**{arg: _value(context[arg]) for arg in self.params
+                           if arg in context})
+
+    def __repr__(self):
+        return 'BoundAction({0!r})'.format(self.fun)
+
 
-def match_rules_context(tree, rules, parent_context={}):
+def bind_action(fun, rules, strict=False):
+    """Resolves the parameters of an action against the captures of rules
+
+    The parameters of the action are looked up once instead of on every call,
+    and every top level template is checked against them: a template whose
+    matches, including the matches of its nested rules, can never capture all
+    parameters without default value would fail with a TypeError when its
+    action is called, so it is reported here instead.
+
+    Args:
+        fun (function): Action function
+        rules (dict): See match_rules
+        strict (Bool): If True, raises for unsatisfiable templates instead of
+            warning
+    Returns:
+        BoundAction: Action to pass as fun to match_rules
+    Raises:
+        ValueError: If strict and a template can never supply the required
+            parameters
+    """
+    params, required = _action_params(fun)
+    unsatisfied = []
+    memo = {}
+    for template, child_rules in compile_rules(rules).items():
+        covers = _entry_covers(template, child_rules, required, memo)
+        missing = min([required - cover for cover in covers] or [required],
+                      key=len)
+        if missing:
+            unsatisfied.append((template.template, sorted(missing)))
+
+    for template, missing in unsatisfied:
+        message = 'Template {0!r} never captures {1} of {2}'.format(
+            template, ', '.join(missing), getattr(fun, '__name__', fun))
+        if strict:
+            raise ValueError(message)
+        warnings.warn(message, stacklevel=2)
+    return BoundAction(fun, params, required, unsatisfied)
+
+
+def _token_captures(token):
+    names = set()
+    if token.name is not None:
+        names.add(token.name)
+    for child in token.children:
+        names |= _token_captures(child)
+    return names
+
+
+def _entry_covers(template, child_rules, required, memo):
+    """Returns the sets of required names captured by the matches of a rule
+
+    Every match of the template together with one match of each of its nested
+    rules captures some of the required names. Only the distinct subsets are
+    kept, so there are at most 2 ** len(required) of them.
+    """
+    own = frozenset(_token_captures(template.root) & required)
+    childss = [_rules_covers(rules, required, memo)
+               for rules in child_rules.values()]
+    return set(own.union(*children) for children in product(*childss))
+
+
+def _rules_covers(rules, required, memo):
+    key = id(rules)
+    if key not in memo:
+        covers = set()
+        for template, child_rules in rules.items():
+            covers |= _entry_covers(template, child_rules, required, memo)
+        memo[key] = covers
+    return memo[key]
+
+def match_rules_context(tree, rules, parent_context={}, engine='index',
+                        cache=None, stats=None):
     """Recursively matches a Tree structure with rules and returns context
 
     Args:
         tree (Tree): Parsed tree structure
         rules (dict): See match_rules
         parent_context (dict): Context of parent call
+        engine (str): See match_rules
+        cache (ExtractCache): Strings extracted from the tree so far
+        stats (MatchStats): See match_rules
     Returns:
         dict: Context matched dictionary of matched rules or
         None if no match
     """
-    for template, match_rules in rules.items():
+    if cache is None:
+        cache = ExtractCache()
+    context = _match_context(tree, _cached_rules(rules), parent_context, engine,
+                             cache, stats)
+    if context is None:
+        return None
+    return _materialize(context)
+
+def _match_context(tree, rules, parent_context, engine, cache, stats):
+    """Same as match_rules_context with captured strings not yet extracted"""
+    return _match_first(tree, rules, parent_context, engine, cache, stats)[1]
+
+def _match_first(tree, rules, parent_context, engine, cache, stats):
+    """Returns (first template matching the root, its context or None)
+
+    Only the first matching template is used, if its nested rules do not
+    match the context is None. The template is None if none matches.
+    """
+    for template, match_rules, args in rules.matches(tree, engine, cache, stats,
+                                                     lazy=True):
         context = parent_context.copy()
-        if match_template(tree, template, context):
-            for key, child_rules in match_rules.items():
-                child_context = match_rules_context(context[key], child_rules, context)
-                if child_context:
-                    for k, v in child_context.items():
-                        context[k] = v
-                else:
-                    return None
-            return context
-    return None
+        context.update(args)
+        for key, child_rules in match_rules.items():
+            child_context = _match_context(
+                _value(context[key]), child_rules, context, engine, cache, stats)
+            if child_context:
+                for k, v in child_context.items():
+                    context[k] = v
+            else:
+                return template, None
+        return template, context
+    return None, None
 
 def cross_context(contextss):
     """
@@ -92,29 +331,114 @@ def cross_context(contextss):
         product = tmp_product
     return product
 
-def match_rules_context_multi(tree, rules, parent_context={}):
+def match_rules_context_multi(tree, rules, parent_context={}, engine='index',
+                              stats=None):
     """Recursively matches a Tree structure with rules and returns context
 
     Args:
         tree (Tree): Parsed tree structure
         rules (dict): See match_rules
         parent_context (dict): Context of parent call
+        engine (str): See match_rules
+        stats (MatchStats): See match_rules
     Returns:
-        dict: Context matched dictionary of matched rules or
-        None if no match
+        list: Context matched dictionaries of all matched rules
     """
-    all_contexts = []
-    for template, match_rules in rules.items():
-        context = parent_context.copy()
-        if match_template(tree, template, context):
-            child_contextss = []
-            if not match_rules:
-                all_contexts += [context]
+    contexts = _iter_contexts(tree, _cached_rules(rules),
+                              ChainMap(parent_context), engine, ExtractCache(),
+                              stats)
+    return [_materialize(context) for context in contexts]
+
+def _iter_contexts(tree, rules, parent_context, engine, cache, stats=None):
+    """Lazy version of match_rules_context_multi yielding ChainMap contexts
+
+    A matched template's context is the parent context with the captured args
+    as a new child. Contexts of nested rules are combined as a ChainMap of the
+    nested contexts, which looks keys up in the same order as cross_context
+    merges them. Captured strings are not extracted yet (see _Capture).
+    """
+    for template, match_rules, args in rules.matches(tree, engine, cache, stats,
+                                                     lazy=True):
+        context = parent_context.new_child(args)
+        if not match_rules:
+            yield context
+            continue
+        child_contextss = []
+        for key, child_rules in match_rules.items():
+            child_contexts = _LazyList(_iter_contexts(
+                _value(context[key]), child_rules, context, engine, cache,
+                stats))
+            if not child_contexts.nonempty():
+                break
+            child_contextss.append(child_contexts)
+        else:
+            for contexts in _iter_cross(child_contextss):
+                yield ChainMap(*contexts)
+
+def _iter_cross(contextss):
+    """Lazy cross product in the order of cross_context (first varies fastest)"""
+    if not contextss:
+        yield ()
+        return
+    for c in contextss[-1]:
+        for rest in _iter_cross(contextss[:-1]):
+            yield rest + (c,)
+
+class _Capture:
+    """Reference to a captured subtree whose string is extracted on demand
+
+    Templates store captures with a format ('-r', '-R', '-o', '-O') as
+    _Capture while matching, so no string is built for templates that fail
+    after capturing or for arguments an action does not take. Captures are
+    extracted when a context is passed to an action or returned.
+    """
+    __slots__ = ('cache', 'opt', 'tree')
+
+    def __init__(self, cache, opt, tree):
+        self.cache = cache
+        self.opt = opt
+        self.tree = tree
+
+    def value(self):
+        return _extractors[self.opt](self.cache, self.tree)
+
+def _value(value):
+    """Extracts the string of a _Capture, other values are returned as is"""
+    if type(value) is _Capture:
+        return value.value()
+    return value
+
+def _materialize(context):
+    """Returns a context as a dictionary with every capture extracted"""
+    return {k: _value(v) for k, v in context.items()}
+
+class _LazyList:
+    """Re-iterable view of an iterator that only consumes it on demand"""
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+        self._items = []
+
+    def nonempty(self):
+        for _ in self:
+            return True
+        return False
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i < len(self._items):
+                yield self._items[i]
+            elif self._iterator is None:
+                return
             else:
-                for key, child_rules in match_rules.items():
-                    child_contextss.append(match_rules_context_multi(context[key], child_rules, context))
-                all_contexts += cross_context(child_contextss)    
-    return all_contexts
+                try:
+                    self._items.append(next(self._iterator))
+                except StopIteration:
+                    self._iterator = None
+                    return
+                continue
+            i += 1
 
 def match_template(tree, template, args=None):
     """Check if match string matches Tree structure
@@ -122,16 +446,18 @@ def match_template(tree, template, args=None):
     Args:
         tree (Tree): Parsed Tree structure of a sentence
         template (str): String template to match. Example: "( S ( NP ) )"
+            or a CompiledTemplate
     Returns:
         bool: If they match or not
     """
-    tokens = get_tokens(template.split())
+    if not isinstance(template, CompiledTemplate):
+        template = compile_template(template)
     cur_args = {}
-    if match_tokens(tree, tokens, cur_args):
+    if template.match(tree, cur_args, lazy=True):
         if args is not None:
             for k, v in cur_args.items():
-                args[k] = v
-        logger.debug('MATCHED: {0}'.format(template))
+                args[k] = _value(v)
+        logger.debug('MATCHED: %s', template.template)
         return True
     else:
         return False
@@ -165,7 +491,7 @@ def match_tokens(tree, tokens, args):
     if len(tokens) == 0:
         return True
 
-    if not isinstance(tree, Tree):
+    if not _is_tree(tree):
         return False
 
     root_token = tokens[0]
@@ -231,17 +557,1301 @@ def get_tokens(tokens):
         elif tokens[i] == ')':
             stack -= 1
             if stack < 0:
-                raise Exception('Bracket mismatch: ' + str(tokens))
+                raise RuleError('Bracket mismatch: ' + str(tokens))
             if stack == 0:
                 ret.append(get_tokens(tokens[start:i + 1]))
         else:
             if stack == 0:
                 ret.append(tokens[i])
     if stack != 0:
-        raise Exception('Bracket mismatch: ' + str(tokens))
+        raise RuleError('Bracket mismatch: ' + str(tokens))
     return ret
 
 
+class CompiledToken:
+    """Pre-parsed token of a template (see match_tokens for the syntax)
+
+    Attributes:
+        labels (frozenset): Labels the tree must have, None for wild card '.'
+        eq (frozenset): Lower case words the tree must equal, None if no '='
+        name (str): Capture name, None if not labeled
+        opt (str): Capture format ('r', 'R', 'o', 'O'), None to capture the tree
+        exact (int): Required number of children if ended with '$', else None
+        children (list): Child CompiledTokens
+
+    Captures with a format are stored in args as _Capture references, see
+    CompiledTemplate.match for the extracted strings.
+    """
+
+    def __init__(self, tokens):
+        if not tokens:
+            raise RuleError('Empty token tree: ( )')
+        root_token = tokens[0]
+        if not isinstance(root_token, str):
+            raise RuleError('Token tree must start with a tag: ' + str(tokens))
+        if '$' in tokens[:-1]:
+            raise RuleError('End symbol $ must be last: ' + str(tokens))
+        self.eq = None
+        self.name = None
+        self.opt = None
+
+        if root_token.find('=') >= 0:
+            self.eq = frozenset(root_token.split('=')[1].lower().split('|'))
+            root_token = root_token.split('=')[0]
+
+        if root_token.find(':') >= 0:
+            arg_tokens = root_token.split(':')[1].split('-')
+            self.name = arg_tokens[0]
+            if not self.name:
+                raise RuleError('Empty match label: ' + tokens[0])
+            if len(arg_tokens) > 1:
+                self.opt = arg_tokens[1]
+                if self.opt not in _extractors:
+                    raise RuleError('Unknown label option: ' + tokens[0])
+            root_token = root_token.split(':')[0]
+
+        if root_token == '.':
+            self.labels = None
+        else:
+            self.labels = frozenset(root_token.split('/'))
+
+        if tokens[-1] == '$':
+            self.exact = len(tokens) - 2
+            tokens = tokens[:-1]
+        else:
+            self.exact = None
+
+        self.children = [
+            CompiledToken(child if isinstance(child, list) else [child])
+            for child in tokens[1:]]
+
+    def match(self, tree, args, cache, counter=None):
+        """Check if the token and its children match the Tree structure
+
+        Args:
+            tree : Parsed tree structure
+            args (dict): Dictionary to store captured labels in
+            cache (ExtractCache): Strings extracted from the tree so far
+            counter (list): If given, the number of nodes visited is added to
+                counter[0] (see MatchStats)
+        Returns:
+            Boolean if they match or not
+        """
+        if counter is not None:
+            counter[0] += 1
+        if not isinstance(tree, _tree_types):
+            return False
+
+        if self.labels is not None and tree.label() not in self.labels:
+            return False
+
+        if self.exact is not None:
+            if len(tree) != self.exact:
+                return False
+        elif len(tree) < len(self.children):
+            return False
+
+        if self.eq is not None and cache.raw_lower(tree) not in self.eq:
+            return False
+
+        if self.name is not None:
+            if self.opt is None:
+                args[self.name] = tree
+            else:
+                args[self.name] = _Capture(cache, self.opt, tree)
+
+        for child, subtree in zip(self.children, tree):
+            if not child.match(subtree, args, cache, counter):
+                return False
+        return True
+
+
+class CompiledTemplate:
+    """Template string parsed once into a tree of CompiledTokens
+
+    Args:
+        template (str): String template. Example: "( S ( NP:np ) )"
+    Raises:
+        RuleError: If the template is not a valid token tree
+    """
+
+    def __init__(self, template):
+        self.template = template
+        tokens = template.split()
+        if len(tokens) < 2 or tokens[0] != '(' or tokens[-1] != ')':
+            raise RuleError(
+                'Template must be a token tree "( tag ... )" with spaces '
+                'around brackets: {0!r}'.format(template))
+        try:
+            self.root = CompiledToken(get_tokens(tokens))
+        except RuleError as e:
+            raise RuleError('{0} in template {1!r}'.format(e, template))
+
+    def match(self, tree, args, cache=None, lazy=False):
+        """Check if the template matches the Tree structure
+
+        Args:
+            tree (Tree): Parsed tree structure
+            args (dict): Dictionary to store captured labels in
+            cache (ExtractCache): Strings extracted from the tree so far
+            lazy (Bool): If True, captured strings are stored as _Capture
+                references to extract with _value
+        Returns:
+            bool: If they match or not
+        """
+        if cache is None:
+            cache = ExtractCache()
+        if not _is_tree(tree):
+            return False
+        res = self.root.match(tree, args, cache)
+        if not lazy:
+            for k, v in args.items():
+                if type(v) is _Capture:
+                    args[k] = v.value()
+        return res
+
+    def __repr__(self):
+        return 'CompiledTemplate({0!r})'.format(self.template)
+
+
+class CompiledRules:
+    """Rules dictionary with every template compiled (see compile_rules)
+
+    Behaves like the read-only rules dictionary it was compiled from, mapping
+    CompiledTemplate to a dictionary of subtemplate parameter to CompiledRules.
+
+    Templates are indexed by root label and by the label of their first child
+    so only templates that can match a tree are tried (see candidates).
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._by_label = {}
+        self._wild = []
+        for i, (template, _) in enumerate(entries):
+            labels = template.root.labels
+            if labels is None:
+                self._wild.append(i)
+            else:
+                for label in labels:
+                    self._by_label.setdefault(label, []).append(i)
+        self._candidates = {}
+        self._trie = None
+
+    def items(self):
+        return iter(self.entries)
+
+    def __iter__(self):
+        return (template for template, _ in self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __reduce__(self):
+        # Pickle the shared template and rules tables of a rules artifact
+        # (see dump_rules) instead of every token, index and cached candidate
+        return _load_rules, (_dump_rules(self),)
+
+    def candidates(self, tree):
+        """Get the rules that can match the root of a tree
+
+        Args:
+            tree (Tree): Parsed tree structure
+        Returns:
+            list: (CompiledTemplate, child rules) pairs in rule order
+        """
+        if not isinstance(tree, _tree_types) and not _is_tree(tree):
+            return []
+        label = tree.label()
+        child_label = None
+        if len(tree) and isinstance(tree[0], _tree_types):
+            child_label = tree[0].label()
+        key = (label, child_label)
+        candidates = self._candidates.get(key)
+        if candidates is None:
+            candidates = []
+            indices = self._by_label.get(label, [])
+            if self._wild:
+                indices = sorted(indices + self._wild)
+            for i in indices:
+                entry = self.entries[i]
+                children = entry[0].root.children
+                if children:
+                    if child_label is None:
+                        continue
+                    labels = children[0].labels
+                    if labels is not None and child_label not in labels:
+                        continue
+                candidates.append(entry)
+            self._candidates[key] = candidates
+        return candidates
+
+    @property
+    def trie(self):
+        """RuleTrie of the templates, built on first use"""
+        if self._trie is None:
+            self._trie = RuleTrie([template for template, _ in self.entries])
+        return self._trie
+
+    def matches(self, tree, engine='index', cache=None, stats=None,
+                lazy=False):
+        """Get the rules whose templates match the root of a tree
+
+        Args:
+            tree (Tree): Parsed tree structure
+            engine (str): See match_rules
+            cache (ExtractCache): Strings extracted from the tree so far
+            stats (MatchStats): See match_rules
+            lazy (Bool): See CompiledTemplate.match
+        Yields:
+            tuple: (CompiledTemplate, child rules, captured args) in rule order
+        """
+        if cache is None:
+            cache = ExtractCache()
+        if stats is not None:
+            matches = self._matches_counted(tree, engine, cache, stats)
+        elif engine == 'index':
+            matches = self._matches_index(tree, cache)
+        elif engine == 'trie':
+            matches = self._matches_trie(self.trie.match(tree, cache, lazy=True))
+        else:
+            raise ValueError('Unknown engine: ' + str(engine))
+        if lazy:
+            yield from matches
+        else:
+            for template, child_rules, args in matches:
+                yield template, child_rules, _materialize(args)
+
+    def _matches_index(self, tree, cache):
+        for template, child_rules in self.candidates(tree):
+            args = {}
+            if template.root.match(tree, args, cache):
+                logger.debug('MATCHED: %s', template.template)
+                yield template, child_rules, args
+
+    def _matches_trie(self, results):
+        for i, args in results:
+            template, child_rules = self.entries[i]
+            logger.debug('MATCHED: %s', template.template)
+            yield template, child_rules, args
+
+    def _matches_counted(self, tree, engine, cache, stats):
+        """Same as matches, counting every template tried in stats"""
+        if engine == 'index':
+            for template, child_rules in self.candidates(tree):
+                args = {}
+                counter = [0]
+                start = time.perf_counter()
+                matched = template.root.match(tree, args, cache, counter)
+                stats.record(template.template, matched, counter[0],
+                             time.perf_counter() - start)
+                if matched:
+                    logger.debug('MATCHED: %s', template.template)
+                    yield template, child_rules, args
+        elif engine == 'trie':
+            counter = [0]
+            start = time.perf_counter()
+            results = self.trie.match(tree, cache, counter, lazy=True)
+            stats.record_walk(counter[0], time.perf_counter() - start)
+            matched = set(i for i, _ in results)
+            for i, (template, _) in enumerate(self.entries):
+                stats.record(template.template, i in matched, 0, 0.0)
+            yield from self._matches_trie(results)
+        else:
+            raise ValueError('Unknown engine: ' + str(engine))
+
+
+class _TrieNode:
+    __slots__ = ('edges', 'terminals')
+
+    def __init__(self):
+        self.edges = {}
+        self.terminals = []
+
+
+class RuleTrie:
+    """Prefix trie of all templates of one rules level
+
+    Each template is flattened in preorder into checks on the node at a child
+    position path from the root: ``('node', path, labels, eq)`` checks the node
+    exists with the right label and words and ``('len', path, n)`` checks the
+    '$' end symbol. Templates sharing a prefix of checks share a path in the
+    trie, so a single walk of the tree reports every matching template and each
+    distinct check is evaluated at most once.
+
+    Args:
+        templates (list): CompiledTemplates in rule order
+    """
+
+    def __init__(self, templates):
+        self.root = _TrieNode()
+        self.captures = []
+        for i, template in enumerate(templates):
+            self.add(i, template)
+
+    def add(self, i, template):
+        """Adds a template at rule index i
+
+        Args:
+            i (int): Index of the template, the number of templates to add it
+                last or the index of a removed template
+            template (CompiledTemplate): Template to add
+        """
+        checks = []
+        captures = []
+        _flatten_token(template.root, (), checks, captures)
+        node = self.root
+        for check in checks:
+            child = node.edges.get(check)
+            if child is None:
+                child = node.edges[check] = _TrieNode()
+            node = child
+        node.terminals.append(i)
+        if i == len(self.captures):
+            self.captures.append(captures)
+        else:
+            self.captures[i] = captures
+
+    def remove(self, i, template):
+        """Removes the template at rule index i, pruning its unshared checks
+
+        The indices of the other templates are unchanged.
+
+        Args:
+            i (int): Index of the template
+            template (CompiledTemplate): Template at index i
+        """
+        checks = []
+        _flatten_token(template.root, (), checks, [])
+        path = [self.root]
+        for check in checks:
+            path.append(path[-1].edges[check])
+        path[-1].terminals.remove(i)
+        for check, node, parent in reversed(list(zip(checks, path[1:], path))):
+            if node.terminals or node.edges:
+                break
+            del parent.edges[check]
+        self.captures[i] = None
+
+    def match(self, tree, cache=None, counter=None, lazy=False):
+        """Match every template against a tree in a single walk
+
+        Args:
+            tree (Tree): Parsed tree structure
+            cache (ExtractCache): Strings extracted from the tree so far
+            counter (list): If given, the number of node checks evaluated is
+                added to counter[0]
+            lazy (Bool): See CompiledTemplate.match
+        Returns:
+            list: (template index, captured args) for every matching
+            template in rule order
+        """
+        if not isinstance(tree, _tree_types) and not _is_tree(tree):
+            return []
+        if cache is None:
+            cache = ExtractCache()
+        nodes = {(): tree}
+        results = {}
+        matched = []
+        stack = [self.root]
+        while stack:
+            trie_node = stack.pop()
+            matched.extend(trie_node.terminals)
+            for check, child in trie_node.edges.items():
+                result = results.get(check)
+                if result is None:
+                    result = results[check] = _test_check(check, nodes, cache)
+                if result:
+                    stack.append(child)
+        if counter is not None:
+            counter[0] += sum(1 for check in results if check[0] == 'node')
+
+        res = []
+        for i in sorted(matched):
+            args = {}
+            for path, name, opt in self.captures[i]:
+                node = nodes[path]
+                if opt is None:
+                    args[name] = node
+                elif lazy:
+                    args[name] = _Capture(cache, opt, node)
+                else:
+                    args[name] = _extractors[opt](cache, node)
+            res.append((i, args))
+        return res
+
+
+def _flatten_token(token, path, checks, captures):
+    checks.append(('node', path, token.labels, token.eq))
+    if token.exact is not None:
+        checks.append(('len', path, token.exact))
+    if token.name is not None:
+        captures.append((path, token.name, token.opt))
+    for i, child in enumerate(token.children):
+        _flatten_token(child, path + (i,), checks, captures)
+
+
+def _test_check(check, nodes, cache):
+    kind, path = check[0], check[1]
+    if kind == 'len':
+        return len(nodes[path]) == check[2]
+
+    if path:
+        parent = nodes.get(path[:-1])
+        node = None
+        if parent is not None and len(parent) > path[-1]:
+            node = parent[path[-1]]
+            if not isinstance(node, _tree_types):
+                node = None
+        nodes[path] = node
+    else:
+        node = nodes[path]
+    if node is None:
+        return False
+
+    labels, eq = check[2], check[3]
+    if labels is not None and node.label() not in labels:
+        return False
+    if eq is not None and cache.raw_lower(node) not in eq:
+        return False
+    return True
+
+
+@lru_cache(maxsize=4096)
+def compile_template(template):
+    """Compile a template string into a CompiledTemplate
+
+    Results are cached so the same template string is only parsed once.
+
+    Args:
+        template (str): String template. Example: "( S ( NP ) )"
+    Returns:
+        CompiledTemplate
+    Raises:
+        RuleError: If the template is not a valid token tree
+    """
+    return CompiledTemplate(template)
+
+
+def compile_rules(rules):
+    """Compile a rules dictionary once for repeated matching
+
+    The returned object can be passed anywhere a rules dictionary is accepted
+    and gives exactly the same results.
+
+    Args:
+        rules (dict): See match_rules
+    Returns:
+        CompiledRules: Compiled rules (returned as is if already compiled)
+    Raises:
+        RuleError: If a template is not a valid token tree
+    """
+    if isinstance(rules, CompiledRules):
+        return rules
+    return _compile_rules(rules, {})
+
+
+def _compile_rules(rules, memo):
+    """Compiles rules, compiling sub-rules shared by many templates once"""
+    compiled = memo.get(id(rules))
+    if compiled is not None:
+        return compiled
+    entries = []
+    for template, child_rules in rules.items():
+        children = {}
+        for key, sub_rules in child_rules.items():
+            if isinstance(sub_rules, CompiledRules):
+                children[key] = sub_rules
+            else:
+                children[key] = _compile_rules(sub_rules, memo)
+        entries.append((compile_template(template), children))
+    compiled = memo[id(rules)] = CompiledRules(entries)
+    return compiled
+
+
+# Compiled forms of the rules dictionaries matched last, so a dictionary that
+# is passed to match_rules on every call is only compiled again once changed
+_rules_cache = OrderedDict()
+_rules_cache_lock = threading.Lock()
+_RULES_CACHE_SIZE = 32
+
+
+def _rules_signature(rules):
+    """Returns the items of every dictionary in rules, to notice changes
+
+    Templates usually share their dictionaries of child rules, so each one is
+    only read once and comparing two signatures mostly compares identities.
+    """
+    signature = []
+    seen = set()
+    stack = [rules]
+    while stack:
+        rules = stack.pop()
+        signature.append(tuple(rules.items()))
+        for child_rules in {id(c): c for c in rules.values()}.values():
+            items = tuple(child_rules.items())
+            signature.append(items)
+            for _, sub_rules in items:
+                if id(sub_rules) not in seen:
+                    seen.add(id(sub_rules))
+                    stack.append(sub_rules)
+    return signature
+
+
+def _cached_rules(rules):
+    """Same as compile_rules, reusing the compiled form of an unchanged dict
+
+    The cache keeps the dictionaries it compiled alive, so their ids are not
+    reused, and compares their templates and keys at every call so changes
+    made in place are seen.
+    """
+    if isinstance(rules, CompiledRules):
+        return rules
+    key = id(rules)
+    signature = _rules_signature(rules)
+    with _rules_cache_lock:
+        cached = _rules_cache.get(key)
+        if cached is not None and cached[1] == signature:
+            _rules_cache.move_to_end(key)
+            return cached[2]
+    compiled = compile_rules(rules)
+    with _rules_cache_lock:
+        _rules_cache[key] = (rules, signature, compiled)
+        _rules_cache.move_to_end(key)
+        while len(_rules_cache) > _RULES_CACHE_SIZE:
+            _rules_cache.popitem(last=False)
+    return compiled
+
+
+class RuleSet(CompiledRules):
+    """Compiled rules that can be changed in place during a hot reload
+
+    Templates are added, removed and replaced one at a time and only the
+    templates changed are compiled. The label index and the cached
+    candidates of the labels of a changed template are updated in place, as
+    is the trie of the 'trie' engine if the other templates keep their
+    index (adding at the end, removing the last template or replacing one),
+    else it is rebuilt on its next use.
+
+    Every change is logged, so matches of a stored set of trees can be
+    updated by matching only the changed templates (see track)::
+
+        ruleset = RuleSet(rules)
+        corpus = ruleset.track(trees, fun)
+        ruleset.update(new_rules)
+        for i, old, new in corpus.rematch():
+            print(i, old, new)
+
+    A RuleSet can be passed anywhere a rules dictionary is accepted.
+
+    Args:
+        rules (dict): Initial rules, see match_rules (None for no rules)
+    Raises:
+        RuleError: If a template is not a valid token tree
+    """
+
+    def __init__(self, rules=None):
+        rules = compile_rules(rules or {})
+        super().__init__(list(rules.entries))
+        self._changes = []
+        self._entry_rules = {}
+        self._sources = {}
+        self._positions = None
+
+    def __reduce__(self):
+        return RuleSet, (CompiledRules(self.entries),)
+
+    @property
+    def version(self):
+        """Number of changes made to the rules so far"""
+        return len(self._changes)
+
+    def changed_since(self, version):
+        """Returns the template strings changed since a version
+
+        Args:
+            version (int): Earlier value of version
+        Returns:
+            set: Templates added, removed, replaced or moved since
+        """
+        return set(self._changes[version:])
+
+    def index(self, template):
+        """Returns the position of a template in rule order
+
+        Args:
+            template (str): Template string
+        Returns:
+            int: Position of the template
+        Raises:
+            KeyError: If the template is not in the rules
+        """
+        if self._positions is None:
+            self._positions = dict((compiled.template, i) for i, (compiled, _)
+                                   in enumerate(self.entries))
+        return self._positions[getattr(template, 'template', template)]
+
+    def __contains__(self, template):
+        try:
+            self.index(template)
+        except KeyError:
+            return False
+        return True
+
+    def add(self, template, child_rules=None, before=None):
+        """Adds a template
+
+        Args:
+            template (str): Template string
+            child_rules (dict): Dictionary of subtemplate parameter to rules
+                (see match_rules)
+            before (str): Template to add the template before (None to add
+                it last)
+        Raises:
+            ValueError: If the template is already in the rules
+            KeyError: If before is not in the rules
+            RuleError: If the template is not a valid token tree
+        """
+        if template in self:
+            raise ValueError('Template already in rules: ' + str(template))
+        i = len(self.entries) if before is None else self.index(before)
+        entry = (compile_template(template), _compile_children(child_rules))
+        self.entries.insert(i, entry)
+        if i < len(self.entries) - 1:
+            self._shift_index(i, 1)
+            self._trie = None
+            self._positions = None
+        else:
+            if self._trie is not None:
+                self._trie.add(i, entry[0])
+            self._positions[entry[0].template] = i
+        self._index_add(i, entry[0])
+        self._changed(entry[0])
+
+    def remove(self, template):
+        """Removes a template
+
+        Args:
+            template (str): Template string
+        Raises:
+            KeyError: If the template is not in the rules
+        """
+        i = self.index(template)
+        compiled = self.entries.pop(i)[0]
+        self._index_remove(i, compiled)
+        if i < len(self.entries):
+            self._shift_index(i + 1, -1)
+            self._trie = None
+            self._positions = None
+        else:
+            if self._trie is not None:
+                self._trie.remove(i, compiled)
+                self._trie.captures.pop()
+            del self._positions[compiled.template]
+        self._changed(compiled)
+
+    def replace(self, template, new_template=None, child_rules=None):
+        """Replaces a template or its child rules, keeping its position
+
+        Args:
+            template (str): Template string
+            new_template (str): New template string (None to keep it)
+            child_rules (dict): New child rules (None to keep them)
+        Raises:
+            KeyError: If the template is not in the rules
+            ValueError: If the new template is already in the rules
+            RuleError: If the new template is not a valid token tree
+        """
+        i = self.index(template)
+        old, old_children = self.entries[i]
+        new = old if new_template is None else compile_template(new_template)
+        if new is not old and new.template in self:
+            raise ValueError('Template already in rules: ' + new.template)
+        children = (old_children if child_rules is None
+                    else _compile_children(child_rules))
+        self.entries[i] = (new, children)
+        del self._positions[old.template]
+        self._positions[new.template] = i
+        self._index_remove(i, old)
+        self._index_add(i, new)
+        if self._trie is not None:
+            self._trie.remove(i, old)
+            self._trie.add(i, new)
+        self._changed(old)
+        self._changed(new)
+
+    def update(self, rules):
+        """Changes the rules into new rules, only changing templates that differ
+
+        Args:
+            rules (dict): New rules, see match_rules
+        Returns:
+            set: Templates added, removed, replaced or moved
+        Raises:
+            RuleError: If a template is not a valid token tree
+        """
+        version = self.version
+        new_entries = [(getattr(template, 'template', template), children)
+                       for template, children in rules.items()]
+        new_templates = set(template for template, _ in new_entries)
+        for template, _ in list(self.entries):
+            if template.template not in new_templates:
+                self.remove(template.template)
+
+        # Child rules are shared by many templates, so each is only
+        # converted once to be compared
+        sources = {}
+        for i, (template, children) in enumerate(new_entries):
+            if template not in self:
+                before = (self.entries[i][0].template
+                          if i < len(self.entries) else None)
+                self.add(template, children, before)
+                continue
+            j = self.index(template)
+            if j != i:
+                old_children = self.entries[j][1]
+                self.remove(template)
+                self.add(template, old_children, self.entries[i][0].template)
+            source = sources.get(id(children))
+            if source is None:
+                source = sources[id(children)] = _children_source(children)
+            if self._source(template) != source:
+                self.replace(template, child_rules=children)
+        return self.changed_since(version)
+
+    def _source(self, template):
+        """Returns the source of the child rules of a template to compare"""
+        source = self._sources.get(template)
+        if source is None:
+            source = self._sources[template] = _children_source(
+                self.entries[self.index(template)][1])
+        return source
+
+    def _changed(self, template):
+        self._changes.append(template.template)
+        self._entry_rules.pop(template.template, None)
+        self._sources.pop(template.template, None)
+
+    def _index_add(self, i, template):
+        labels = template.root.labels
+        if labels is None:
+            insort(self._wild, i)
+        else:
+            for label in labels:
+                insort(self._by_label.setdefault(label, []), i)
+        self._drop_candidates(labels)
+
+    def _index_remove(self, i, template):
+        labels = template.root.labels
+        if labels is None:
+            self._wild.remove(i)
+        else:
+            for label in labels:
+                indices = self._by_label[label]
+                indices.remove(i)
+                if not indices:
+                    del self._by_label[label]
+        self._drop_candidates(labels)
+
+    def _shift_index(self, start, offset):
+        """Adds offset to every indexed position from start on"""
+        for indices in list(self._by_label.values()) + [self._wild]:
+            for k, i in enumerate(indices):
+                if i >= start:
+                    indices[k] = i + offset
+
+    def _drop_candidates(self, labels):
+        """Forgets the cached candidates of trees with a root label in labels"""
+        for key in list(self._candidates):
+            if labels is None or key[0] in labels:
+                del self._candidates[key]
+
+    def _rules_of(self, template):
+        """Returns rules with only the entry of a template"""
+        rules = self._entry_rules.get(template)
+        if rules is None:
+            rules = self._entry_rules[template] = CompiledRules(
+                [self.entries[self.index(template)]])
+        return rules
+
+    def track(self, trees, fun=None, multi=False, engine='index'):
+        """Matches a set of trees, keeping what is needed to rematch them
+
+        Args:
+            trees (list): Trees, or a sequence of trees such as a
+                lango.corpus.TreebankReader
+            fun (function): See match_rules
+            multi (Bool): See match_rules
+            engine (str): See match_rules
+        Returns:
+            CorpusMatches: Results of match_rules for every tree
+        """
+        return CorpusMatches(self, trees, fun, multi, engine)
+
+
+def _compile_children(child_rules):
+    return dict((key, compile_rules(sub_rules))
+                for key, sub_rules in (child_rules or {}).items())
+
+
+def _children_source(children):
+    return [[key, _rules_source(sub_rules)] for key, sub_rules in children.items()]
+
+
+class CorpusMatches:
+    """Results of matching a set of trees with a RuleSet (see RuleSet.track)
+
+    After the rules change, rematch only matches the changed templates
+    against the trees that they can affect: with multi=False a tree is
+    matched with the changed templates ahead of its old first matching
+    template, and with the unchanged templates after it only if that
+    template changed. With multi=True the contexts of every template are
+    kept per tree and only the changed templates are matched.
+
+    Attributes:
+        rules (RuleSet): Rules the trees are matched with
+        trees (list): Matched trees
+        results (list): Result of match_rules for every tree
+    """
+
+    def __init__(self, rules, trees, fun=None, multi=False, engine='index'):
+        if not hasattr(trees, '__getitem__'):
+            trees = list(trees)
+        self.rules = rules
+        self.trees = trees
+        self.fun = fun
+        self.multi = multi
+        self.engine = engine
+        self.results = []
+        # Per tree, the template matched first (multi=False) or the results
+        # of every matched template (multi=True)
+        self._matched = []
+        for tree in trees:
+            if multi:
+                matched = self._match_all(tree)
+                self.results.append(
+                    [res for results in matched.values() for res in results])
+            else:
+                template, context = _match_first(
+                    tree, rules, {}, engine, ExtractCache(), None)
+                matched = template and template.template
+                self.results.append(self._result(template, context))
+            self._matched.append(matched)
+        self._snapshot()
+
+    def __len__(self):
+        return len(self.results)
+
+    def __getitem__(self, i):
+        return self.results[i]
+
+    def _snapshot(self):
+        self.version = self.rules.version
+        self._positions = dict(
+            (template.template, i) for i, template in enumerate(self.rules))
+
+    def _result(self, template, context):
+        if template is None or not context:
+            return None
+        if self.fun:
+            return call_action(self.fun, context)
+        return _materialize(context)
+
+    def _match_template(self, tree, template, cache):
+        """Returns the results of the matches of a single template"""
+        rules = self.rules._rules_of(template)
+        if self.multi:
+            contexts = _iter_contexts(
+                tree, rules, ChainMap(), self.engine, cache)
+            if self.fun:
+                return [call_action(self.fun, context) for context in contexts]
+            return [_materialize(context) for context in contexts]
+        return _match_first(tree, rules, {}, self.engine, cache, None)
+
+    def _match_all(self, tree):
+        cache = ExtractCache()
+        matched = {}
+        for template, _ in self.rules.candidates(tree):
+            results = self._match_template(tree, template.template, cache)
+            if results:
+                matched[template.template] = results
+        return matched
+
+    def rematch(self):
+        """Updates the results after the rules changed
+
+        Returns:
+            list: (tree index, old result, new result) for every tree whose
+            result changed
+        """
+        changed = self.rules.changed_since(self.version)
+        diff = []
+        if changed:
+            templates = [template.template for template in self.rules]
+            for i, tree in enumerate(self.trees):
+                old = self.results[i]
+                if self.multi:
+                    new = self._rematch_multi(i, tree, templates, changed)
+                else:
+                    new = self._rematch_first(i, tree, templates, changed)
+                if new != old:
+                    diff.append((i, old, new))
+                self.results[i] = new
+        self._snapshot()
+        return diff
+
+    def _rematch_first(self, i, tree, templates, changed):
+        matched = self._matched[i]
+        last = (len(self._positions) if matched is None
+                else self._positions[matched])
+        cache = ExtractCache()
+        for template in templates:
+            if template not in changed:
+                if template == matched:
+                    return self.results[i]
+                if self._positions[template] < last:
+                    # Known not to match the tree
+                    continue
+            compiled, context = self._match_template(tree, template, cache)
+            if compiled is not None:
+                self._matched[i] = template
+                return self._result(compiled, context)
+        self._matched[i] = None
+        return None
+
+    def _rematch_multi(self, i, tree, templates, changed):
+        old = self._matched[i]
+        cache = ExtractCache()
+        matched = {}
+        for template in templates:
+            if template in changed:
+                results = self._match_template(tree, template, cache)
+            else:
+                results = old.get(template)
+            if results:
+                matched[template] = results
+        self._matched[i] = matched
+        return [res for results in matched.values() for res in results]
+
+
+RULES_FORMAT = 'lango-rules'
+RULES_VERSION = 1
+
+
+def rules_checksum(rules):
+    """Returns the sha256 checksum of the templates and match labels of rules
+
+    Args:
+        rules (dict): See match_rules
+    Returns:
+        str: Hex digest, the same for a rules dictionary and its compiled rules
+    """
+    import hashlib
+
+    data = json.dumps(_rules_source(rules), separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _rules_source(rules):
+    source = []
+    for template, child_rules in rules.items():
+        template = getattr(template, 'template', template)
+        source.append([template, [[key, _rules_source(sub_rules)]
+                                  for key, sub_rules in child_rules.items()]])
+    return source
+
+
+def dump_rules(rules):
+    """Serializes compiled rules into a JSON compatible dictionary
+
+    Templates are stored already parsed, so load_rules does not parse them
+    again.
+
+    Args:
+        rules (dict): See match_rules
+    Returns:
+        dict: Artifact with the format version and the checksum of the rules
+    """
+    from lango import __version__
+    rules = compile_rules(rules)
+    return {
+        'format': RULES_FORMAT,
+        'version': RULES_VERSION,
+        'lango_version': __version__,
+        'checksum': rules_checksum(rules),
+        'rules': _dump_rules(rules),
+    }
+
+
+def save_rules(rules, path):
+    """Saves compiled rules to a JSON file (see dump_rules)
+
+    Args:
+        rules (dict): See match_rules
+        path (str): Path of the file
+    """
+    with open(path, 'w') as f:
+        json.dump(dump_rules(rules), f, separators=(',', ':'))
+
+
+def load_rules(data, rules=None):
+    """Loads compiled rules saved by save_rules or dump_rules
+
+    Args:
+        data: Path of a file written by save_rules or a dictionary returned
+            by dump_rules
+        rules (dict): Source rules the artifact must have been built from
+            (None to not check)
+    Returns:
+        CompiledRules
+    Raises:
+        RuleError: If the artifact has an unknown format or version, or was
+            not built from the given rules
+    """
+    if isinstance(data, str):
+        with open(data) as f:
+            data = json.load(f)
+    if data.get('format') != RULES_FORMAT or data.get('version') != RULES_VERSION:
+        raise RuleError('Unsupported rules artifact: format {0!r} version {1!r}'.format(
+            data.get('format'), data.get('version')))
+    if rules is not None and rules_checksum(rules) != data['checksum']:
+        raise RuleError('Rules artifact was built from different rules')
+    return _load_rules(data['rules'])
+
+
+def _dump_rules(rules):
+    """Returns the template and rules tables of an artifact
+
+    Every distinct template and every distinct nested rules dictionary is
+    stored once and referred to by its index, rules by ``[[template index,
+    [[match label, rules index], ...]], ...]``. The top level rules are last.
+    """
+    templates = []
+    template_ids = {}
+    tables = []
+    table_ids = {}
+
+    def dump(rules):
+        table = []
+        for template, child_rules in rules.items():
+            i = template_ids.get(template.template)
+            if i is None:
+                i = template_ids[template.template] = len(templates)
+                templates.append([template.template, _dump_token(template.root)])
+            table.append([i, [[key, dump(sub_rules)]
+                              for key, sub_rules in child_rules.items()]])
+        key = json.dumps(table, separators=(',', ':'))
+        j = table_ids.get(key)
+        if j is None:
+            j = table_ids[key] = len(tables)
+            tables.append(table)
+        return j
+
+    dump(rules)
+    return {'templates': templates, 'tables': tables}
+
+
+def _dump_token(token):
+    return [
+        sorted(token.labels) if token.labels is not None else None,
+        sorted(token.eq) if token.eq is not None else None,
+        token.name,
+        token.opt,
+        token.exact,
+        [_dump_token(child) for child in token.children],
+    ]
+
+
+def _load_rules(data):
+    templates = []
+    for template_string, token in data['templates']:
+        template = CompiledTemplate.__new__(CompiledTemplate)
+        template.template = template_string
+        template.root = _load_token(token)
+        templates.append(template)
+    tables = []
+    for table in data['tables']:
+        tables.append(CompiledRules([
+            (templates[i], dict((key, tables[j]) for key, j in children))
+            for i, children in table]))
+    return tables[-1]
+
+
+def _load_token(data):
+    labels, eq, name, opt, exact, children = data
+    if opt is not None and opt not in _extractors:
+        raise RuleError('Unknown label option in rules artifact: ' + opt)
+    token = CompiledToken.__new__(CompiledToken)
+    token.labels = frozenset(labels) if labels is not None else None
+    token.eq = frozenset(eq) if eq is not None else None
+    token.name = name
+    token.opt = opt
+    token.exact = exact
+    token.children = [_load_token(child) for child in children]
+    return token
+
+
+class RuleReport:
+    """Result of validate_rules
+
+    Rules are identified by their path from the top level rules, a tuple
+    alternating templates and match labels. Example:
+    ``('( S ( NP:np ) )', 'np', '( NP:subject-o )')``
+
+    Attributes:
+        errors (list): (path, message) for every invalid template or match
+            label, such rules can never match
+        shadowed (list): (path, shadowing template) for every template that
+            only matches trees an earlier template of the same rules also
+            matches, so it is never used by match_rules without multi
+        labels (dict): Path to the frozenset of labels a tree must contain
+            for the rule and its nested rules to match
+    """
+
+    def __init__(self):
+        self.errors = []
+        self.shadowed = []
+        self.labels = {}
+
+    def __bool__(self):
+        return not self.errors
+
+    def __repr__(self):
+        return 'RuleReport(errors={0}, shadowed={1}, rules={2})'.format(
+            len(self.errors), len(self.shadowed), len(self.labels))
+
+
+def validate_rules(rules, strict=False):
+    """Checks every template and match label of a rules dictionary
+
+    Finds the problems that would otherwise only show up when a tree reaches
+    them: invalid templates, match labels of nested rules that no template
+    captures (a KeyError when matching), match labels of captured strings
+    (never match), match labels without rules, and templates shadowed by an
+    earlier more general template. Also computes the labels each rule needs.
+
+    Run it once when the rules are loaded::
+
+        validate_rules(rules, strict=True)
+        compiled = compile_rules(rules)
+
+    Args:
+        rules (dict): See match_rules
+        strict (Bool): If True, raises on the first error
+    Returns:
+        RuleReport
+    Raises:
+        RuleError: If strict and there is an error
+    """
+    report = RuleReport()
+    _validate_rules(rules, (), {}, report)
+    if strict and report.errors:
+        path, message = report.errors[0]
+        raise RuleError('{0} at {1}'.format(message, ' -> '.join(path)))
+    return report
+
+
+def _validate_rules(rules, path, names, report):
+    """Validates one rules level
+
+    Args:
+        names (dict): Match labels captured by the enclosing templates to
+            their capture format
+    Returns:
+        frozenset: Labels needed by every rule of the level, None if there
+        are no valid rules
+    """
+    compiled = []
+    for template, child_rules in rules.items():
+        template_path = path + (getattr(template, 'template', template),)
+        if not isinstance(template, CompiledTemplate):
+            try:
+                template = compile_template(template)
+            except RuleError as e:
+                report.errors.append((template_path, str(e)))
+                continue
+
+        for earlier in compiled:
+            if _subsumes(earlier.root, template.root):
+                report.shadowed.append((template_path, earlier.template))
+                break
+        compiled.append(template)
+
+        captures = dict(names)
+        captures.update(_token_formats(template.root))
+        labels = set(_token_labels(template.root))
+        for key, sub_rules in child_rules.items():
+            key_path = template_path + (key,)
+            if key not in captures:
+                report.errors.append((key_path, 'Match label {0!r} is not '
+                                      'captured by the template'.format(key)))
+            elif captures[key] is not None:
+                report.errors.append((key_path, 'Match label {0!r} captures a '
+                                      'string, nested rules need a tree '
+                                      '(remove -{1})'.format(key, captures[key])))
+            if not len(sub_rules):
+                report.errors.append((key_path, 'Match label {0!r} has no '
+                                      'rules'.format(key)))
+            sub_labels = _validate_rules(sub_rules, key_path, captures, report)
+            if sub_labels:
+                labels |= sub_labels
+        report.labels[template_path] = frozenset(labels)
+
+    level = [report.labels[path + (template.template,)] for template in compiled]
+    if not level:
+        return None
+    return frozenset.intersection(*level)
+
+
+def _token_formats(token):
+    """Returns the capture names of a token tree to their capture format"""
+    formats = {}
+    stack = [token]
+    while stack:
+        token = stack.pop()
+        if token.name is not None:
+            formats[token.name] = token.opt
+        stack.extend(token.children)
+    return formats
+
+
+def _token_labels(token):
+    """Yields the labels every tree matching a token tree contains"""
+    if token.labels is not None and len(token.labels) == 1:
+        yield next(iter(token.labels))
+    for child in token.children:
+        for label in _token_labels(child):
+            yield label
+
+
+def _subsumes(general, specific):
+    """Check if every tree matching the specific token also matches the general one"""
+    if general.labels is not None and (
+            specific.labels is None or not specific.labels <= general.labels):
+        return False
+    if general.eq is not None and (
+            specific.eq is None or not specific.eq <= general.eq):
+        return False
+
+    n = len(general.children)
+    if general.exact is not None:
+        if specific.exact != general.exact:
+            return False
+    elif specific.exact is None:
+        if len(specific.children) < n:
+            return False
+    elif specific.exact < n:
+        return False
+
+    if len(specific.children) < n:
+        # Children the specific token does not constrain can be words
+        return False
+    for general_child, specific_child in zip(general.children, specific.children):
+        if not _subsumes(general_child, specific_child):
+            return False
+    return True
+
+
 def get_object(tree):
     """Get the object in the tree object.
     
@@ -256,7 +1866,9 @@ def get_object(tree):
     Returns:
         Resulting string of tree ``(Ex: "red car")``
     """
-    if isinstance(tree, Tree):
+    if isinstance(tree, (CompactNode, CompactTree)):
+        return tree.object()
+    if _is_tree(tree):
         if tree.label() == 'DT' or tree.label() == 'POS':
             return ''
         words = []
@@ -279,7 +1891,9 @@ def get_raw(tree):
     Returns:
         Resulting string of tree ``(Ex: "The red car")``
     """
-    if isinstance(tree, Tree):
+    if isinstance(tree, (CompactNode, CompactTree)):
+        return tree.raw()
+    if _is_tree(tree):
         words = []
         for child in tree:
             words.append(get_raw(child))
@@ -289,4 +1903,84 @@ def get_raw(tree):
 
 
 def get_raw_lower(tree):
-    return get_raw(tree).lower()
\ No newline at end of file
+    return get_raw(tree).lower()
+
+
+class ExtractCache:
+    """Strings extracted from the subtrees of a tree during a match
+
+    Extracting the raw words or the object of a tree reuses the strings of its
+    subtrees, so each subtree is rendered at most once per format no matter how
+    many templates capture or compare it. Subtrees are keyed by id (nodes of a
+    CompactTree by the id of the tree and their node id, since they are created
+    on every access), so a cache must only be used while the matched tree is
+    alive and should be thrown away after the match.
+    """
+
+    def __init__(self):
+        self._raw = {}
+        self._object = {}
+        self._lower = {}
+
+    @staticmethod
+    def _key(tree):
+        if isinstance(tree, CompactNode):
+            return id(tree.tree), tree.i
+        if isinstance(tree, CompactTree):
+            return id(tree), 0
+        return id(tree)
+
+    def raw(self, tree):
+        """Same as get_raw"""
+        if not isinstance(tree, _tree_types):
+            return tree
+        key = self._key(tree)
+        res = self._raw.get(key)
+        if res is None:
+            if isinstance(tree, (CompactNode, CompactTree)):
+                res = tree.raw()
+            else:
+                res = ' '.join([self.raw(child) for child in tree])
+            self._raw[key] = res
+        return res
+
+    def object(self, tree):
+        """Same as get_object"""
+        if not isinstance(tree, _tree_types):
+            return tree
+        key = self._key(tree)
+        res = self._object.get(key)
+        if res is None:
+            if isinstance(tree, (CompactNode, CompactTree)):
+                res = tree.object()
+            elif tree.label() == 'DT' or tree.label() == 'POS':
+                res = ''
+            else:
+                words = [self.object(child) for child in tree]
+                res = ' '.join([_f for _f in words if _f])
+            self._object[key] = res
+        return res
+
+    def raw_lower(self, tree):
+        """Same as get_raw_lower"""
+        key = ('r', self._key(tree))
+        res = self._lower.get(key)
+        if res is None:
+            res = self._lower[key] = self.raw(tree).lower()
+        return res
+
+    def object_lower(self, tree):
+        """Same as get_object_lower"""
+        key = ('o', self._key(tree))
+        res = self._lower.get(key)
+        if res is None:
+            res = self._lower[key] = self.object(tree).lower()
+        return res
+
+
+_extractors = {
+    'r': ExtractCache.raw_lower,
+    'R': ExtractCache.raw,
+    'o': ExtractCache.object_lower,
+    'O': ExtractCache.object,
+}
@@ -0,0 +1,311 @@
+"""
+Instrumentation of matching and parsing.
+"""
+import threading
+
+
+def _escape(value):
+    """Escapes a Prometheus label value"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MatchStats:
+    """Per template counters of matching, collected when passed to match_rules
+
+    For every template, counts how often it was tried on a tree, how often it
+    matched, how many tree nodes it visited and the cumulative time spent
+    matching it::
+
+        stats = MatchStats()
+        for tree in trees:
+            match_rules(tree, rules, stats=stats)
+        print(stats.to_prometheus())
+
+    With the 'trie' engine all templates of a rules level are matched in a
+    single walk, so templates are counted as tried and matched but the nodes
+    visited and the time of the walk are counted per walk (see walks).
+
+    Attributes:
+        templates (dict): Template string to [tried, matched, nodes, seconds]
+        walks (list): [walks, nodes, seconds] of the 'trie' engine
+    """
+
+    def __init__(self):
+        self.templates = {}
+        self.walks = [0, 0, 0.0]
+
+    def record(self, template, matched, nodes, seconds):
+        """Counts a template being tried on a tree
+
+        Args:
+            template (str): Template string
+            matched (Bool): If the template matched
+            nodes (int): Number of tree nodes visited
+            seconds (float): Time spent matching
+        """
+        counts = self.templates.get(template)
+        if counts is None:
+            counts = self.templates[template] = [0, 0, 0, 0.0]
+        counts[0] += 1
+        if matched:
+            counts[1] += 1
+        counts[2] += nodes
+        counts[3] += seconds
+
+    def record_walk(self, nodes, seconds):
+        """Counts a walk of the 'trie' engine
+
+        Args:
+            nodes (int): Number of tree nodes checked
+            seconds (float): Time spent walking
+        """
+        self.walks[0] += 1
+        self.walks[1] += nodes
+        self.walks[2] += seconds
+
+    def reset(self):
+        """Clears all counters"""
+        self.templates.clear()
+        self.walks = [0, 0, 0.0]
+
+    def to_dict(self):
+        """Returns the counters as a dictionary
+
+        Returns:
+            dict: {'templates': {template: {'tried', 'matched', 'nodes',
+            'seconds'}}, 'trie': {'walks', 'nodes', 'seconds'}}
+        """
+        templates = {}
+        for template, (tried, matched, nodes, seconds) in self.templates.items():
+            templates[template] = {
+                'tried': tried,
+                'matched': matched,
+                'nodes': nodes,
+                'seconds': seconds,
+            }
+        walks, nodes, seconds = self.walks
+        return {
+            'templates': templates,
+            'trie': {'walks': walks, 'nodes': nodes, 'seconds': seconds},
+        }
+
+    def to_prometheus(self, prefix='lango_match'):
+        """Returns the counters in the Prometheus text exposition format
+
+        Args:
+            prefix (str): Prefix of the metric names
+        Returns:
+            str: One counter per template and metric
+        """
+        lines = []
+        metrics = [
+            ('tried_total', 'Number of times a template was tried'),
+            ('matched_total', 'Number of times a template matched'),
+            ('nodes_total', 'Number of tree nodes visited by a template'),
+            ('seconds_total', 'Time spent matching a template'),
+        ]
+        for k, (name, help) in enumerate(metrics):
+            name = prefix + '_' + name
+            lines.append('# HELP {0} {1}'.format(name, help))
+            lines.append('# TYPE {0} counter'.format(name))
+            for template, counts in self.templates.items():
+                lines.append('{0}{{template="{1}"}} {2}'.format(
+                    name, _escape(template), _format_number(counts[k])))
+
+        walks = [
+            ('trie_walks_total', 'Number of walks of the trie engine'),
+            ('trie_nodes_total', 'Number of tree nodes checked by the trie engine'),
+            ('trie_seconds_total', 'Time spent walking with the trie engine'),
+        ]
+        for k, (name, help) in enumerate(walks):
+            name = prefix + '_' + name
+            lines.append('# HELP {0} {1}'.format(name, help))
+            lines.append('# TYPE {0} counter'.format(name))
+            lines.append('{0} {1}'.format(name, _format_number(self.walks[k])))
+        return '\n'.join(lines) + '\n'
+
+
+class Histogram:
+    """Cumulative histogram of observed values
+
+    Args:
+        buckets (tuple): Increasing upper bounds of the buckets
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Adds a value to the histogram"""
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        return {
+            'buckets': dict(zip(self.buckets, self.counts)),
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+class ParseMetrics:
+    """Registry of parser metrics, collected when passed to a Parser
+
+    Parsers call their metrics with a dictionary for every event, so any
+    function taking a dictionary can be used instead to forward events to
+    another metrics system. Every event has the keys 'event' and 'parser'
+    (the parser class name). The events are:
+
+        'parse': A call to parse. Keys: 'seconds', 'empty' (True if parsing
+            failed and an empty tree was returned), 'error' (exception class
+            name if parse raised, else None)
+        'request': A request to a CoreNLP server. Keys: 'server', 'seconds',
+            'request_bytes', 'response_bytes', 'status' (None if there was no
+            response), 'error' (None, 'connection' (or parser process
+            exited), 'timeout' or 'html' for a response that is not JSON)
+        'retry': A request retried after a connection error or timeout.
+            Keys: 'server'
+        'eject': A server ejected from a ParserPool. Keys: 'server'
+        'restart': A parser process restarted by ProcessParser. Keys: 'server'
+        'cache': A lookup in the parse cache. Keys: 'hit'
+
+    ParseMetrics aggregates the events into latency histograms and counters::
+
+        metrics = ParseMetrics()
+        parser = StanfordServerParser(metrics=metrics)
+        ...
+        print(metrics.to_prometheus())
+
+    Args:
+        buckets (tuple): Upper bounds in seconds of the latency histograms
+    """
+
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                       5.0, 10.0, 30.0)
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clears all metrics"""
+        with self._lock:
+            self.parses = {}
+            self.requests = {}
+            self.counters = {}
+
+    def _count(self, name, labels, value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def __call__(self, event):
+        """Records an event (see the class docstring)"""
+        kind = event['event']
+        parser = event['parser']
+        with self._lock:
+            if kind == 'parse':
+                histogram = self.parses.get(parser)
+                if histogram is None:
+                    histogram = self.parses[parser] = Histogram(self.buckets)
+                histogram.observe(event['seconds'])
+                if event.get('empty'):
+                    self._count('empty_parses_total', (('parser', parser),))
+                if event.get('error'):
+                    self._count('parse_errors_total', (
+                        ('parser', parser), ('error', event['error'])))
+            elif kind == 'request':
+                server = event['server']
+                histogram = self.requests.get(server)
+                if histogram is None:
+                    histogram = self.requests[server] = Histogram(self.buckets)
+                histogram.observe(event['seconds'])
+                labels = (('server', server),)
+                self._count('request_bytes_total', labels, event['request_bytes'])
+                self._count('response_bytes_total', labels, event['response_bytes'])
+                if event.get('error'):
+                    self._count('request_errors_total', (
+                        ('server', server), ('error', event['error'])))
+            elif kind == 'retry':
+                self._count('retries_total', (('server', event['server']),))
+            elif kind == 'eject':
+                self._count('ejects_total', (('server', event['server']),))
+            elif kind == 'restart':
+                self._count('restarts_total', (('server', event['server']),))
+            elif kind == 'cache':
+                name = 'cache_hits_total' if event['hit'] else 'cache_misses_total'
+                self._count(name, (('parser', parser),))
+
+    def to_dict(self):
+        """Returns the metrics as a dictionary
+
+        Returns:
+            dict: {'parse_seconds': {parser: histogram}, 'request_seconds':
+            {server: histogram}, counter name: {labels: value}} where
+            labels are comma separated name=value pairs
+        """
+        with self._lock:
+            res = {
+                'parse_seconds': dict(
+                    (k, v.to_dict()) for k, v in self.parses.items()),
+                'request_seconds': dict(
+                    (k, v.to_dict()) for k, v in self.requests.items()),
+            }
+            for (name, labels), value in self.counters.items():
+                res.setdefault(name, {})[','.join(
+                    '{0}={1}'.format(k, v) for k, v in labels)] = value
+        return res
+
+    def to_prometheus(self, prefix='lango_parse'):
+        """Returns the metrics in the Prometheus text exposition format
+
+        Args:
+            prefix (str): Prefix of the metric names
+        Returns:
+            str: Latency histograms and counters
+        """
+        lines = []
+        with self._lock:
+            histograms = [
+                ('seconds', 'parser', self.parses, 'Latency of parse calls'),
+                ('request_seconds', 'server', self.requests,
+                 'Latency of requests to CoreNLP servers'),
+            ]
+            for name, label, histograms, help in histograms:
+                name = prefix + '_' + name
+                lines.append('# HELP {0} {1}'.format(name, help))
+                lines.append('# TYPE {0} histogram'.format(name))
+                for key, histogram in histograms.items():
+                    key = _escape(key)
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append('{0}_bucket{{{1}="{2}",le="{3}"}} {4}'.format(
+                            name, label, key, bound, count))
+                    lines.append('{0}_bucket{{{1}="{2}",le="+Inf"}} {3}'.format(
+                        name, label, key, histogram.count))
+                    lines.append('{0}_sum{{{1}="{2}"}} {3}'.format(
+                        name, label, key, repr(histogram.sum)))
+                    lines.append('{0}_count{{{1}="{2}"}} {3}'.format(
+                        name, label, key, histogram.count))
+
+            names = sorted(set(name for name, _ in self.counters))
+            for name in names:
+                full_name = prefix + '_' + name
+                lines.append('# TYPE {0} counter'.format(full_name))
+                for (counter, labels), value in self.counters.items():
+                    if counter == name:
+                        lines.append('{0}{{{1}}} {2}'.format(full_name, ','.join(
+                            '{0}="{1}"'.format(k, _escape(v)) for k, v in labels),
+                            value))
+        return '\n'.join(lines) + '\n'
@@ -1,25 +1,279 @@
-from nltk.parse.stanford import StanfordParser, GenericStanfordParser
-from nltk.internals import find_jars_within_path
-from nltk.tree import Tree
-from pycorenlp import StanfordCoreNLP
+"""
+Parsers of sentences into trees.
+
+The parser backends import nltk and requests when they are first created, so
+importing this module does not load them.
+"""
+from collections import OrderedDict
+from functools import lru_cache
+import json
+import os
+import queue
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from lango.trees import parse_tree, tree_class
+
+
+class ParseError(Exception):
+    """Raised when a sentence could not be parsed"""
+
+
+class ServerUnavailableError(ParseError):
+    """Raised when a CoreNLP server could not be reached or timed out"""
+
+
+class ParseCache:
+    """In-process LRU cache of parsed trees with an optional persistent store
+
+    Trees are keyed on the whitespace normalized sentence and the properties
+    of the parser (see key). Cached trees are shared between callers and
+    should not be modified.
+
+    Args:
+        maxsize (int): Maximum number of trees kept in memory
+        ttl (float): Seconds before a cached tree expires (None to never expire)
+        store: Persistent store with get(key) and set(key, value) methods
+            such as SqliteParseStore (None for in-process only)
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, store=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(sent, properties=None):
+        """Returns the cache key of a sentence
+
+        Args:
+            sent (str): Sentence to be parsed
+            properties (dict): Properties of the parser
+        Returns:
+            str: Cache key
+        """
+        return '{0}\n{1}'.format(
+            json.dumps(properties or {}, sort_keys=True), ' '.join(sent.split()))
+
+    def get(self, key):
+        """Returns the cached tree for a key or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            item = self._trees.get(key)
+            if item is not None:
+                tree, created = item
+                if self.ttl is None or now - created < self.ttl:
+                    self._trees.move_to_end(key)
+                    self.hits += 1
+                    return tree
+                del self._trees[key]
+
+        if self.store is not None:
+            item = self.store.get(key)
+            if item is not None:
+                value, created = item
+                if self.ttl is None or now - created < self.ttl:
+                    tree = parse_tree(value)
+                    self._put(key, tree, created)
+                    with self._lock:
+                        self.hits += 1
+                    return tree
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, tree):
+        """Caches a tree"""
+        created = time.time()
+        self._put(key, tree, created)
+        if self.store is not None:
+            self.store.set(key, tree.pformat(margin=sys.maxsize), created)
+
+    def _put(self, key, tree, created):
+        with self._lock:
+            self._trees[key] = (tree, created)
+            self._trees.move_to_end(key)
+            while len(self._trees) > self.maxsize:
+                self._trees.popitem(last=False)
+
+    def clear(self):
+        """Removes all trees kept in memory and resets the counters"""
+        with self._lock:
+            self._trees.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._trees)
+
+
+class SqliteParseStore:
+    """Persistent store of parsed trees for ParseCache in a sqlite file
+
+    Args:
+        path (str): Path of the sqlite database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS parses '
+                '(key TEXT PRIMARY KEY, tree TEXT, created REAL)')
+
+    def get(self, key):
+        """Returns (tree string, creation time) for a key or None"""
+        with self._lock:
+            return self._conn.execute(
+                'SELECT tree, created FROM parses WHERE key = ?',
+                (key,)).fetchone()
+
+    def set(self, key, value, created):
+        """Stores a tree string"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO parses VALUES (?, ?, ?)',
+                (key, value, created))
+
+    def close(self):
+        self._conn.close()
 
 
 class Parser:
-    """Abstract Parser class"""
-    def __init__():
-        pass
+    """Abstract Parser class
+
+    Args:
+        cache (ParseCache): Cache of parsed trees (None to disable caching)
+        metrics: Function called with a dictionary for every parse, request
+            and cache lookup such as lango.metrics.ParseMetrics (None to
+            disable metrics)
+    """
+    def __init__(self, cache=None, metrics=None):
+        self.cache = cache
+        self.metrics = metrics
+
+    def _emit(self, event, **fields):
+        """Sends an event to the metrics function if there is one"""
+        if self.metrics is not None:
+            fields['event'] = event
+            fields['parser'] = type(self).__name__
+            self.metrics(fields)
+
+    @property
+    def cache_properties(self):
+        """Properties that change the parse of a sentence for cache keys"""
+        return {'parser': type(self).__name__}
 
     def parse(self, sent):
+        """Returns tree objects from a sentence
+
+        Args:
+            sent: Sentence to be parsed into a tree
+
+        Returns:
+            Tree object representing parsed sentence
+        """
+        if self.metrics is None:
+            return self._parse_cached(sent)
+
+        start = time.perf_counter()
+        try:
+            tree = self._parse_cached(sent)
+        except Exception as e:
+            self._emit('parse', seconds=time.perf_counter() - start,
+                       empty=False, error=type(e).__name__)
+            raise
+        self._emit('parse', seconds=time.perf_counter() - start,
+                   empty=not tree, error=None)
+        return tree
+
+    def _parse_cached(self, sent):
+        if self.cache is None:
+            return self._parse(sent)
+
+        key = self.cache.key(sent, self.cache_properties)
+        tree = self.cache.get(key)
+        self._emit('cache', hit=tree is not None)
+        if tree is None:
+            tree = self._parse(sent)
+            # Do not cache empty trees from failed parses
+            if tree:
+                self.cache.set(key, tree)
+        return tree
+
+    def _parse(self, sent):
         pass
 
+    def parse_all(self, text):
+        """Returns a tree for every sentence of a text
+
+        Args:
+            text (str): Text to be parsed
+
+        Returns:
+            list: Tree objects of the sentences in order
+        Raises:
+            ParseError: If the text could not be parsed
+        """
+        return list(self.iter_parse_all(text))
+
+    def iter_parse_all(self, text):
+        """Yields a tree for every sentence of a text as soon as it is parsed
+
+        Each line of the text is parsed as a sentence with parse, parsers
+        that can split sentences or parse many at once override this.
+
+        Args:
+            text (str): Text to be parsed
+
+        Yields:
+            Tree objects of the sentences in order
+        Raises:
+            ParseError: If the text could not be parsed
+        """
+        for line in text.splitlines():
+            if line.strip():
+                yield self.parse(line)
+
+
+@lru_cache(maxsize=None)
+def _stanford_parser_class():
+    """Returns a StanfordParser building trees with lango.trees.parse_tree"""
+    from nltk.parse.stanford import StanfordParser
+
+    class _StanfordParser(StanfordParser):
+
+        def _make_tree(self, result):
+            return parse_tree(result)
+
+    return _StanfordParser
+
 
 class OldStanfordLibParser(Parser):
     """For StanfordParser < 3.6.0"""
 
-    def __init__(self):
-        self.parser = StanfordParser()
+    def __init__(self, cache=None, metrics=None):
+        Parser.__init__(self, cache, metrics)
+        self.parser = _stanford_parser_class()()
+
+    @property
+    def cache_properties(self):
+        return {
+            'parser': type(self).__name__,
+            'model': self.parser.model_path,
+        }
 
-    def parse(self, line):
+    def _parse(self, line):
         """Returns tree objects from a sentence
 
         Args:
@@ -33,21 +287,59 @@ class OldStanfordLibParser(Parser):
         tree = tree[0]
         return tree
 
+    def iter_parse_all(self, text):
+        """Yields a tree for every line of a text
+
+        All lines are parsed by a single run of the Stanford parser.
+
+        Args:
+            text (str): Text with one sentence per line
+
+        Yields:
+            Tree objects of the sentences in order
+        """
+        lines = [line for line in text.splitlines() if line.strip()]
+        for trees in self.parser.raw_parse_sents(lines):
+            yield next(iter(trees))[0]
+
 
 class StanfordLibParser(OldStanfordLibParser):
     """For StanfordParser == 3.6.0"""
-    def __init__(self):
-        self.parser = StanfordParser(
+    def __init__(self, cache=None, metrics=None):
+        from nltk.internals import find_jars_within_path
+
+        Parser.__init__(self, cache, metrics)
+        self.parser = _stanford_parser_class()(
             model_path='edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz')
         stanford_dir = self.parser._classpath[0].rpartition('/')[0]
         self.parser._classpath = tuple(find_jars_within_path(stanford_dir))
 
 
-class StanfordServerParser(Parser, GenericStanfordParser):
-    """Follow the readme to setup the Stanford CoreNLP server"""
-    def __init__(self, host='localhost', port=9000, properties={}):
-        url = 'http://{0}:{1}'.format(host, port)
-        self.nlp = StanfordCoreNLP(url)
+class StanfordServerParser(Parser):
+    """Follow the readme to setup the Stanford CoreNLP server
+
+    Args:
+        host (str): Host of the CoreNLP server
+        port (int): Port of the CoreNLP server
+        properties (dict): CoreNLP annotation properties
+        cache (ParseCache): Cache of parsed trees (None to disable caching)
+        batch_size (int): Number of sentences sent per request by parse_batch
+        timeout (float): Seconds before a request times out (None for no timeout)
+        retries (int): Number of times a request is retried after a
+            connection error or timeout
+        metrics: See Parser
+    """
+    def __init__(self, host='localhost', port=9000, properties={},
+                 cache=None, batch_size=50, timeout=None, retries=0,
+                 metrics=None):
+        import requests
+
+        Parser.__init__(self, cache, metrics)
+        self.url = 'http://{0}:{1}'.format(host, port)
+        self.session = requests.Session()
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.retries = retries
 
         if not properties:
             self.properties = {
@@ -57,16 +349,657 @@ class StanfordServerParser(Parser, GenericStanfordParser):
         else:
             self.properties = properties
 
+    @property
+    def cache_properties(self):
+        return self.properties
+
     def _make_tree(self, result):
-        return Tree.fromstring(result)
+        return parse_tree(result)
 
-    def parse(self, sent):
-        output = self.nlp.annotate(sent, properties=self.properties)
+    def _annotate(self, text, properties=None):
+        """Annotates text with the CoreNLP server
+
+        Args:
+            text (str): Text to annotate
+            properties (dict): CoreNLP properties (defaults to self.properties)
+        Returns:
+            dict: Decoded JSON output of the server
+        Raises:
+            ServerUnavailableError: If the server is down or timed out
+            ParseError: If the server did not return JSON
+        """
+        import requests
+
+        if properties is None:
+            properties = self.properties
+        params = {'properties': json.dumps(properties)}
+        data = text.encode('utf-8')
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._emit('retry', server=self.url)
+            start = time.perf_counter()
+            try:
+                r = self.session.post(self.url, params=params, data=data,
+                                      timeout=self.timeout)
+            except requests.exceptions.Timeout:
+                self._emit_request(start, data, None, 'timeout')
+                error = ServerUnavailableError(
+                    'CoreNLP request timed out after {0}s'.format(self.timeout))
+                continue
+            except requests.exceptions.ConnectionError:
+                self._emit_request(start, data, None, 'connection')
+                error = ServerUnavailableError(
+                    'Check whether you have started the CoreNLP server e.g.\n'
+                    '$ java -mx4g -cp "*" edu.stanford.nlp.pipeline.StanfordCoreNLPServer')
+                continue
+            try:
+                output = json.loads(r.content.decode('utf-8'))
+            except ValueError:
+                self._emit_request(start, data, r, 'html')
+                raise ParseError('CoreNLP server did not return JSON: {0}'.format(
+                    r.content[:200]))
+            self._emit_request(start, data, r, None)
+            return output
+        raise error
+
+    def _emit_request(self, start, data, response, error):
+        if self.metrics is not None:
+            self._emit('request', server=self.url,
+                       seconds=time.perf_counter() - start,
+                       request_bytes=len(data),
+                       response_bytes=len(response.content) if response is not None else 0,
+                       status=response.status_code if response is not None else None,
+                       error=error)
+
+    def _sentence_tree(self, sentence):
+        return parse_tree(sentence['parse'])[0]
+
+    def _parse(self, sent):
+        try:
+            output = self._annotate(sent)
+        except ServerUnavailableError:
+            raise
+        except ParseError:
+            # Got random html, return empty tree
+            return tree_class()('', [])
+
+        return self._sentence_tree(output['sentences'][0])
+
+    def iter_parse_all(self, text):
+        """Yields a tree for every sentence of a text
+
+        The text is split into sentences and parsed by the server in a single
+        request, and the tree of each sentence is built when it is reached,
+        so the first trees can be used before the others are built.
+
+        Args:
+            text (str): Text to be parsed
+
+        Yields:
+            Tree objects of the sentences in order
+        Raises:
+            ParseError: If the text could not be parsed
+        """
+        output = self._annotate(text)
+        for sentence in output['sentences']:
+            yield self._sentence_tree(sentence)
+
+    def parse_document(self, text):
+        """Same as parse_all"""
+        return self.parse_all(text)
+
+    def parse_batch(self, sentences, batch_size=None):
+        """Returns tree objects from many sentences
+
+        Sentences are sent to the server batch_size at a time, one sentence
+        per line, and the results are mapped back to the sentences in order.
+        If a batch fails, its sentences are parsed one by one so a bad
+        sentence does not fail the whole batch. If the server is down or
+        times out, the sentences not parsed yet all get the
+        ServerUnavailableError instead, without more requests.
+
+        Args:
+            sentences (list): Sentences to be parsed into trees
+            batch_size (int): Sentences per request (defaults to self.batch_size)
+
+        Returns:
+            list: Tree object for each sentence, or the ParseError raised
+            while parsing it
+        """
+        batch_size = batch_size or self.batch_size
+        results = [None] * len(sentences)
+        todo = []
+        for i, sent in enumerate(sentences):
+            sent = ' '.join(sent.split())
+            if not sent:
+                results[i] = ParseError('Empty sentence')
+                continue
+            if self.cache is not None:
+                tree = self.cache.get(self.cache.key(sent, self.cache_properties))
+                self._emit('cache', hit=tree is not None)
+                if tree is not None:
+                    results[i] = tree
+                    continue
+            todo.append((i, sent))
+
+        properties = dict(self.properties)
+        properties['ssplit.eolonly'] = 'true'
+        try:
+            for start in range(0, len(todo), batch_size):
+                batch = todo[start:start + batch_size]
+                try:
+                    output = self._annotate(
+                        '\n'.join([sent for _, sent in batch]), properties)
+                    if len(output['sentences']) != len(batch):
+                        raise ParseError('Sentence count mismatch')
+                    trees = [self._sentence_tree(sentence)
+                             for sentence in output['sentences']]
+                except ServerUnavailableError:
+                    raise
+                except (ParseError, KeyError, ValueError):
+                    trees = [self._parse_or_error(sent) for _, sent in batch]
+
+                for (i, sent), tree in zip(batch, trees):
+                    results[i] = tree
+                    if self.cache is not None and not isinstance(tree, ParseError):
+                        self.cache.set(
+                            self.cache.key(sent, self.cache_properties), tree)
+        except ServerUnavailableError as e:
+            # Every other request would wait for the server as well
+            for i, _ in todo:
+                if results[i] is None:
+                    results[i] = e
+        return results
+
+    def _parse_or_error(self, sent):
+        try:
+            output = self._annotate(sent)
+            sentences = output['sentences']
+            if not sentences:
+                raise ParseError('No sentence found: ' + sent)
+            return self._sentence_tree(sentences[0])
+        except ServerUnavailableError:
+            raise
+        except ParseError as e:
+            return e
+        except (KeyError, ValueError) as e:
+            return ParseError(str(e))
+
+
+class ProcessParser(Parser):
+    """Parses sentences with a long running child process
+
+    The process is started once and kept running. Sentences are written to
+    its standard input one per line, and it must write one bracketed tree per
+    sentence to its standard output, in order. Trees may span several lines
+    and lines between trees that do not start a tree are ignored.
+
+    If the process exits it is restarted and the sentences not parsed yet are
+    sent again. A sentence that takes longer than timeout to parse, or that
+    the process exits on twice in a row, fails with a ParseError.
+
+    Args:
+        command (list): Command line of the process
+        cache (ParseCache): Cache of parsed trees (None to disable caching)
+        timeout (float): Seconds to wait for the tree of a sentence
+        restarts (int): Maximum number of restarts in a row without parsing
+            a sentence before giving up on the remaining sentences of a call
+        encoding (str): Encoding of the standard input and output
+        stderr: Where the standard error of the process goes (see
+            subprocess.Popen, defaults to discarding it)
+        metrics: See Parser
+    """
+    def __init__(self, command, cache=None, timeout=60, restarts=3,
+                 encoding='utf-8', stderr=subprocess.DEVNULL, metrics=None):
+        Parser.__init__(self, cache, metrics)
+        self.command = command
+        self.timeout = timeout
+        self.restarts = restarts
+        self.encoding = encoding
+        self.stderr = stderr
+        self.starts = 0
+        self._process = None
+        self._trees = None
+        self._lock = threading.Lock()
+
+    @property
+    def cache_properties(self):
+        return {'parser': type(self).__name__, 'command': self.command}
+
+    def _start(self):
+        try:
+            self._process = subprocess.Popen(
+                self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=self.stderr)
+        except OSError as e:
+            raise ParseError('Could not start the parser process: {0}'.format(e))
+        self._trees = queue.Queue()
+        thread = threading.Thread(
+            target=self._read_trees,
+            args=(self._process.stdout, self._trees, self.encoding))
+        thread.daemon = True
+        thread.start()
+        self.starts += 1
+        if self.starts > 1:
+            self._emit('restart', server=self.command[0])
+
+    @staticmethod
+    def _read_trees(stdout, trees, encoding):
+        """Puts every tree written by the process in trees, then None"""
+        parts = []
+        depth = 0
+        for line in stdout:
+            line = line.decode(encoding, 'replace')
+            if not parts and not line.lstrip().startswith('('):
+                continue
+            parts.append(line)
+            depth += line.count('(') - line.count(')')
+            if depth <= 0:
+                trees.put(''.join(parts))
+                parts = []
+                depth = 0
+        trees.put(None)
+
+    def _stop(self):
+        if self._process is not None:
+            try:
+                self._process.kill()
+                self._process.wait()
+            except OSError:
+                pass
+            for pipe in (self._process.stdin, self._process.stdout):
+                try:
+                    pipe.close()
+                except OSError:
+                    pass
+            self._process = None
+
+    def close(self):
+        """Stops the process"""
+        with self._lock:
+            self._stop()
+
+    def _request(self, sentences):
+        """Parses sentences and returns a bracketed tree or ParseError for each
+
+        The process is used by a single call at a time.
+        """
+        with self._lock:
+            return list(self._iter_results(sentences))
+
+    def _iter_results(self, sentences):
+        """Parses sentences and yields a bracketed tree or ParseError for each
+
+        Must be run to the end with the lock held. If it is interrupted, the
+        process is stopped so the trees it has not read do not reach the next
+        call.
+        """
+        n = 0
+        restarts = 0
+        crashed_at = None
+        start = time.perf_counter()
+        try:
+            while n < len(sentences):
+                todo = sentences[n:]
+                if self._process is None or self._process.poll() is not None:
+                    if self._process is not None:
+                        restarts += 1
+                        if restarts > self.restarts:
+                            for _ in todo:
+                                n += 1
+                                yield ParseError('Parser process keeps exiting')
+                            break
+                        self._stop()
+                    self._start()
+                try:
+                    self._process.stdin.write(''.join(
+                        [sent + '\n' for sent in todo]).encode(self.encoding))
+                    self._process.stdin.flush()
+                except OSError:
+                    # The process closed its input, restart it
+                    self._process.kill()
+                    self._process.wait()
+                    continue
+
+                for _ in todo:
+                    try:
+                        tree = self._trees.get(timeout=self.timeout)
+                    except queue.Empty:
+                        # Stop the process so its late output is not
+                        # mistaken for the tree of the next sentence
+                        self._stop()
+                        self._emit_request(start, todo, 'timeout')
+                        n += 1
+                        yield ParseError('Parser process timed out after '
+                                         '{0}s'.format(self.timeout))
+                        break
+                    if tree is None:
+                        self._process.wait()
+                        self._emit_request(start, todo, 'connection')
+                        if crashed_at == n:
+                            n += 1
+                            crashed_at = n
+                            yield ParseError(
+                                'Parser process exited while parsing: ' +
+                                sentences[n - 1])
+                        else:
+                            crashed_at = n
+                        break
+                    n += 1
+                    restarts = 0
+                    yield tree
+                else:
+                    self._emit_request(start, todo, None)
+        finally:
+            if n < len(sentences):
+                self._stop()
+
+    def _emit_request(self, start, sentences, error):
+        if self.metrics is not None:
+            self._emit('request', server=self.command[0],
+                       seconds=time.perf_counter() - start,
+                       request_bytes=sum(len(sent) + 1 for sent in sentences),
+                       response_bytes=0, status=None, error=error)
+
+    def _make_tree(self, parse):
+        tree = parse_tree(parse)
+        if tree.label() == 'ROOT' or tree.label() == '':
+            tree = tree[0]
+        return tree
+
+    def _parse(self, sent):
+        sent = ' '.join(sent.split())
+        if not sent:
+            raise ParseError('Empty sentence')
+        result = self._request([sent])[0]
+        if isinstance(result, ParseError):
+            raise result
+        return self._make_tree(result)
+
+    def parse_batch(self, sentences):
+        """Returns tree objects from many sentences
+
+        All sentences are written to the process at once and their trees are
+        read back as the process writes them.
+
+        Args:
+            sentences (list): Sentences to be parsed into trees
+
+        Returns:
+            list: Tree object for each sentence, or the ParseError raised
+            while parsing it
+        """
+        results = [None] * len(sentences)
+        todo = []
+        for i, sent in enumerate(sentences):
+            sent = ' '.join(sent.split())
+            if not sent:
+                results[i] = ParseError('Empty sentence')
+                continue
+            if self.cache is not None:
+                tree = self.cache.get(self.cache.key(sent, self.cache_properties))
+                self._emit('cache', hit=tree is not None)
+                if tree is not None:
+                    results[i] = tree
+                    continue
+            todo.append((i, sent))
+
+        parses = self._request([sent for _, sent in todo])
+        for (i, sent), parse in zip(todo, parses):
+            if isinstance(parse, ParseError):
+                results[i] = parse
+                continue
+            try:
+                tree = self._make_tree(parse)
+            except ValueError as e:
+                results[i] = ParseError(str(e))
+                continue
+            results[i] = tree
+            if self.cache is not None:
+                self.cache.set(self.cache.key(sent, self.cache_properties), tree)
+        return results
+
+    def parse_all(self, text):
+        """Returns a tree for every line of a text
+
+        All lines are written to the process at once, iter_parse_all sends
+        them one at a time instead so the process is not held between trees.
+
+        Args:
+            text (str): Text with one sentence per line
+
+        Returns:
+            list: Tree objects of the sentences in order
+        Raises:
+            ParseError: If a sentence could not be parsed
+        """
+        trees = self.parse_batch(
+            [line for line in text.splitlines() if line.strip()])
+        for tree in trees:
+            if isinstance(tree, ParseError):
+                raise tree
+        return trees
+
+
+class StanfordProcessParser(ProcessParser):
+    """Stanford LexicalizedParser running in a single long lived JVM
+
+    Unlike StanfordLibParser, which starts Java and loads the model for every
+    sentence, the JVM is started and the model loaded once. The jars are
+    found like nltk's StanfordParser finds them (the STANFORD_PARSER and
+    STANFORD_MODELS environment variables).
+
+    Args:
+        model_path (str): Path of the parser model in the models jar
+        path_to_jar (str): Path of the parser jar (None to search for it)
+        path_to_models_jar (str): Path of the models jar (None to search for it)
+        java_options (str): Options of the JVM
+        cache (ParseCache): Cache of parsed trees (None to disable caching)
+        timeout (float): See ProcessParser
+        restarts (int): See ProcessParser
+        metrics: See Parser
+    """
+    def __init__(self,
+                 model_path='edu/stanford/nlp/models/lexparser/englishPCFG.ser.gz',
+                 path_to_jar=None, path_to_models_jar=None, java_options='-mx4g',
+                 cache=None, timeout=60, restarts=3, metrics=None):
+        from nltk import internals
+
+        finder = _stanford_parser_class()(
+            path_to_jar=path_to_jar, path_to_models_jar=path_to_models_jar,
+            model_path=model_path, java_options=java_options)
+        internals.config_java()
+        command = [internals._java_bin] + java_options.split() + [
+            '-cp', os.pathsep.join(finder._classpath),
+            'edu.stanford.nlp.parser.lexparser.LexicalizedParser',
+            '-model', model_path,
+            '-sentences', 'newline',
+            '-outputFormat', 'penn',
+            '-encoding', 'utf-8',
+            '-']
+        ProcessParser.__init__(self, command, cache, timeout, restarts,
+                               metrics=metrics)
+        self.model_path = model_path
+
+    @property
+    def cache_properties(self):
+        return {'parser': type(self).__name__, 'model': self.model_path}
+
+
+class ParserPool(Parser):
+    """Spreads parses across many Stanford CoreNLP servers
+
+    Each parse goes to the server with the fewest requests in flight. A server
+    that is down or times out is ejected for eject_time seconds and the parse
+    is retried on another server. A server that returns an error page instead
+    of JSON is only ejected if it does not answer a ping either, otherwise the
+    sentence is at fault and gets an empty tree like with
+    StanfordServerParser. The last server that is not ejected is never
+    ejected by a failed parse. Ejected servers are re-admitted after
+    eject_time, or by check_health which can also run in the background
+    every health_interval seconds.
+
+    Args:
+        endpoints (list): (host, port) pairs or StanfordServerParsers
+        properties (dict): CoreNLP annotation properties for (host, port) pairs
+        cache (ParseCache): Cache of parsed trees (None to disable caching)
+        eject_time (float): Seconds a failing server is not used for
+        health_interval (float): Seconds between background health checks
+            (None to disable)
+        timeout (float): Request timeout of the servers given as (host, port)
+            pairs (see StanfordServerParser)
+        metrics: See Parser, also used by the servers given as (host, port)
+            pairs
+    """
+    def __init__(self, endpoints, properties={}, cache=None, eject_time=30,
+                 health_interval=None, timeout=None, metrics=None):
+        Parser.__init__(self, cache, metrics)
+        self.parsers = []
+        for endpoint in endpoints:
+            if not isinstance(endpoint, Parser):
+                host, port = endpoint
+                endpoint = StanfordServerParser(
+                    host, port, properties, timeout=timeout, metrics=metrics)
+            self.parsers.append(endpoint)
+        if not self.parsers:
+            raise ValueError('ParserPool needs at least one endpoint')
+        self.eject_time = eject_time
+        self.outstanding = [0] * len(self.parsers)
+        self.ejected_until = [0.0] * len(self.parsers)
+        self._next = 0
+        self._lock = threading.Lock()
+
+        self._stop = threading.Event()
+        if health_interval:
+            thread = threading.Thread(
+                target=self._health_loop, args=(health_interval,))
+            thread.daemon = True
+            thread.start()
+
+    @property
+    def cache_properties(self):
+        return self.parsers[0].cache_properties
+
+    def _acquire(self, tried):
+        with self._lock:
+            now = time.time()
+            n = len(self.parsers)
+            candidates = [i for i in range(n)
+                          if i not in tried and self.ejected_until[i] <= now]
+            if not candidates:
+                return None
+            start = self._next
+            self._next = (self._next + 1) % n
+            i = min(candidates,
+                    key=lambda i: (self.outstanding[i], (i - start) % n))
+            self.outstanding[i] += 1
+            return i
+
+    def _release(self, i, ok):
+        """Releases server i, ejecting it if not ok and others are healthy
+
+        Returns:
+            bool: If the server was ejected
+        """
+        with self._lock:
+            self.outstanding[i] -= 1
+            if ok:
+                return False
+            now = time.time()
+            if all(self.ejected_until[j] > now
+                   for j in range(len(self.parsers)) if j != i):
+                return False
+            self.ejected_until[i] = now + self.eject_time
+            return True
+
+    @staticmethod
+    def _ping(parser):
+        """Returns True if the server of parser answers a tokenize request"""
+        try:
+            parser._annotate('ping', {'annotators': 'tokenize',
+                                      'outputFormat': 'json'})
+        except ParseError:
+            return False
+        return True
+
+    def _call(self, fun):
+        """Calls fun with the least loaded healthy server parser
+
+        Raises:
+            ServerUnavailableError: If every server failed or is ejected
+            ParseError: If a server that answers pings failed on the input
+        """
+        tried = set()
+        error = ServerUnavailableError('All CoreNLP servers are ejected')
+        while True:
+            i = self._acquire(tried)
+            if i is None:
+                raise error
+            if tried:
+                self._emit('retry', server=self._server(i))
+            tried.add(i)
+            ok = True
+            try:
+                return fun(self.parsers[i])
+            except ServerUnavailableError as e:
+                ok = False
+                error = e
+            except ParseError as e:
+                # An error page is usually caused by the input, so another
+                # server would fail on it too
+                ok = self._ping(self.parsers[i])
+                if ok:
+                    raise
+                error = e
+            finally:
+                # Other exceptions are not the server's fault, so they are
+                # raised without ejecting it
+                ejected = self._release(i, ok)
+            if ejected:
+                self._emit('eject', server=self._server(i))
+
+    def _server(self, i):
+        return getattr(self.parsers[i], 'url', str(i))
+
+    def _parse(self, sent):
+        try:
+            return self._call(lambda parser: parser._sentence_tree(
+                parser._annotate(sent)['sentences'][0]))
+        except ServerUnavailableError:
+            raise
+        except ParseError:
+            # Got random html, return empty tree
+            return tree_class()('', [])
+
+    def iter_parse_all(self, text):
+        """See StanfordServerParser.iter_parse_all"""
+        parser, output = self._call(
+            lambda parser: (parser, parser._annotate(text)))
+        for sentence in output['sentences']:
+            yield parser._sentence_tree(sentence)
+
+    def parse_document(self, text):
+        """Same as parse_all"""
+        return self.parse_all(text)
+
+    def check_health(self):
+        """Checks every server, ejecting failing ones and re-admitting healthy ones
+
+        Returns:
+            list: True for every healthy server
+        """
+        healthy = []
+        for i, parser in enumerate(self.parsers):
+            ok = self._ping(parser)
+            with self._lock:
+                self.ejected_until[i] = 0.0 if ok else time.time() + self.eject_time
+            healthy.append(ok)
+        return healthy
 
-        # Got random html, return empty tree
-        if isinstance(output, str):
-            return Tree('', [])
+    def _health_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.check_health()
 
-        parse_output = output['sentences'][0]['parse'] + '\n\n'
-        tree = next(next(self._parse_trees_output(parse_output)))[0]
-        return tree
\ No newline at end of file
+    def close(self):
+        """Stops the background health checks"""
+        self._stop.set()
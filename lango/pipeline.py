@@ -0,0 +1,281 @@
+"""
+Pipelines overlapping the parsing and matching of a stream of sentences.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import inspect
+import time
+
+from lango.matcher import compile_rules, match_rules
+
+
+class PipelineResult:
+    """Result of a sentence passed through a Pipeline
+
+    Attributes:
+        index (int): Position of the sentence in the input
+        sentence (str): Sentence
+        tree (Tree): Parsed tree (None if parsing failed)
+        result: Result of match_rules (None if nothing matched or on error)
+        error (Exception): Exception raised by parsing or matching, else None
+        parse_seconds (float): Time spent parsing
+        match_seconds (float): Time spent matching
+        seconds (float): Time from reading the sentence to its result being
+            ready, including the time spent waiting for free workers
+    """
+
+    def __init__(self, index, sentence):
+        self.index = index
+        self.sentence = sentence
+        self.tree = None
+        self.result = None
+        self.error = None
+        self.parse_seconds = 0.0
+        self.match_seconds = 0.0
+        self.seconds = 0.0
+        self._start = time.perf_counter()
+
+    def _done(self):
+        self.seconds = time.perf_counter() - self._start
+
+    def __repr__(self):
+        return 'PipelineResult({0}, {1!r}, result={2!r}, error={3!r})'.format(
+            self.index, self.sentence, self.result, self.error)
+
+
+# Matching arguments of the worker processes, set by _init_worker
+_worker_args = None
+
+
+def _init_worker(rules, fun, multi, engine):
+    global _worker_args
+    _worker_args = (rules, fun, multi, engine)
+
+
+def _match_in_worker(tree):
+    return _match(tree, *_worker_args)
+
+
+def _match(tree, rules, fun, multi, engine):
+    """Returns (result of match_rules, seconds spent matching)"""
+    start = time.perf_counter()
+    result = match_rules(tree, rules, fun, multi=multi, engine=engine)
+    return result, time.perf_counter() - start
+
+
+class Pipeline:
+    """Parses and matches a stream of sentences with both stages overlapping
+
+    Sentences are parsed by up to parse_workers threads while the trees
+    already parsed are matched on a pool of match_workers, so the matcher
+    does not wait for the parser and the parser does not wait for the
+    matcher. At most max_pending sentences are in flight: the input is only
+    read further once the oldest result was taken, so a slow stage holds back
+    the input instead of buffering it. Results are yielded in the order of
+    the input::
+
+        pipeline = Pipeline(StanfordServerParser(), rules, fun)
+        for res in pipeline.run(sentences):
+            print(res.sentence, res.result, res.parse_seconds, res.match_seconds)
+
+    With an AsyncStanfordServerParser or an async stream of sentences use
+    run_async instead. A sentence that fails to parse or match does not stop
+    the pipeline, its result has the exception as error.
+
+    Matching is CPU bound, so with processes=True it runs on a pool of
+    processes instead of threads. The compiled rules and fun are sent once
+    to every process, fun must then be picklable (a module level function)
+    and so must the trees.
+
+    Args:
+        parser (Parser): Parser of sentences, or an AsyncStanfordServerParser
+            for run_async
+        rules (dict): Query rules or compiled rules (see match_rules)
+        fun (function): See match_rules
+        multi (Bool): See match_rules
+        engine (str): See match_rules
+        parse_workers (int): Maximum number of sentences parsed at once
+        match_workers (int): Number of matching workers
+        max_pending (int): Maximum number of sentences in flight (None for
+            twice the number of workers)
+        processes (Bool): If True, matches on a pool of processes
+    """
+
+    def __init__(self, parser, rules, fun=None, multi=False, engine='index',
+                 parse_workers=4, match_workers=1, max_pending=None,
+                 processes=False):
+        self.parser = parser
+        self.rules = compile_rules(rules)
+        self.fun = fun
+        self.multi = multi
+        self.engine = engine
+        self.parse_workers = parse_workers
+        self.match_workers = match_workers
+        if max_pending is None:
+            max_pending = 2 * (parse_workers + match_workers)
+        self.max_pending = max_pending
+        self.processes = processes
+        self._parse_executor = None
+        self._match_executor = None
+
+    def _executors(self):
+        if self._parse_executor is None:
+            self._parse_executor = ThreadPoolExecutor(self.parse_workers)
+        if self._match_executor is None:
+            if self.processes:
+                self._match_executor = ProcessPoolExecutor(
+                    self.match_workers, initializer=_init_worker,
+                    initargs=(self.rules, self.fun, self.multi, self.engine))
+            else:
+                self._match_executor = ThreadPoolExecutor(self.match_workers)
+        return self._parse_executor, self._match_executor
+
+    def _submit_match(self, executor, tree):
+        if self.processes:
+            return executor.submit(_match_in_worker, tree)
+        return executor.submit(
+            _match, tree, self.rules, self.fun, self.multi, self.engine)
+
+    def close(self):
+        """Shuts down the worker pools"""
+        for executor in (self._parse_executor, self._match_executor):
+            if executor is not None:
+                executor.shutdown()
+        self._parse_executor = None
+        self._match_executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _parse(self, sent):
+        """Returns (tree, seconds spent parsing)"""
+        start = time.perf_counter()
+        tree = self.parser.parse(sent)
+        return tree, time.perf_counter() - start
+
+    def run(self, sentences):
+        """Parses and matches sentences
+
+        Args:
+            sentences (iterable): Sentences (str)
+        Yields:
+            PipelineResult of every sentence in order
+        """
+        parse_executor, match_executor = self._executors()
+        pending = deque()
+
+        def submit(index, sent):
+            res = PipelineResult(index, sent)
+            done = Future()
+
+            def matched(future):
+                try:
+                    res.result, res.match_seconds = future.result()
+                except Exception as e:
+                    res.error = e
+                res._done()
+                done.set_result(res)
+
+            def parsed(future):
+                try:
+                    res.tree, res.parse_seconds = future.result()
+                    self._submit_match(
+                        match_executor, res.tree).add_done_callback(matched)
+                except Exception as e:
+                    res.error = e
+                    res._done()
+                    done.set_result(res)
+
+            parse_executor.submit(self._parse, sent).add_done_callback(parsed)
+            return done
+
+        for index, sent in enumerate(sentences):
+            if len(pending) >= self.max_pending:
+                yield pending.popleft().result()
+            pending.append(submit(index, sent))
+        while pending:
+            yield pending.popleft().result()
+
+    async def run_async(self, sentences):
+        """Parses and matches sentences in an event loop
+
+        The parser is awaited if its parse method is a coroutine function
+        (AsyncStanfordServerParser), else it runs on the parse threads. The
+        input is read by a separate task, so results are yielded as soon as
+        they are ready even while the stream waits for its next sentence.
+
+        Args:
+            sentences (iterable): Sentences (str) or an async iterable of
+                sentences
+        Yields:
+            PipelineResult of every sentence in order
+        """
+        parse_executor, match_executor = self._executors()
+        loop = asyncio.get_running_loop()
+        is_async = inspect.iscoroutinefunction(self.parser.parse)
+        parse_slots = asyncio.Semaphore(self.parse_workers)
+        # The producer waits for a slot when max_pending sentences are in flight
+        slots = asyncio.Semaphore(self.max_pending)
+        pending = asyncio.Queue()
+
+        async def process(res):
+            try:
+                async with parse_slots:
+                    start = time.perf_counter()
+                    if is_async:
+                        res.tree = await self.parser.parse(res.sentence)
+                    else:
+                        res.tree = await loop.run_in_executor(
+                            parse_executor, self.parser.parse, res.sentence)
+                    res.parse_seconds = time.perf_counter() - start
+                res.result, res.match_seconds = await asyncio.wrap_future(
+                    self._submit_match(match_executor, res.tree))
+            except Exception as e:
+                res.error = e
+            res._done()
+            return res
+
+        async def submit(index, sent):
+            await slots.acquire()
+            pending.put_nowait(loop.create_task(
+                process(PipelineResult(index, sent))))
+
+        async def produce():
+            index = 0
+            if hasattr(sentences, '__aiter__'):
+                async for sent in sentences:
+                    await submit(index, sent)
+                    index += 1
+            else:
+                for sent in sentences:
+                    await submit(index, sent)
+                    index += 1
+            pending.put_nowait(None)
+
+        producer = loop.create_task(produce())
+        try:
+            while True:
+                get = loop.create_task(pending.get())
+                await asyncio.wait([get, producer],
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not get.done():
+                    # The producer failed before putting the end of input
+                    get.cancel()
+                    producer.result()
+                task = get.result()
+                if task is None:
+                    break
+                res = await task
+                slots.release()
+                yield res
+            await producer
+        finally:
+            producer.cancel()
+            while not pending.empty():
+                task = pending.get_nowait()
+                if task is not None:
+                    task.cancel()
@@ -0,0 +1,406 @@
+"""
+Compact array backed parse trees.
+
+nltk is only imported when nltk Trees are built (see tree_class), so trees can
+be parsed into CompactTrees and matched without it.
+"""
+from array import array
+import sys
+
+_Tree = None
+
+
+def tree_class():
+    """Returns nltk.Tree, importing nltk on first use"""
+    global _Tree
+    if _Tree is None:
+        from nltk import Tree
+        _Tree = Tree
+    return _Tree
+
+
+class CompactTree:
+    """Parse tree stored as flat arrays in preorder
+
+    Nodes are numbered in preorder. Node i has the label ``labels[label_ids[i]]``
+    and its children are ``children[child_start[i]:child_start[i + 1]]``, where
+    a child ``c >= 0`` is node c and ``c < 0`` is the leaf ``leaves[~c]``. The
+    leaves of node i are ``leaves[leaf_start[i]:leaf_end[i]]`` and its subtree
+    ends before node ``end[i]``. Labels and leaves are interned strings.
+
+    A CompactTree behaves like its root node (see CompactNode), so it can be
+    matched directly::
+
+        compact = CompactTree.from_tree(tree)
+        match_rules(compact, rules)
+    """
+    __slots__ = ('labels', 'label_ids', 'child_start', 'children', 'leaves',
+                 'leaf_start', 'leaf_end', 'end')
+
+    def __init__(self, labels, label_ids, child_start, children, leaves,
+                 leaf_start, leaf_end, end):
+        self.labels = labels
+        self.label_ids = label_ids
+        self.child_start = child_start
+        self.children = children
+        self.leaves = leaves
+        self.leaf_start = leaf_start
+        self.leaf_end = leaf_end
+        self.end = end
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Converts a Tree into a CompactTree
+
+        Args:
+            tree (Tree): Parsed tree structure
+        Returns:
+            CompactTree
+        """
+        builder = CompactTreeBuilder()
+        stack = [(tree, False)]
+        while stack:
+            node, closing = stack.pop()
+            if closing:
+                builder.close()
+            elif not isinstance(node, str):
+                builder.open(node.label())
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(node))
+            else:
+                builder.leaf(node)
+        return builder.build()
+
+    def to_tree(self, i=0):
+        """Converts the subtree of node i back into a Tree
+
+        Args:
+            i (int): Node id (0 for the whole tree)
+        Returns:
+            Tree
+        """
+        return self._to_tree(i, tree_class())
+
+    def _to_tree(self, i, Tree):
+        children = []
+        for c in self.children[self.child_start[i]:self.child_start[i + 1]]:
+            if c < 0:
+                children.append(self.leaves[~c])
+            else:
+                children.append(self._to_tree(c, Tree))
+        return Tree(self.labels[self.label_ids[i]], children)
+
+    def node(self, i):
+        """Returns the CompactNode of node i
+
+        Nodes are created on every access and not kept with the tree, so a
+        matched tree takes no more memory than before. Nodes of the same tree
+        and id are equal.
+        """
+        return CompactNode(self, i)
+
+    @property
+    def root(self):
+        return self.node(0)
+
+    def label(self):
+        return self.labels[self.label_ids[0]]
+
+    def __len__(self):
+        return self.child_start[1] - self.child_start[0]
+
+    def __getitem__(self, k):
+        return self.root[k]
+
+    def __iter__(self):
+        return iter(self.root)
+
+    def raw(self):
+        return self.root.raw()
+
+    def object(self):
+        return self.root.object()
+
+    def __getstate__(self):
+        return (self.labels, self.label_ids, self.child_start, self.children,
+                self.leaves, self.leaf_start, self.leaf_end, self.end)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return 'CompactTree({0!r})'.format(str(self.to_tree()))
+
+
+class CompactNode:
+    """Node of a CompactTree with the read-only interface of a Tree
+
+    Supports label(), len(), indexing and iteration over children, which are
+    CompactNodes or leaf strings. raw() and object() give the same strings as
+    lango.matcher.get_raw and get_object without building intermediate strings.
+    """
+    __slots__ = ('tree', 'i')
+
+    def __init__(self, tree, i):
+        self.tree = tree
+        self.i = i
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactNode):
+            return NotImplemented
+        return self.tree is other.tree and self.i == other.i
+
+    def __hash__(self):
+        return hash((id(self.tree), self.i))
+
+    def label(self):
+        return self.tree.labels[self.tree.label_ids[self.i]]
+
+    def __len__(self):
+        child_start = self.tree.child_start
+        return child_start[self.i + 1] - child_start[self.i]
+
+    def __getitem__(self, k):
+        tree = self.tree
+        start = tree.child_start[self.i]
+        n = tree.child_start[self.i + 1] - start
+        if k < 0:
+            k += n
+        if not 0 <= k < n:
+            raise IndexError('child index out of range')
+        c = tree.children[start + k]
+        if c < 0:
+            return tree.leaves[~c]
+        return tree.node(c)
+
+    def __iter__(self):
+        tree = self.tree
+        leaves = tree.leaves
+        node = tree.node
+        for c in tree.children[tree.child_start[self.i]:tree.child_start[self.i + 1]]:
+            yield leaves[~c] if c < 0 else node(c)
+
+    def raw(self):
+        """Same as get_raw"""
+        tree = self.tree
+        return ' '.join(tree.leaves[tree.leaf_start[self.i]:tree.leaf_end[self.i]])
+
+    def object(self):
+        """Same as get_object"""
+        tree = self.tree
+        labels, label_ids, end = tree.labels, tree.label_ids, tree.end
+        leaf_start, leaf_end = tree.leaf_start, tree.leaf_end
+        words = []
+        pos = leaf_start[self.i]
+        j = self.i
+        while j < end[self.i]:
+            label = labels[label_ids[j]]
+            if label == 'DT' or label == 'POS':
+                words.extend(tree.leaves[pos:leaf_start[j]])
+                pos = leaf_end[j]
+                j = end[j]
+            else:
+                j += 1
+        words.extend(tree.leaves[pos:leaf_end[self.i]])
+        return ' '.join([_f for _f in words if _f])
+
+    def to_tree(self):
+        return self.tree.to_tree(self.i)
+
+    def __repr__(self):
+        return 'CompactNode({0!r})'.format(str(self.to_tree()))
+
+
+class CompactTreeBuilder:
+    """Builds a CompactTree from open / leaf / close events in preorder"""
+
+    def __init__(self):
+        self.labels = []
+        self._label_index = {}
+        self.label_ids = array('H')
+        self.leaves = []
+        self.leaf_start = array('I')
+        self.leaf_end = array('I')
+        self.end = array('I')
+        self._children = []
+        self._open = []
+
+    def open(self, label):
+        """Starts a node"""
+        i = len(self.label_ids)
+        if i and not self._open:
+            raise ValueError('Bracket mismatch in tree')
+        label_id = self._label_index.get(label)
+        if label_id is None:
+            label_id = self._label_index[label] = len(self.labels)
+            self.labels.append(sys.intern(label))
+        self.label_ids.append(label_id)
+        self.leaf_start.append(len(self.leaves))
+        self.leaf_end.append(0)
+        self.end.append(0)
+        self._children.append([])
+        if self._open:
+            self._children[self._open[-1]].append(i)
+        self._open.append(i)
+
+    def leaf(self, word):
+        """Adds a leaf to the current node"""
+        if not self._open:
+            raise ValueError('Word outside of a tree: ' + word)
+        self._children[self._open[-1]].append(~len(self.leaves))
+        self.leaves.append(sys.intern(word))
+
+    def close(self):
+        """Ends the current node"""
+        if not self._open:
+            raise ValueError('Bracket mismatch in tree')
+        i = self._open.pop()
+        self.leaf_end[i] = len(self.leaves)
+        self.end[i] = len(self.label_ids)
+
+    def build(self):
+        """Returns the CompactTree of the nodes added so far"""
+        if self._open or not self.label_ids:
+            raise ValueError('Incomplete tree')
+        child_start = array('I')
+        children = array('i')
+        for node_children in self._children:
+            child_start.append(len(children))
+            children.extend(node_children)
+        child_start.append(len(children))
+        return CompactTree(tuple(self.labels), self.label_ids, child_start,
+                           children, tuple(self.leaves), self.leaf_start,
+                           self.leaf_end, self.end)
+
+
+def _tokenize(s):
+    return s.replace('(', ' ( ').replace(')', ' ) ').split()
+
+
+def _strip_root(tokens, start, end):
+    """Returns the token span of the only child of a ROOT or unlabeled root"""
+    if end - start < 4 or tokens[start] != '(':
+        return start, end
+    if tokens[start + 1] == 'ROOT':
+        child = start + 2
+    elif tokens[start + 1] == '(':
+        child = start + 1
+    else:
+        return start, end
+    if tokens[child] != '(':
+        return start, end
+    depth = 0
+    for i in range(child, end):
+        token = tokens[i]
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth == 0:
+                if i + 2 == end:
+                    return child, i + 1
+                return start, end
+    return start, end
+
+
+def _build(tokens, start, end, compact):
+    if compact:
+        builder = CompactTreeBuilder()
+        i = start
+        while i < end:
+            token = tokens[i]
+            if token == '(':
+                label = tokens[i + 1]
+                if label == '(' or label == ')':
+                    builder.open('')
+                else:
+                    builder.open(label)
+                    i += 1
+            elif token == ')':
+                builder.close()
+            else:
+                builder.leaf(token)
+            i += 1
+        return builder.build()
+
+    Tree = tree_class()
+    stack = [(None, [])]
+    i = start
+    while i < end:
+        token = tokens[i]
+        if token == '(':
+            label = tokens[i + 1]
+            if label == '(' or label == ')':
+                label = ''
+            else:
+                i += 1
+            stack.append((label, []))
+        elif token == ')':
+            label, children = stack.pop()
+            if not stack:
+                raise ValueError('Bracket mismatch in tree')
+            stack[-1][1].append(Tree(label, children))
+        else:
+            stack[-1][1].append(token)
+        i += 1
+    if len(stack) != 1 or len(stack[0][1]) != 1:
+        raise ValueError('Bracket mismatch in tree')
+    return stack[0][1][0]
+
+
+def parse_tree(s, compact=False, strip_root=False):
+    """Parses a bracketed tree string in a single pass
+
+    Gives the same tree as ``Tree.fromstring`` for the output of the Stanford
+    parsers, without its regular expressions.
+
+    Args:
+        s (str): Bracketed tree. Example: "(ROOT (S (NP (NNP Sam)) ...))"
+        compact (Bool): If True, returns a CompactTree instead of a Tree
+        strip_root (Bool): If True, removes a ROOT (or unlabeled) root node
+            with a single child
+    Returns:
+        Tree or CompactTree
+    Raises:
+        ValueError: If the brackets do not match
+    """
+    tokens = _tokenize(s)
+    start, end = 0, len(tokens)
+    if strip_root:
+        start, end = _strip_root(tokens, start, end)
+    if not tokens or tokens[start] != '(' or tokens[end - 1] != ')':
+        raise ValueError('Not a bracketed tree: ' + s[:100])
+    return _build(tokens, start, end, compact)
+
+
+def iter_parse_trees(s, compact=False, strip_root=False):
+    """Parses every bracketed tree in a string
+
+    Args:
+        s (str): Bracketed trees separated by any whitespace
+        compact (Bool): See parse_tree
+        strip_root (Bool): See parse_tree
+    Yields:
+        Tree or CompactTree for each tree in order
+    """
+    tokens = _tokenize(s)
+    depth = 0
+    start = 0
+    for i, token in enumerate(tokens):
+        if token == '(':
+            if depth == 0:
+                start = i
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth == 0:
+                span = (start, i + 1)
+                if strip_root:
+                    span = _strip_root(tokens, start, i + 1)
+                yield _build(tokens, span[0], span[1], compact)
+            elif depth < 0:
+                raise ValueError('Bracket mismatch in trees')
+        elif depth == 0:
+            raise ValueError('Word outside of a tree: ' + token)
+    if depth:
+        raise ValueError('Bracket mismatch in trees')
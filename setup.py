@@ -12,6 +12,6 @@ setup(
     scripts=[],
     install_requires=[
         'nltk',
-        'pycorenlp'
+        'requests'
     ],
 )
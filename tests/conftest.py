@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# The stub CoreNLP server and parser process live with the benchmarks
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'benchmarks')
+sys.path.insert(0, BENCHMARKS)
+
+from stub_server import StubCoreNLPServer
+
+
+@pytest.fixture
+def stub_server():
+    server = StubCoreNLPServer(error_word='html').start()
+    yield server
+    server.stop()
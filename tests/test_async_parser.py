@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from lango.async_parser import AsyncStanfordServerParser
+from lango.parser import ParseError, ServerUnavailableError
+from lango.trees import parse_tree
+
+from stub_server import StubCoreNLPServer
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_parse(stub_server):
+    parser = AsyncStanfordServerParser(port=stub_server.port)
+
+    async def parse():
+        try:
+            return await parser.parse('Call me an Uber .')
+        finally:
+            parser.close()
+
+    tree = run(parse())
+    assert tree == parse_tree(
+        '(S (VP (VB Call) (S (NP (PRP me)) (NP (DT an) (NNP Uber)))) (. .))')
+
+
+def test_parse_many_returns_errors(stub_server):
+    parser = AsyncStanfordServerParser(port=stub_server.port, concurrency=2)
+
+    async def parse_many():
+        try:
+            return await parser.parse_many(
+                ['Call me an Uber .', 'send html please', 'Hello there'])
+        finally:
+            parser.close()
+
+    trees = run(parse_many())
+    assert trees[0].label() == 'S'
+    assert isinstance(trees[1], ParseError)
+    assert trees[2] == parse_tree('(S (NN Hello) (NN there))')
+
+
+def test_timeout_then_recovers():
+    server = StubCoreNLPServer(delay=0.5).start()
+    parser = AsyncStanfordServerParser(port=server.port, timeout=0.1)
+
+    async def parse():
+        try:
+            with pytest.raises(ServerUnavailableError):
+                await parser.parse('Hello there')
+            server.delay = 0
+            return await parser.parse('Hello there')
+        finally:
+            parser.close()
+
+    try:
+        assert run(parse()) == parse_tree('(S (NN Hello) (NN there))')
+    finally:
+        server.stop()
+
+
+def test_connection_refused():
+    parser = AsyncStanfordServerParser(port=1)
+    with pytest.raises(ServerUnavailableError):
+        run(parser.parse('Hello there'))
+
+
+def test_reuses_stale_keep_alive_connection():
+    server = StubCoreNLPServer(drop_connections=True).start()
+    parser = AsyncStanfordServerParser(port=server.port, concurrency=1)
+
+    async def parse_twice():
+        try:
+            first = await parser.parse('Hello there')
+            # The idle connection was closed by the server in the meantime
+            await asyncio.sleep(0.05)
+            assert len(parser._pool._idle) == 1
+            second = await parser.parse('Hello again')
+            return first, second
+        finally:
+            parser.close()
+
+    try:
+        first, second = run(parse_twice())
+    finally:
+        server.stop()
+    assert first == parse_tree('(S (NN Hello) (NN there))')
+    assert second == parse_tree('(S (NN Hello) (NN again))')
+    assert server.requests == 2
+
+
+def test_parse_in_new_event_loops(stub_server):
+    parser = AsyncStanfordServerParser(port=stub_server.port)
+    expected = parse_tree('(S (NN Hello) (NN there))')
+    # The first loop is closed with an idle connection left in the pool
+    assert run(parser.parse('Hello there')) == expected
+    assert run(parser.parse('Hello there')) == expected
+    assert run(parser.parse_many(['Hello there'])) == [expected]
+    parser.close()
@@ -0,0 +1,75 @@
+import warnings
+
+import pytest
+
+from lango.matcher import bind_action, match_rules
+from lango.trees import parse_tree
+
+TREE = parse_tree('(S (NP (PRP I)) (VP (VBD ran) (PP (TO to) (NP (NN school)))))')
+
+RULES = {
+    '( S ( NP:np ) ( VP ( VBD:verb-o ) ( PP:pp ) ) )': {
+        'np': {'( NP:subject-o )': {}},
+        'pp': {'( PP ( TO ) ( NP:place-o ) )': {}, '( PP:place-o )': {}},
+    },
+    '( S ( NP:subject-o ) ( VP:verb-o ) )': {},
+    '( S:other-o )': {},
+}
+
+
+def bind(fun, rules=RULES, strict=False):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        action = bind_action(fun, rules, strict)
+    return action, [str(warning.message) for warning in caught]
+
+
+def test_parameters_from_nested_rules():
+    def action(subject, verb, place):
+        return subject, verb, place
+
+    bound, messages = bind(action, {
+        template: child_rules for template, child_rules in RULES.items()
+        if 'pp' in child_rules})
+    assert messages == []
+    assert bound.params == ('subject', 'verb', 'place')
+    assert match_rules(TREE, RULES, bound) == ('i', 'ran', 'school')
+
+
+def test_unsatisfiable_template_warns():
+    def action(subject, place):
+        return subject, place
+
+    bound, messages = bind(action)
+    assert bound.unsatisfied == [('( S ( NP:subject-o ) ( VP:verb-o ) )', ['place']),
+                                 ('( S:other-o )', ['place', 'subject'])]
+    assert len(messages) == 2
+    assert "never captures place of action" in messages[0]
+
+
+def test_unsatisfiable_template_raises_when_strict():
+    def action(subject, place):
+        return subject, place
+
+    with pytest.raises(ValueError) as info:
+        bind(action, strict=True)
+    assert '( S ( NP:subject-o ) ( VP:verb-o ) )' in str(info.value)
+
+
+def test_defaults_and_kwargs():
+    def action(subject, place=None, *args, mood='x', **kwargs):
+        return subject, place, mood, kwargs
+
+    rules = {template: child_rules for template, child_rules in RULES.items()
+             if 'other' not in template}
+    bound, messages = bind(action, rules)
+    assert messages == []
+    assert bound.params == ('subject', 'place', 'mood')
+    assert bound.required == frozenset(['subject'])
+    # Only named parameters are passed, not every capture
+    assert match_rules(TREE, rules, bound) == ('i', 'school', 'x', {})
+    assert match_rules(TREE, rules, bound, multi=True) == [
+        ('i', 'school', 'x', {}), ('i', 'to school', 'x', {}),
+        ('i', None, 'x', {})]
+    assert (match_rules(TREE, rules, bound, multi=True) ==
+            match_rules(TREE, rules, action, multi=True))
@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+from lango.corpus import TreebankReader, decode_tree, encode_tree, match_corpus
+from lango.matcher import match_rules
+from lango.trees import CompactNode, parse_tree
+
+from common import load_trees, matching_rules
+
+PARSES = [
+    '(ROOT (S (NP (PRP I)) (VP (VBD ran))))',
+    '(ROOT (S (NN Hello) (NN there)))',
+]
+
+
+def write_corpus(tmp_path):
+    path = str(tmp_path / 'parses.txt')
+    with open(path, 'w') as f:
+        f.write('\n\n'.join(PARSES) + '\n')
+    return path
+
+
+def test_saves_index(tmp_path):
+    path = write_corpus(tmp_path)
+    with TreebankReader(path) as reader:
+        assert list(reader) == [parse_tree(parse)[0] for parse in PARSES]
+    assert os.path.exists(path + '.idx')
+    with TreebankReader(path) as reader:
+        assert reader._index is not None
+        assert reader[1] == parse_tree(PARSES[1])[0]
+
+
+def test_unwritable_index_is_kept_in_memory(tmp_path):
+    path = write_corpus(tmp_path)
+    # A directory cannot be written as a file, like a read-only corpus
+    index_path = str(tmp_path / 'index')
+    os.mkdir(index_path)
+    with TreebankReader(path, index_path=index_path) as reader:
+        assert len(list(reader)) == 2
+        assert len(reader) == 2
+        assert reader[0] == parse_tree(PARSES[0])[0]
+    assert os.path.isdir(index_path)
+
+
+def test_json_documents(tmp_path):
+    path = str(tmp_path / 'parses.json')
+    with open(path, 'w') as f:
+        for parses in (PARSES, PARSES[::-1] + PARSES):
+            json.dump({'sentences': [{'parse': parse} for parse in parses]}, f,
+                      indent=2)
+            f.write('\n')
+    expected = [parse_tree(parse)[0] for parse in PARSES + PARSES[::-1] + PARSES]
+    with TreebankReader(path) as reader:
+        assert list(reader) == expected
+    with TreebankReader(path) as reader:
+        assert reader._index is not None
+        assert list(reader) == expected
+        assert [reader[i] for i in (4, 0, 3, -1)] == [
+            expected[4], expected[0], expected[3], expected[-1]]
+
+
+def action(action=None, subject=None, item=None):
+    return (action, subject, item)
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_match_corpus(workers):
+    trees = load_trees()
+    expected = [match_rules(tree, matching_rules, action) for tree in trees]
+    assert list(match_corpus(trees, matching_rules, action, workers=workers,
+                             chunksize=4)) == expected
+    unordered = match_corpus(iter(trees), matching_rules, action,
+                             workers=workers, chunksize=4, ordered=False)
+    assert sorted(unordered, key=lambda pair: pair[0]) == list(enumerate(expected))
+
+
+def test_match_corpus_decodes_compact_trees():
+    tree = parse_tree(PARSES[1])[0]
+    assert decode_tree(encode_tree(tree)).to_tree() == tree
+    context, = match_corpus([tree], {'( S ( NN:n ) ( NN:x-o ) )': {}},
+                            workers=0)
+    assert isinstance(context['n'], CompactNode)
+    assert context['n'].to_tree() == tree[0]
+    assert context['x'] == 'there'
@@ -0,0 +1,133 @@
+import pickle
+
+import pytest
+
+from lango.matcher import (compile_rules, get_tokens, iter_match_rules,
+                           match_rules, match_tokens)
+from lango.trees import parse_tree
+
+from common import (command_rules, load_trees, matching_rules,
+                    multimatch_rules)
+
+# Rules using wildcards, alternatives, end anchors and every capture mode
+wildcard_rules = {
+    '( S ( NP:np ) ( VP ( VBD:action-o ) ( PP:pp ) ) )': {
+        'np': {'( NP:subject-o )': {}},
+        'pp': {
+            '( PP ( TO=to ) ( NP:to_object-o ) )': {},
+            '( PP ( IN=from ) ( NP:from_object-o ) )': {},
+        },
+    },
+    '( S ( NP ) $ )': {},
+    '( . ( NP:x-r ) ( . ) $ )': {},
+    '( S/SBARQ:all-R )': {},
+    '( . ( VP=call|get ( VB:v ) ) )': {},
+}
+
+nested_rules = {
+    '( S:x ( NP:a ) ( VP:b ) )': {
+        'a': {'( NP:x-r )': {}, '( .:y-o )': {}, '( NP:z-R )': {}},
+        'b': {
+            '( VP:x-O ( VBD:y-r ) )': {},
+            '( VP:z ( . ) ( PP:pp ) )': {
+                'pp': {'( PP:x-r )': {}, '( PP ( .:q-o ) )': {}},
+            },
+        },
+    },
+    '( . ( . ) ( VP:c ) )': {
+        'c': {'( VP ( . ) ( PP:x ) )': {'x': {'( PP:x-o )': {}}}},
+    },
+}
+
+RULES = [matching_rules, multimatch_rules, command_rules(40), wildcard_rules,
+         nested_rules]
+
+
+def reference_context(tree, rules, parent_context):
+    """First matching context, matching every template with match_tokens"""
+    for template, child_rules in rules.items():
+        context = parent_context.copy()
+        if match_tokens(tree, get_tokens(template.split()), context):
+            for key, rules in child_rules.items():
+                child_context = reference_context(context[key], rules, context)
+                if not child_context:
+                    return None
+                context.update(child_context)
+            return context
+    return None
+
+
+def reference_contexts(tree, rules, parent_context):
+    """All matching contexts, matching every template with match_tokens"""
+    contexts = []
+    for template, child_rules in rules.items():
+        context = parent_context.copy()
+        if not match_tokens(tree, get_tokens(template.split()), context):
+            continue
+        if not child_rules:
+            contexts.append(context)
+            continue
+        product = [{}]
+        for key, rules in child_rules.items():
+            product = [dict(child, **other)
+                       for child in reference_contexts(context[key], rules, context)
+                       for other in product]
+        contexts += product
+    return contexts
+
+
+def action(subject=None, relation=None, item=None, action=None, x=None,
+           to_object=None, from_object=None, all=None):
+    return (subject, relation, item, action, x, to_object, from_object, all)
+
+
+@pytest.fixture(scope='module', params=[False, True], ids=['nltk', 'compact'])
+def trees(request):
+    return load_trees(compact=request.param)
+
+
+@pytest.mark.parametrize('engine', ['index', 'trie'])
+@pytest.mark.parametrize('rules', RULES)
+def test_same_results_as_match_tokens(trees, rules, engine):
+    compiled = compile_rules(rules)
+    reloaded = pickle.loads(pickle.dumps(compiled))
+    for tree in trees:
+        first = reference_context(tree, rules, {})
+        every = reference_contexts(tree, rules, {})
+        for rules_ in (rules, compiled, reloaded):
+            assert match_rules(tree, rules_, engine=engine) == (first or None)
+            assert match_rules(tree, rules_, multi=True, engine=engine) == every
+            assert list(iter_match_rules(tree, rules_, engine=engine)) == every
+            # Actions only take some of the captures
+            assert match_rules(tree, rules_, action, engine=engine) == (
+                action(**{k: v for k, v in first.items()
+                          if k in action.__code__.co_varnames})
+                if first else None)
+            assert match_rules(tree, rules_, action, multi=True,
+                               engine=engine) == [
+                action(**{k: v for k, v in context.items()
+                          if k in action.__code__.co_varnames})
+                for context in every]
+
+
+def test_shared_sub_rules_are_compiled_once():
+    compiled = compile_rules(command_rules(40))
+    children = [child_rules['subj_t'] for _, child_rules in compiled.items()
+                if 'subj_t' in child_rules]
+    assert len(children) > 1
+    assert all(child is children[0] for child in children)
+
+
+def test_rules_changed_in_place_are_seen():
+    tree = parse_tree('(S (NP (NN cats)) (VP (VBZ sleep)))')
+    np_rules = {'( NP:x-o )': {}}
+    rules = {'( S ( NP:np ) ( VP ) )': {'np': np_rules}}
+    assert match_rules(tree, rules) == {'np': tree[0], 'x': 'cats'}
+    np_rules['( NP ( NN:y-o ) )'] = {}
+    assert match_rules(tree, rules, multi=True) == [
+        {'np': tree[0], 'x': 'cats'}, {'np': tree[0], 'y': 'cats'}]
+    del np_rules['( NP:x-o )']
+    assert match_rules(tree, rules) == {'np': tree[0], 'y': 'cats'}
+    rules['( S:all-o )'] = {}
+    del rules['( S ( NP:np ) ( VP ) )']
+    assert match_rules(tree, rules) == {'all': 'cats sleep'}
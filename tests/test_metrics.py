@@ -0,0 +1,177 @@
+import pytest
+
+from lango.matcher import match_rules
+from lango.metrics import MatchStats, ParseMetrics
+from lango.parser import (ParseCache, ServerUnavailableError,
+                          StanfordServerParser)
+from lango.trees import parse_tree
+
+from stub_server import StubCoreNLPServer
+
+TREE = parse_tree('(S (NP (NN cats)) (VP (VBZ sleep)))')
+
+RULES = {
+    '( S ( VP ) )': {},
+    '( S ( NP ) ( NP ) )': {},
+    '( S ( NP:np ) )': {'np': {'( NP:x-o )': {}, '( NP ( NN:y-o ) )': {}}},
+    '( S:all-o )': {},
+}
+
+
+def counts(stats):
+    return {template: (tried, matched)
+            for template, (tried, matched, _, _) in stats.templates.items()}
+
+
+def test_index_engine_counts():
+    stats = MatchStats()
+    for _ in range(2):
+        match_rules(TREE, RULES, stats=stats)
+    # '( S ( VP ) )' is not a candidate for an S whose first child is an NP,
+    # and matching stops at the first full match
+    assert counts(stats) == {
+        '( S ( NP ) ( NP ) )': (2, 0),
+        '( S ( NP:np ) )': (2, 2),
+        '( NP:x-o )': (2, 2),
+    }
+    assert all(nodes > 0 for _, _, nodes, _ in stats.templates.values())
+    assert stats.walks == [0, 0, 0.0]
+
+    stats.reset()
+    match_rules(TREE, RULES, multi=True, stats=stats)
+    assert counts(stats) == {
+        '( S ( NP ) ( NP ) )': (1, 0),
+        '( S ( NP:np ) )': (1, 1),
+        '( NP:x-o )': (1, 1),
+        '( NP ( NN:y-o ) )': (1, 1),
+        '( S:all-o )': (1, 1),
+    }
+
+
+def test_trie_engine_counts():
+    stats = MatchStats()
+    for _ in range(2):
+        match_rules(TREE, RULES, engine='trie', stats=stats)
+    # The trie walks every template at once, so each one is tried
+    assert counts(stats) == {
+        '( S ( VP ) )': (2, 0),
+        '( S ( NP ) ( NP ) )': (2, 0),
+        '( S ( NP:np ) )': (2, 2),
+        '( S:all-o )': (2, 2),
+        '( NP:x-o )': (2, 2),
+        '( NP ( NN:y-o ) )': (2, 2),
+    }
+    walks, nodes, seconds = stats.walks
+    assert walks == 4
+    assert nodes > 0 and seconds > 0
+
+    stats.reset()
+    assert stats.templates == {}
+    assert stats.walks == [0, 0, 0.0]
+
+
+def test_to_dict():
+    stats = MatchStats()
+    match_rules(TREE, RULES, engine='trie', stats=stats)
+    data = stats.to_dict()
+    assert data['templates']['( S ( NP:np ) )']['tried'] == 1
+    assert data['templates']['( S ( NP:np ) )']['matched'] == 1
+    assert data['templates']['( S ( VP ) )']['matched'] == 0
+    assert data['trie']['walks'] == 2
+
+
+def test_match_stats_prometheus():
+    stats = MatchStats()
+    match_rules(TREE, RULES, stats=stats)
+    lines = stats.to_prometheus().splitlines()
+    assert '# TYPE lango_match_tried_total counter' in lines
+    assert 'lango_match_tried_total{template="( S ( NP ) ( NP ) )"} 1' in lines
+    assert 'lango_match_matched_total{template="( S ( NP ) ( NP ) )"} 0' in lines
+    assert 'lango_match_matched_total{template="( NP:x-o )"} 1' in lines
+    assert 'lango_match_nodes_total{template="( S ( NP:np ) )"} 2' in lines
+    assert 'lango_match_trie_walks_total 0' in lines
+
+    lines = stats.to_prometheus('app').splitlines()
+    assert 'app_tried_total{template="( S ( NP:np ) )"} 1' in lines
+
+
+def test_parse_metrics(stub_server):
+    events = []
+    metrics = ParseMetrics()
+    parser = StanfordServerParser(
+        port=stub_server.port, cache=ParseCache(),
+        metrics=lambda event: (events.append(event), metrics(event)))
+    parser.parse('cats sleep')
+    parser.parse('cats sleep')
+    assert not parser.parse('an html page')
+
+    assert [event['event'] for event in events] == [
+        'cache', 'request', 'parse',
+        'cache', 'parse',
+        'cache', 'request', 'parse']
+    assert all(event['parser'] == 'StanfordServerParser' for event in events)
+    assert [event['hit'] for event in events if event['event'] == 'cache'] == [
+        False, True, False]
+    requests = [event for event in events if event['event'] == 'request']
+    assert [event['error'] for event in requests] == [None, 'html']
+    assert [event['status'] for event in requests] == [200, 500]
+    assert all(event['server'] == parser.url for event in requests)
+    assert requests[0]['request_bytes'] == len('cats sleep')
+    assert [event['empty'] for event in events if event['event'] == 'parse'] == [
+        False, False, True]
+
+    data = metrics.to_dict()
+    assert data['parse_seconds']['StanfordServerParser']['count'] == 3
+    assert data['request_seconds'][parser.url]['count'] == 2
+    assert data['cache_hits_total'] == {'parser=StanfordServerParser': 1}
+    assert data['cache_misses_total'] == {'parser=StanfordServerParser': 2}
+    assert data['empty_parses_total'] == {'parser=StanfordServerParser': 1}
+    assert data['request_errors_total'] == {
+        'server={0},error=html'.format(parser.url): 1}
+    assert data['request_bytes_total'] == {
+        'server=' + parser.url: len('cats sleep') + len('an html page')}
+
+
+def test_parse_metrics_retries():
+    server = StubCoreNLPServer(delay=1).start()
+    metrics = ParseMetrics()
+    try:
+        parser = StanfordServerParser(port=server.port, timeout=0.1, retries=2,
+                                      metrics=metrics)
+        with pytest.raises(ServerUnavailableError):
+            parser.parse('too slow')
+    finally:
+        server.stop()
+
+    data = metrics.to_dict()
+    assert data['request_seconds'][parser.url]['count'] == 3
+    assert data['retries_total'] == {'server=' + parser.url: 2}
+    assert data['request_errors_total'] == {
+        'server={0},error=timeout'.format(parser.url): 3}
+    assert data['parse_errors_total'] == {
+        'parser=StanfordServerParser,error=ServerUnavailableError': 1}
+
+
+def test_parse_metrics_prometheus(stub_server):
+    metrics = ParseMetrics(buckets=(0.5, 30))
+    parser = StanfordServerParser(port=stub_server.port, cache=ParseCache(),
+                                  metrics=metrics)
+    parser.parse('cats sleep')
+    parser.parse('cats sleep')
+    lines = metrics.to_prometheus().splitlines()
+    assert '# TYPE lango_parse_seconds histogram' in lines
+    assert ('lango_parse_seconds_bucket'
+            '{parser="StanfordServerParser",le="30"} 2') in lines
+    assert ('lango_parse_seconds_bucket'
+            '{parser="StanfordServerParser",le="+Inf"} 2') in lines
+    assert 'lango_parse_seconds_count{parser="StanfordServerParser"} 2' in lines
+    assert ('lango_parse_request_seconds_count'
+            '{{server="{0}"}} 1'.format(parser.url)) in lines
+    assert '# TYPE lango_parse_cache_hits_total counter' in lines
+    assert ('lango_parse_cache_hits_total'
+            '{parser="StanfordServerParser"} 1') in lines
+    assert ('lango_parse_cache_misses_total'
+            '{parser="StanfordServerParser"} 1') in lines
+
+    metrics.reset()
+    assert metrics.to_dict() == {'parse_seconds': {}, 'request_seconds': {}}
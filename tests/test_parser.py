@@ -0,0 +1,102 @@
+import time
+
+from lango.parser import (ParseCache, ParseError, ServerUnavailableError,
+                          SqliteParseStore, StanfordServerParser)
+from lango.trees import parse_tree
+
+from stub_server import StubCoreNLPServer
+
+
+def test_parse_batch_falls_back_on_bad_sentence(stub_server):
+    parser = StanfordServerParser(port=stub_server.port, batch_size=2)
+    trees = parser.parse_batch(['Hello there', 'send html', 'Hi', ''])
+    assert trees[0] == parse_tree('(S (NN Hello) (NN there))')
+    assert isinstance(trees[1], ParseError)
+    assert trees[2] == parse_tree('(S (NN Hi))')
+    assert isinstance(trees[3], ParseError)
+
+
+def test_parse_batch_stops_when_server_is_down():
+    server = StubCoreNLPServer(delay=1).start()
+    try:
+        parser = StanfordServerParser(port=server.port, batch_size=2,
+                                      timeout=0.1, retries=1)
+        trees = parser.parse_batch(['one', 'two', 'three', 'four', 'five'])
+        assert all(isinstance(tree, ServerUnavailableError) for tree in trees)
+        # The first batch and its retry, no request per sentence
+        assert server.requests == 2
+    finally:
+        server.stop()
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ParseCache(maxsize=2)
+    trees = [parse_tree('(S (NN {0}))'.format(word)) for word in 'abc']
+    cache.set('a', trees[0])
+    cache.set('b', trees[1])
+    assert cache.get('a') is trees[0]
+    cache.set('c', trees[2])
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') is trees[0]
+    assert cache.get('c') is trees[2]
+    assert (cache.hits, cache.misses) == (3, 1)
+    cache.clear()
+    assert (len(cache), cache.hits, cache.misses) == (0, 0, 0)
+
+
+def test_cache_key_normalizes_whitespace():
+    assert ParseCache.key(' Hello   there ', {'a': 1}) == \
+        ParseCache.key('Hello there', {'a': 1})
+    assert ParseCache.key('Hello there', {'a': 1}) != \
+        ParseCache.key('Hello there', {'a': 2})
+
+
+def test_cache_expires_trees():
+    cache = ParseCache(ttl=0.05)
+    cache.set('a', parse_tree('(S (NN a))'))
+    assert cache.get('a') is not None
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_store_hit_in_fresh_cache(tmp_path):
+    path = str(tmp_path / 'parses.db')
+    tree = parse_tree('(S (NP (PRP I)) (VP (VBD ran)))')
+    store = SqliteParseStore(path)
+    ParseCache(store=store).set('key', tree)
+    store.close()
+
+    store = SqliteParseStore(path)
+    cache = ParseCache(store=store)
+    assert cache.get('key') == tree
+    assert len(cache) == 1
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert cache.get('other') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    store.close()
+
+
+def test_store_expires_trees(tmp_path):
+    store = SqliteParseStore(str(tmp_path / 'parses.db'))
+    store.set('old', '(S (NN old))', time.time() - 100)
+    store.set('new', '(S (NN new))', time.time())
+    cache = ParseCache(ttl=10, store=store)
+    assert cache.get('old') is None
+    assert cache.get('new') == parse_tree('(S (NN new))')
+    store.close()
+
+
+def test_empty_trees_are_not_cached(stub_server, tmp_path):
+    store = SqliteParseStore(str(tmp_path / 'parses.db'))
+    cache = ParseCache(store=store)
+    parser = StanfordServerParser(port=stub_server.port, cache=cache)
+    assert not parser.parse('send html')
+    assert len(cache) == 0
+    assert store.get(cache.key('send html', parser.cache_properties)) is None
+    assert parser.parse('Hello there')
+    assert parser.parse('Hello there')
+    assert stub_server.requests == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+    store.close()
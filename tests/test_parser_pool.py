@@ -0,0 +1,48 @@
+import pytest
+
+from lango.parser import ParserPool, ServerUnavailableError
+from lango.trees import parse_tree
+
+from stub_server import StubCoreNLPServer
+
+
+@pytest.fixture
+def servers():
+    servers = [StubCoreNLPServer(error_word='html').start() for _ in range(2)]
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+def test_releases_server_on_other_errors(servers):
+    pool = ParserPool([('localhost', server.port) for server in servers])
+    for _ in range(3):
+        # No sentence in the output
+        with pytest.raises(IndexError):
+            pool.parse('   ')
+    assert pool.outstanding == [0, 0]
+    assert pool.ejected_until == [0.0, 0.0]
+
+
+def test_ejects_unreachable_server(servers):
+    pool = ParserPool([('localhost', 1), ('localhost', servers[0].port)])
+    assert pool.parse('Hello there') == parse_tree('(S (NN Hello) (NN there))')
+    assert pool.outstanding == [0, 0]
+    assert pool.ejected_until[0] > 0
+    assert pool.ejected_until[1] == 0
+
+
+def test_error_page_does_not_eject_healthy_servers(servers):
+    pool = ParserPool([('localhost', server.port) for server in servers])
+    assert not pool.parse('please send html')
+    assert pool.ejected_until == [0.0, 0.0]
+    assert pool.parse('Hello there') == parse_tree('(S (NN Hello) (NN there))')
+
+
+def test_does_not_eject_last_server(servers):
+    pool = ParserPool([('localhost', 1), ('localhost', servers[0].port)])
+    servers[0].stop()
+    with pytest.raises(ServerUnavailableError):
+        pool.parse('Hello there')
+    assert pool.ejected_until[0] > 0
+    assert pool.ejected_until[1] == 0
@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+
+from lango.parser import ParseError, Parser
+from lango.pipeline import Pipeline
+from lango.trees import parse_tree
+
+RULES = {'( S ( NN:first-o ) )': {}}
+
+
+def first(first=None):
+    return first
+
+
+class WordParser(Parser):
+    """Parses a sentence into a flat tree of nouns, failing on 'fail'"""
+
+    def __init__(self, delay=0):
+        Parser.__init__(self)
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def _parse(self, sent):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            # Later sentences finish first, so results come out of order
+            time.sleep(self.delay / (1 + len(sent)))
+            if 'fail' in sent.split():
+                raise ParseError('Could not parse ' + sent)
+            return parse_tree('(S {0})'.format(' '.join(
+                '(NN {0})'.format(word) for word in sent.split())))
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+class AsyncWordParser:
+
+    def __init__(self):
+        self.parser = WordParser()
+
+    async def parse(self, sent):
+        await asyncio.sleep(0.001)
+        return self.parser.parse(sent)
+
+
+SENTENCES = ['word{0} more words'.format(i) for i in range(20)]
+EXPECTED = ['word{0}'.format(i) for i in range(20)]
+
+
+def test_results_in_order():
+    with Pipeline(WordParser(delay=0.01), RULES, first, parse_workers=4) as pipeline:
+        results = list(pipeline.run(SENTENCES))
+    assert [res.index for res in results] == list(range(20))
+    assert [res.sentence for res in results] == SENTENCES
+    assert [res.result for res in results] == EXPECTED
+    assert all(res.error is None and res.seconds >= res.parse_seconds
+               for res in results)
+
+
+def test_errors_do_not_stop_the_pipeline():
+    sentences = ['a b', 'please fail', 'c', ')']
+    with Pipeline(WordParser(), RULES, first) as pipeline:
+        results = list(pipeline.run(sentences))
+    assert [res.result for res in results] == ['a', None, 'c', None]
+    assert isinstance(results[1].error, ParseError)
+    assert results[1].tree is None
+    assert results[3].error is not None
+    assert results[0].error is None and results[2].error is None
+
+
+def test_caps_sentences_in_flight():
+    read = []
+
+    def sentences():
+        for sent in SENTENCES:
+            read.append(sent)
+            yield sent
+
+    parser = WordParser(delay=0.01)
+    with Pipeline(parser, RULES, first, parse_workers=2,
+                  max_pending=3) as pipeline:
+        for res in pipeline.run(sentences()):
+            # The result taken, plus at most max_pending read after it
+            assert len(read) <= res.index + 1 + 3
+    assert parser.max_running <= 2
+
+
+def test_async_generator_input():
+    async def sentences():
+        for sent in SENTENCES:
+            await asyncio.sleep(0.001)
+            yield sent
+
+    async def run(parser):
+        with Pipeline(parser, RULES, first) as pipeline:
+            return [res async for res in pipeline.run_async(sentences())]
+
+    for parser in (AsyncWordParser(), WordParser()):
+        results = asyncio.run(run(parser))
+        assert [res.result for res in results] == EXPECTED
+
+
+def test_async_errors():
+    async def run():
+        with Pipeline(AsyncWordParser(), RULES, first) as pipeline:
+            return [res async for res in pipeline.run_async(['a', 'fail', 'b'])]
+
+    results = asyncio.run(run())
+    assert [res.result for res in results] == ['a', None, 'b']
+    assert isinstance(results[1].error, ParseError)
+
+
+def test_match_in_processes():
+    with Pipeline(WordParser(), RULES, first, match_workers=2,
+                  processes=True) as pipeline:
+        results = list(pipeline.run(SENTENCES))
+    assert [res.result for res in results] == EXPECTED
+    assert all(res.match_seconds > 0 for res in results)
@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from lango.parser import ParseError, ProcessParser
+from lango.trees import parse_tree
+
+STUB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    'benchmarks', 'stub_lexparser.py')
+
+
+def make_parser(*args, **kwargs):
+    return ProcessParser([sys.executable, STUB] + list(args), **kwargs)
+
+
+def tree(sent):
+    return parse_tree('(S {0})'.format(' '.join(
+        '(NN {0})'.format(word) for word in sent.split())))
+
+
+@pytest.fixture
+def crashing_parser():
+    parser = make_parser('--exit-on', 'crash')
+    yield parser
+    parser.close()
+
+
+def test_crash_mid_batch(crashing_parser):
+    sents = ['one two', 'three crash', 'four five', 'six']
+    results = crashing_parser.parse_batch(sents)
+    assert results[0] == tree('one two')
+    assert isinstance(results[1], ParseError)
+    assert results[2] == tree('four five')
+    assert results[3] == tree('six')
+    # Started, restarted to retry the sentence, restarted after it failed
+    assert crashing_parser.starts == 3
+
+
+def test_crash_again_on_same_sentence(crashing_parser):
+    for _ in range(2):
+        with pytest.raises(ParseError):
+            crashing_parser.parse('it will crash')
+        assert crashing_parser.parse('then recover') == tree('then recover')
+
+
+def test_every_sentence_crashing(crashing_parser):
+    results = crashing_parser.parse_batch(['crash one', 'crash two', 'ok'])
+    assert [type(result) for result in results[:2]] == [ParseError] * 2
+    assert results[2] == tree('ok')
+
+
+def test_timeout_then_recovers():
+    parser = make_parser('--delay', '0.5', timeout=0.1)
+    try:
+        with pytest.raises(ParseError):
+            parser.parse('too slow')
+        parser.timeout = 10
+        # The late tree of the first sentence is not taken for this one
+        assert parser.parse('in time') == tree('in time')
+    finally:
+        parser.close()
+
+
+def test_abandoned_generator_does_not_hold_the_process(crashing_parser):
+    trees = crashing_parser.iter_parse_all('one\ntwo\nthree')
+    assert next(trees) == tree('one')
+
+    results = []
+    thread = threading.Thread(
+        target=lambda: results.append(crashing_parser.parse('other call')))
+    thread.start()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert results == [tree('other call')]
+
+    assert next(trees) == tree('two')
+    del trees
+    assert crashing_parser.parse('next call') == tree('next call')
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from lango.matcher import (RULES_FORMAT, RULES_VERSION, RuleError,
+                           compile_rules, dump_rules, load_rules, match_rules,
+                           rules_checksum, save_rules)
+
+from common import command_rules, load_trees, matching_rules, multimatch_rules
+
+RULES = dict(command_rules(40), **multimatch_rules)
+
+
+def action(action=None, subject=None, item=None, subj=None, obj=None):
+    return (action, subject, item, subj, obj)
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'rules.json')
+    save_rules(RULES, path)
+    loaded = load_rules(path, RULES)
+    assert [template.template for template in loaded] == list(RULES)
+    assert rules_checksum(loaded) == rules_checksum(RULES)
+    for tree in load_trees():
+        for engine in ('index', 'trie'):
+            assert (match_rules(tree, loaded, action, engine=engine) ==
+                    match_rules(tree, RULES, action))
+            assert (match_rules(tree, loaded, multi=True, engine=engine) ==
+                    match_rules(tree, RULES, multi=True))
+
+
+def test_dump_is_json_and_shares_tables():
+    data = json.loads(json.dumps(dump_rules(RULES)))
+    assert (data['format'], data['version']) == (RULES_FORMAT, RULES_VERSION)
+    # Nested rules shared by many templates are stored once
+    assert len(data['rules']['tables']) < len(RULES)
+    loaded = load_rules(data)
+    assert rules_checksum(loaded) == data['checksum']
+    assert rules_checksum(compile_rules(RULES)) == data['checksum']
+
+
+@pytest.mark.parametrize('field, value', [
+    ('format', 'other-rules'), ('version', RULES_VERSION + 1), ('format', None)])
+def test_rejects_unknown_format_or_version(field, value):
+    data = dump_rules(matching_rules)
+    if value is None:
+        del data[field]
+    else:
+        data[field] = value
+    with pytest.raises(RuleError):
+        load_rules(data)
+
+
+def test_rejects_checksum_mismatch(tmp_path):
+    path = str(tmp_path / 'rules.json')
+    save_rules(matching_rules, path)
+    assert load_rules(path, matching_rules)
+    with pytest.raises(RuleError):
+        load_rules(path, multimatch_rules)
+    changed = dict(matching_rules)
+    changed['( S:all )'] = {}
+    with pytest.raises(RuleError):
+        load_rules(path, changed)
+
+
+def test_rejects_unknown_label_option():
+    data = dump_rules({'( S:s-o )': {}})
+    data['rules']['templates'][0][1][3] = 'x'
+    with pytest.raises(RuleError):
+        load_rules(data)
@@ -0,0 +1,101 @@
+import pickle
+import random
+
+import pytest
+
+from lango.matcher import RuleSet, compile_rules, match_rules
+
+from common import (command_rules, load_trees, matching_rules,
+                    multimatch_rules)
+
+TREES = load_trees()
+
+POOL = {}
+for rules in (command_rules(60), multimatch_rules, matching_rules):
+    POOL.update(rules)
+POOL = sorted(POOL.items())
+
+
+def action(action=None, subject=None, item=None, subj=None, obj=None):
+    return (action, subject, item, subj, obj)
+
+
+def edit(rng, rule_set, rules):
+    """Applies a random edit to rule_set and returns the expected rules"""
+    items = list(rules.items())
+    templates = [template for template, _ in items]
+    op = rng.choice(['add', 'remove', 'replace', 'move', 'update'])
+    if op == 'add' or not items:
+        template, child_rules = rng.choice(POOL)
+        if template in rules:
+            return rules
+        before = rng.choice(templates + [None]) if items else None
+        rule_set.add(template, child_rules, before)
+        i = len(items) if before is None else templates.index(before)
+        items.insert(i, (template, child_rules))
+    elif op == 'remove':
+        template = rng.choice(templates)
+        rule_set.remove(template)
+        del items[templates.index(template)]
+    elif op == 'replace':
+        template = rng.choice(templates)
+        new_template, child_rules = rng.choice(POOL)
+        if new_template in rules:
+            # Keep the template, and maybe its child rules
+            new_template = None
+            if rng.random() < 0.5:
+                child_rules = None
+        rule_set.replace(template, new_template, child_rules)
+        i = templates.index(template)
+        items[i] = (new_template or template,
+                    items[i][1] if child_rules is None else child_rules)
+    elif op == 'move':
+        rng.shuffle(items)
+        rule_set.update(dict(items))
+    else:
+        items = rng.sample(POOL, 15)
+        rule_set.update(dict(items))
+    return dict(items)
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_edits_match_like_compiled_rules(seed):
+    rng = random.Random(seed)
+    rules = dict(rng.sample(POOL, 15))
+    rule_set = RuleSet(rules)
+    for _ in range(6):
+        rules = edit(rng, rule_set, rules)
+        assert [template.template for template in rule_set] == list(rules)
+        compiled = compile_rules(rules)
+        for tree in TREES:
+            for engine in ('index', 'trie'):
+                assert (match_rules(tree, rule_set, action, engine=engine) ==
+                        match_rules(tree, compiled, action, engine=engine))
+                assert (match_rules(tree, rule_set, multi=True, engine=engine) ==
+                        match_rules(tree, compiled, multi=True, engine=engine))
+
+    reloaded = pickle.loads(pickle.dumps(rule_set))
+    assert type(reloaded) is RuleSet
+    assert [template.template for template in reloaded] == list(rules)
+
+
+@pytest.mark.parametrize('multi', [False, True])
+@pytest.mark.parametrize('engine', ['index', 'trie'])
+@pytest.mark.parametrize('seed', range(4))
+def test_rematch_reports_changed_results(seed, engine, multi):
+    rng = random.Random(seed)
+    rules = dict(rng.sample(POOL, 15))
+    rule_set = RuleSet(rules)
+    fun = action if seed % 2 else None
+    corpus = rule_set.track(TREES, fun, multi, engine)
+    for _ in range(8):
+        rules = edit(rng, rule_set, rules)
+        if rng.random() < 0.3:
+            # Let edits pile up before the next rematch
+            continue
+        old = list(corpus.results)
+        changes = corpus.rematch()
+        expected = [match_rules(tree, rules, fun, multi=multi) for tree in TREES]
+        assert corpus.results == expected
+        assert changes == [(i, old[i], expected[i])
+                           for i in range(len(TREES)) if old[i] != expected[i]]
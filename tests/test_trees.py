@@ -0,0 +1,130 @@
+import gc
+import tracemalloc
+
+import pytest
+from nltk import Tree
+
+from lango.matcher import compile_rules, match_rules
+from lango.trees import CompactTree, iter_parse_trees, parse_tree
+
+from common import TREES_PATH, load_trees, matching_rules, multimatch_rules
+
+RULES = compile_rules(dict(matching_rules, **multimatch_rules))
+
+
+def strings(action=None, subject=None, relation=None, item=None, subj=None,
+            obj=None, prop=None, qtype=None):
+    return (action, subject, relation, item, subj, obj, prop, qtype)
+
+EDGE_CASES = [
+    '((S (NN a)))',
+    '( (S (NN a)) )',
+    '(S (NP ) (VP (VB go)))',
+    '()',
+    '(ROOT (S (NN a)) (S (NN b)))',
+    '(S (NN a b))',
+    '(S (-LRB- -LRB-) (NN x) (. ?))',
+    '(S\n  (NN  a)\n)',
+]
+
+MISMATCHED = ['(S (NN a)', '(S (NN a)))', 'S (NN a)', '(S (NN a)) x', '']
+
+
+def read_trees():
+    with open(TREES_PATH) as f:
+        return [line for line in f.read().split('\n') if line.strip()]
+
+
+def stripped(tree):
+    if tree.label() in ('ROOT', '') and len(tree) == 1 and isinstance(
+            tree[0], Tree):
+        return tree[0]
+    return tree
+
+
+@pytest.mark.parametrize('compact', [False, True], ids=['nltk', 'compact'])
+def test_parse_tree_same_as_fromstring(compact):
+    lines = read_trees() + EDGE_CASES
+    for s in lines:
+        for strip_root in (False, True):
+            expected = Tree.fromstring(s)
+            if strip_root:
+                expected = stripped(expected)
+            tree = parse_tree(s, compact=compact, strip_root=strip_root)
+            if compact:
+                assert isinstance(tree, CompactTree)
+                tree = tree.to_tree()
+            assert tree == expected
+
+    for strip_root in (False, True):
+        trees = iter_parse_trees('\n'.join(lines), compact=compact,
+                                 strip_root=strip_root)
+        if compact:
+            trees = [tree.to_tree() for tree in trees]
+        expected = [Tree.fromstring(s) for s in lines]
+        if strip_root:
+            expected = [stripped(tree) for tree in expected]
+        assert list(trees) == expected
+
+
+def test_strip_root():
+    assert parse_tree('(ROOT (S (NN a)))', strip_root=True) == Tree(
+        'S', [Tree('NN', ['a'])])
+    assert parse_tree('((S (NN a)))', strip_root=True) == Tree(
+        'S', [Tree('NN', ['a'])])
+    # Only a ROOT with a single child is removed
+    assert parse_tree('(ROOT (S (NN a)) (S (NN b)))', strip_root=True).label() == (
+        'ROOT')
+    assert parse_tree('(S (NN a))', strip_root=True).label() == 'S'
+
+
+@pytest.mark.parametrize('s', MISMATCHED)
+def test_bracket_mismatch(s):
+    with pytest.raises(ValueError):
+        Tree.fromstring(s)
+    with pytest.raises(ValueError):
+        parse_tree(s)
+    with pytest.raises(ValueError):
+        parse_tree(s, compact=True)
+    if s:
+        with pytest.raises(ValueError):
+            list(iter_parse_trees(s))
+    else:
+        assert list(iter_parse_trees(s)) == []
+
+
+@pytest.mark.parametrize('compact', [False, True], ids=['nltk', 'compact'])
+def test_more_than_one_tree(compact):
+    s = '(S (NN a)) (S (NN b))'
+    with pytest.raises(ValueError):
+        Tree.fromstring(s)
+    with pytest.raises(ValueError):
+        parse_tree(s, compact=compact)
+    trees = list(iter_parse_trees(s, compact=compact))
+    if compact:
+        trees = [tree.to_tree() for tree in trees]
+    assert trees == [Tree.fromstring('(S (NN a))'), Tree.fromstring('(S (NN b))')]
+
+
+def test_compact_trees_match_like_trees():
+    for tree in load_trees():
+        compact = CompactTree.from_tree(tree)
+        assert compact.to_tree() == tree
+        assert compact[0] == compact[0]
+        assert (match_rules(compact, RULES, strings, multi=True) ==
+                match_rules(tree, RULES, strings, multi=True))
+
+
+def test_matching_does_not_grow_compact_trees():
+    for tree in load_trees(compact=True):
+        match_rules(tree, RULES, multi=True)
+    trees = load_trees(compact=True)
+    tracemalloc.start()
+    try:
+        for tree in trees:
+            match_rules(tree, RULES, multi=True)
+        gc.collect()
+        # The nodes created while matching are not kept with the trees
+        assert tracemalloc.get_traced_memory()[0] < 1000
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,94 @@
+import pytest
+
+from lango.matcher import RuleError, validate_rules
+
+
+def test_valid_rules():
+    rules = {
+        '( S ( NP:np ) ( VP:vp ) )': {
+            'np': {'( NP:subject-o )': {}},
+            # Keys captured by an enclosing template can be used further down
+            'vp': {'( VP ( VB:verb-o ) )': {'np': {'( NP ( PRP ) )': {}}}},
+        },
+    }
+    report = validate_rules(rules)
+    assert report
+    assert report.errors == [] and report.shadowed == []
+    assert report.labels[('( S ( NP:np ) ( VP:vp ) )',)] == \
+        frozenset(['S', 'NP', 'VP', 'VB', 'PRP'])
+
+
+def test_uncaptured_key():
+    report = validate_rules({'( S ( NP ) )': {'np': {'( NP )': {}}}})
+    assert not report
+    path, message = report.errors[0]
+    assert path == ('( S ( NP ) )', 'np')
+    assert 'not captured' in message
+
+
+def test_string_capture_used_as_key():
+    report = validate_rules({'( S ( NP:np-o ) )': {'np': {'( NP )': {}}}})
+    path, message = report.errors[0]
+    assert path == ('( S ( NP:np-o ) )', 'np')
+    assert 'captures a string' in message and '-o' in message
+
+
+def test_empty_sub_rules():
+    report = validate_rules({'( S ( NP:np ) )': {'np': {}}})
+    path, message = report.errors[0]
+    assert path == ('( S ( NP:np ) )', 'np')
+    assert 'no rules' in message
+
+
+@pytest.mark.parametrize('template', ['( S ( NP )', '(S (NP))', '( )',
+                                      '( S $ ( NP ) )'])
+def test_bad_template(template):
+    report = validate_rules({template: {}, '( S )': {}})
+    assert [path for path, _ in report.errors] == [(template,)]
+    assert ('( S )',) in report.labels
+
+
+def test_strict_raises_first_error():
+    with pytest.raises(RuleError) as info:
+        validate_rules({'( S ( NP:np ) )': {'np': {'( NP )': {'vp': {'( VP )': {}}}}}},
+                       strict=True)
+    assert 'vp' in str(info.value)
+    assert '( S ( NP:np ) ) -> np -> ( NP ) -> vp' in str(info.value)
+
+
+def shadows(first, second):
+    shadowed = validate_rules({first: {}, second: {}}).shadowed
+    assert shadowed in ([], [((second,), first)])
+    return bool(shadowed)
+
+
+@pytest.mark.parametrize('first, second', [
+    ('( S )', '( S ( NP ) )'),
+    ('( S:s ( NP:np ) )', '( S ( NP ) ( VP ) )'),
+    ('( . ( NP ) )', '( S ( NP ) )'),
+    ('( S ( . ) )', '( S ( NP ( PRP ) ) )'),
+    ('( S/SBARQ )', '( S )'),
+    ('( VB=call|get )', '( VB=call )'),
+    ('( VB )', '( VB=call )'),
+    ('( S ( NP ) )', '( S ( NP ) $ )'),
+    ('( S ( NP ) ( . ) $ )', '( S ( NP ) ( VP ) $ )'),
+])
+def test_shadowed(first, second):
+    assert shadows(first, second)
+
+
+@pytest.mark.parametrize('first, second', [
+    ('( S ( NP ) )', '( S )'),
+    ('( S ( NP ) )', '( . ( NP ) )'),
+    ('( S )', '( S/SBARQ )'),
+    ('( S ( NP ) )', '( SBARQ ( NP ) )'),
+    ('( VB=call )', '( VB=call|get )'),
+    ('( VB=call )', '( VB )'),
+    ('( S ( NP ) $ )', '( S ( NP ) )'),
+    ('( S ( NP ) $ )', '( S ( NP ) ( VP ) $ )'),
+    ('( S ( NP ) ( VP ) )', '( S ( NP ) $ )'),
+    # A token without children also matches a word
+    ('( S ( NP ) ( . ) )', '( S ( NP ) )'),
+])
+def test_not_shadowed(first, second):
+    assert not shadows(first, second)